@@ -1,5 +1,9 @@
 #! /usr/bin/env python3
 
+# Note when the process started, for the startup timing breakdown.
+import time
+STARTED = time.perf_counter()
+
 # Fix up python search path.
 from multiprocessing import connection
 import os.path
@@ -16,108 +20,226 @@ from discord.ext import commands
 from context import Context
 import logging
 import pymongo
-from typing import Union
+import signal
+from typing import Optional, Union
 
 import __about__
+import audit
+import backfill
 from bot import HeuristicAlgorithmic
+import cluster
 import configuration
+from database import AsyncDatabase
 import helper
+import logconfig
+import search
 
-def init_logging() -> logging.Logger:
+def init_logging(config: configuration.Configuration) -> logging.Logger:
     """Set up top-level logging for the bot."""
+    logconfig.start(config.globals.log_level,
+                    config.globals.log_format,
+                    config.globals.log_queue_size,
+                    config.globals.log_sample_rates,
+                    config.globals.log_rate_limits)
+
+    return logging.getLogger('hal')
+
+
+def init_database(config: configuration.Configuration) -> pymongo.MongoClient:
+    """Set up connection to the MongoDB back-end.
+
+    The client connects in the background; prepare_database confirms that it can."""
+    return pymongo.MongoClient(config.mongodb_connection(),
+                               maxPoolSize=config.mongodb_max_workers())
+
+
+def prepare_database(config: configuration.Configuration, connection: pymongo.MongoClient) -> pymongo.database.Database:
+    """Check the MongoDB back-end is available, and prepare the HAL database for use.
+
+    Blocking. Creates whatever is missing, and is safe to run from several cluster processes at once."""
+    # The ping command is cheap and does not require auth.
+    connection.admin.command('ping')
+
+    db = connection[config.mongodb_db_name()]
+
+    # Create the meta collection (creating an index creates its collection; an existing index is left be).
+    meta = db['meta']
+    meta.create_index ('name', unique=True)
+
+    # Write creation date, if this is a new database.
+    try:
+        meta.update_one ({'name' : 'created'}, {'$setOnInsert' : {'time' : discord.utils.utcnow()}}, upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        # Another cluster process created it first.
+        pass
+
+    # Create pin collection.
+    pin = db['pin']
+    pin.create_index ([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)],
+        unique = True)
+
+    # Create audit collection, with its search and retention indexes.
+    audit.prepare (db, config.globals.audit_retention_days)
+
+    # Create autopin backfill checkpoint collections.
+    backfill.prepare (db)
+
+    # Create message search collection, with its text and retention indexes.
+    if config.globals.search_enabled:
+        search.prepare (db, config.globals.search_retention_days)
+
+    # TODO: schemata/validation rules
+
+    # TODO: write default values?
+
+    # And return.
+    return db
 
-    log_handler = logging.StreamHandler()
-    log_handler.setFormatter (helper.ColorFormatter())
-    logger = logging.getLogger('hal')
-    logger.addHandler (log_handler)
-    logger.setLevel (logging.DEBUG)
 
-    return logger
+async def watch_database(logger: logging.Logger, bot: HeuristicAlgorithmic, ready: asyncio.Future) -> bool:
+    """Wait for the database to be prepared, shutting the bot down if it cannot be; returns whether it was."""
+    try:
+        await ready
+    except pymongo.errors.PyMongoError:
+        logger.critical ("mongodb back-end not available.", exc_info=True)
+        await bot.close()
+        return False
+
+    return True
+
+
+def stop_bot(logger: logging.Logger, bot: HeuristicAlgorithmic, signum: int) -> None:
+    """Signal handler: close the bot, which ends run_bot."""
+    logger.info ("received %s; shutting down", signal.Signals(signum).name)
+    asyncio.create_task(bot.close())
+
 
+async def run_bot(logger: logging.Logger, config: configuration.Configuration, connection: pymongo.MongoClient,
+                  startup: helper.StartupTimer, shard_ids: Optional[list] = None, shard_count: Optional[int] = None,
+                  cluster_id: Optional[int] = None) -> int:
+    """Run the bot until it is shut down; returns the exit code for the process."""
+    adb = AsyncDatabase(connection[config.mongodb_db_name()], max_workers=config.mongodb_max_workers())
 
-def init_database(logger: logging.Logger, config: configuration.Configuration) -> pymongo.MongoClient:
-    """Set up connection to the MongoDB back-end."""
-    connection = pymongo.MongoClient(config.mongodb_connection())
+    # Check and prepare the database while logging in to Discord; database calls made in the
+    # meantime wait until it is ready.
+    ready = adb.prepare(startup.timed('database', prepare_database, config, connection))
+    bot = None
+    watcher = None
+    prepared = True
 
     try:
-        # The ping command is cheap and does not require auth.
-        connection.admin.command('ping')
-    except pymongo.errors.ConnectionFailure:
-        logger.critical ("mongodb back-end not available.")
-        sys.exit(1)
+        bot = HeuristicAlgorithmic(logger, config, connection, adb, shard_ids=shard_ids, shard_count=shard_count, startup=startup,
+                                   cluster_id=cluster_id)
+        watcher = asyncio.create_task(watch_database(logger, bot, ready))
 
-    return connection
+        # Shut down cleanly, writing out whatever is queued, when asked to stop (by Docker, by
+        # the cluster launcher, or with Ctrl-C).
+        loop = asyncio.get_running_loop()
 
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop_bot, logger, bot, signum)
 
-def prepare_database(logger: logging.Logger, config: configuration.Configuration, connection: pymongo.MongoClient) -> pymongo.database.Database:
-    """Prepare the HAL database for use."""
-    db_name = config.mongodb_db_name()
+        try:
+            await bot.start(config.discord_secret())
+        except Exception:
+            # Being shut down part-way through logging in can make the login fail; if the
+            # database is why, that has already been reported.
+            if not watcher.done() or watcher.result():
+                raise
+    finally:
+        if watcher is not None:
+            if watcher.done():
+                prepared = watcher.result()
+            else:
+                watcher.cancel()
 
-    # Check if it exists.
-    dbs = connection.list_database_names()
-    if db_name in dbs:
-        # Return existing one.
-        return connection[db_name]
-    else:
-        # Create database.
-        db = connection.get_database(db_name)
+        # However the bot stopped, write out what it has queued; this waits for a close already under way.
+        if bot is not None:
+            await bot.close()
 
-        # Create meta collection.
-        meta = db.create_collection ('meta')
-        meta.create_index ('name', unique=True)
+        # Let any outstanding database calls finish before the connection goes away.
+        await asyncio.to_thread(adb.close)
 
-        # Write creation date.   
-        meta.insert_one ({'name' : 'created', 'time' : discord.utils.utcnow()})
+    return 0 if prepared else 1
 
-        # Create pin collection.
-        pin = db.create_collection ('pin')
-        pin.create_index ([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)],
-            unique = True)
 
-        # TODO: schemata/validation rules
+def run_cluster(cluster_id: int, shard_ids: list, shard_count: int):
+    """Entry point of a shard cluster process."""
+    startup = helper.StartupTimer(STARTED)
+    startup.record('imports', STARTED)
 
-        # TODO: write default values?
+    with startup.phase('configuration'):
+        config = configuration.Configuration()
 
-        # And return.
-        return db
+    with startup.phase('logging'):
+        logger = init_logging(config).getChild(f'cluster{cluster_id}')
 
+    logger.info ("cluster %d is starting up with shards %s", cluster_id, shard_ids)
+
+    # Each cluster has its own connection pool.
+    connection = init_database (config)
+    result = 0
+
+    try:
+        result = asyncio.run(run_bot(logger, config, connection, startup, shard_ids=shard_ids, shard_count=shard_count,
+                                     cluster_id=cluster_id))
+    except KeyboardInterrupt:
+        pass
+
+    logger.info ("cluster %d is stopping", cluster_id)
+    connection.close()
 
-async def run_bot(logger: logging.Logger, config: configuration.Configuration, connection: pymongo.MongoClient, db: pymongo.database.Database):
-    bot = HeuristicAlgorithmic(logger, config, connection, db)
-    await bot.start(config.discord_secret())
+    # Spawned processes skip atexit handlers, so write out the log queue here.
+    logconfig.stop()
+    sys.exit(result)
 
 
 def entrypoint():
     """Entry point of the application."""
-    # Initialize logging
-    logger = init_logging()
+    startup = helper.StartupTimer(STARTED)
+    startup.record('imports', STARTED)
 
     # Load configuration.
-    config = configuration.Configuration()
+    with startup.phase('configuration'):
+        config = configuration.Configuration()
+
+    # Initialize logging
+    with startup.phase('logging'):
+        logger = init_logging(config)
 
     # Log basic information on startup.
     logger.info ("heuristic-algorithmic is starting up")
     logger.info ("heuristic-algorithmic version: %s", __about__.__version__)
     logger.info ("discord.py version: %s", discord.__version__)
 
-    # Initialize database
-    connection = init_database (logger, config)
-
-    # Prepare database
-    db = prepare_database (logger, config, connection)
-
     # Check if we have a secret.
     if config.discord_secret() is None:
         logger.error ("no Discord bot secret specified; exiting")
         sys.exit (1)
 
+    # Work out sharding.
+    with startup.phase('sharding plan'):
+        shard_count, assignments = cluster.plan(logger, config)
+
+    if len(assignments) > 1:
+        # Multiple clusters; each opens and prepares its own database connection.
+        result = cluster.launch(logger, shard_count, assignments, run_cluster)
+
+        logger.info ("heuristic-algorithmic is stopping")
+        sys.exit(result)
+
+    # Initialize database; it is prepared while the bot logs in.
+    connection = init_database (config)
+
     # Run the bot.
-    asyncio.run(run_bot(logger, config, connection, db))
+    result = asyncio.run(run_bot(logger, config, connection, startup, shard_ids=assignments[0], shard_count=shard_count))
 
     # Log exit of entry point.
     logger.info ("heuristic-algorithmic is stopping")
 
     # Close database connection.
     connection.close()
+    sys.exit(result)
 
-entrypoint()
+if __name__ == '__main__':
+    entrypoint()
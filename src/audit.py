@@ -0,0 +1,129 @@
+# Moderation audit store - deleted and edited messages, kept in MongoDB for later search.
+#
+# The moderator echo is a chat message, which is no help in answering "what did this user
+# delete last week?". Every delete and edit whose content is known is therefore also recorded,
+# through the write-behind buffer, in the audit collection. That collection has compound
+# indexes on (guild, author, time) and (guild, channel, time), and a TTL index that lets
+# MongoDB expire records once the retention period is up.
+#
+# Searches page with a cursor (the time and message ID of the last record shown) rather than
+# by skipping, so fetching any page is one index range scan, however deep it is.
+
+import datetime
+import logging
+from typing import Optional
+
+import pymongo
+
+from database import AsyncDatabase, ensure_ttl_index
+from messagestore import StoredMessage
+from writebehind import WriteBehind
+
+COLLECTION = 'audit'
+
+DELETE = 'delete'
+EDIT = 'edit'
+
+# What a search can be made by.
+AUTHOR = 'author_id'
+CHANNEL = 'channel_id'
+
+# Keys of the indexes searches use; records sort newest first, the message ID breaking ties.
+SEARCH_INDEXES = {
+    AUTHOR: [('guild_id', pymongo.ASCENDING), (AUTHOR, pymongo.ASCENDING),
+             ('time', pymongo.DESCENDING), ('message_id', pymongo.DESCENDING)],
+    CHANNEL: [('guild_id', pymongo.ASCENDING), (CHANNEL, pymongo.ASCENDING),
+              ('time', pymongo.DESCENDING), ('message_id', pymongo.DESCENDING)],
+}
+
+SORT = [('time', pymongo.DESCENDING), ('message_id', pymongo.DESCENDING)]
+
+def prepare(db: pymongo.database.Database, retention_days: int) -> None:
+    """Create the audit collection's indexes; blocking, called from prepare_database."""
+    audit = db[COLLECTION]
+
+    for keys in SEARCH_INDEXES.values():
+        audit.create_index(keys)
+
+    ensure_ttl_index(db, COLLECTION, 'time', retention_days * 86400)
+
+def encode_cursor(record: dict) -> str:
+    """A cursor for the page following a record."""
+    time = record['time']
+
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+
+    return f"{round(time.timestamp() * 1000)}-{record['message_id']}"
+
+def decode_cursor(cursor: str) -> tuple:
+    """The (time, message ID) a cursor continues from; raises ValueError if it isn't one."""
+    millis, message_id = cursor.split('-')
+    return datetime.datetime.fromtimestamp(int(millis) / 1000, datetime.timezone.utc), int(message_id)
+
+class AuditLog:
+    """Records deletes and edits in the audit collection, and searches them."""
+    def __init__(self, logger: logging.Logger, db: AsyncDatabase, writes: WriteBehind, enabled: bool):
+        self.logger = logger
+        self.db = db
+        self.writes = writes
+        self.enabled = enabled
+
+        # Statistics
+        self.recorded = 0
+        self.searches = 0
+
+    def _record(self, kind: str, guild_id: int, record: StoredMessage, **fields) -> None:
+        if not self.enabled:
+            return
+
+        document = {
+            'guild_id': guild_id,
+            'channel_id': record.channel_id,
+            'author_id': record.author_id,
+            'author': record.author,
+            'message_id': record.id,
+            'kind': kind,
+            'time': datetime.datetime.now(datetime.timezone.utc),
+            'content': record.content,
+            'attachments': list(record.attachments),
+        }
+        document.update(fields)
+
+        # A message is deleted once, but may be edited many times.
+        key = ('guild_id', 'message_id', 'kind') if kind == DELETE else ('guild_id', 'message_id', 'kind', 'time')
+        self.writes.insert(COLLECTION, document, key=key)
+        self.recorded += 1
+
+    def record_delete(self, guild_id: int, record: StoredMessage, bulk: bool = False) -> None:
+        self._record(DELETE, guild_id, record, bulk=bulk)
+
+    def record_edit(self, guild_id: int, before: StoredMessage, content: str) -> None:
+        self._record(EDIT, guild_id, before, edited=content)
+
+    async def search(self, guild_id: int, by: str, value: int, limit: int, cursor: Optional[str] = None) -> tuple:
+        """A page of records for an author or channel, newest first, and the cursor for the next page (or None).
+
+        Raises ValueError if the cursor is not valid."""
+        query = {'guild_id': guild_id, by: value}
+
+        if cursor is not None:
+            time, message_id = decode_cursor(cursor)
+            query['$or'] = [{'time': {'$lt': time}}, {'time': time, 'message_id': {'$lt': message_id}}]
+
+        self.searches += 1
+
+        # One more than a page, to tell whether there is another.
+        records = await self.db[COLLECTION].find(query, sort=SORT, limit=limit + 1, hint=SEARCH_INDEXES[by])
+
+        if len(records) > limit:
+            return records[:limit], encode_cursor(records[limit - 1])
+
+        return records, None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'recorded': self.recorded,
+            'searches': self.searches,
+        }
@@ -0,0 +1,326 @@
+# Autopin backfill - highlights the older messages of a guild that already qualify for autopin.
+#
+# Autopin only acts on live 📌 reactions, so enabling it on an existing guild (or lowering its
+# threshold) leaves older qualifying messages unpinned. A backfill job reads the history of
+# each of the guild's text channels, oldest first and up to the moment the job began (the live
+# path handles everything after), and pins each message with enough 📌 reactions through the
+# bot's own pin_message, which skips any already pinned.
+#
+# Only a bounded number of channels are read at once, across all jobs, so that history requests
+# stay well within Discord's rate limits (which discord.py also waits out for us). Each channel's
+# progress is checkpointed to MongoDB as it goes, through the write-behind buffer: a job that
+# was interrupted, by a restart, by being cancelled or by a failure, resumes from its
+# checkpoints. The buffer is flushed before checkpoints are read back or cleared. A message that
+# Discord refuses to pin for good (one too long to take the pin's header, say) is skipped and
+# counted, rather than stopping its channel there at every resumption.
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import discord
+import pymongo
+
+from database import AsyncDatabase
+from pincounter import count_pins
+from writebehind import WriteBehind
+
+JOBS = 'backfill_job'
+CHANNELS = 'backfill_channel'
+
+RUNNING = 'running'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+def refused(e: discord.HTTPException) -> bool:
+    """Whether Discord refused to pin a message for good, for something about the message itself
+    (such as being too long once the pin's header is added), rather than the channel or the moment."""
+    return 400 <= e.status < 500 and e.status not in (403, 404, 429)
+
+def prepare(db: pymongo.database.Database) -> None:
+    """Create the backfill collections' indexes; blocking, called from prepare_database."""
+    db[JOBS].create_index('guild_id', unique=True)
+    db[CHANNELS].create_index([('guild_id', pymongo.ASCENDING), ('channel_id', pymongo.ASCENDING)], unique=True)
+
+class ChannelProgress:
+    """How far a job has read one channel."""
+    __slots__ = ('channel_id', 'after', 'scanned', 'pinned', 'skipped', 'done')
+
+    def __init__(self, channel_id: int, after: Optional[int] = None, scanned: int = 0, pinned: int = 0, skipped: int = 0,
+                 done: bool = False):
+        self.channel_id = channel_id
+        self.after = after
+        self.scanned = scanned
+        self.pinned = pinned
+        self.skipped = skipped
+        self.done = done
+
+class BackfillJob:
+    """A backfill of one guild."""
+    def __init__(self, guild_id: int, threshold: int, until: int):
+        self.guild_id = guild_id
+        self.threshold = threshold
+        self.until = until
+        self.status = RUNNING
+        self.channels = {}
+        self.task: Optional[asyncio.Task] = None
+
+        # Progress made since this job was (re)started, for its throughput.
+        self.started = time.monotonic()
+        self.scanned_here = 0
+
+        # Channels left unfinished by Discord or database errors.
+        self.failures = 0
+
+    def channel(self, channel_id: int) -> ChannelProgress:
+        progress = self.channels.get(channel_id)
+
+        if progress is None:
+            progress = ChannelProgress(channel_id)
+            self.channels[channel_id] = progress
+
+        return progress
+
+    def progress(self) -> dict:
+        elapsed = time.monotonic() - self.started
+
+        return {
+            'status': self.status,
+            'threshold': self.threshold,
+            'channels': len(self.channels),
+            'channels_done': sum(1 for c in self.channels.values() if c.done),
+            'scanned': sum(c.scanned for c in self.channels.values()),
+            'pinned': sum(c.pinned for c in self.channels.values()),
+            'skipped': sum(c.skipped for c in self.channels.values()),
+            'failures': self.failures,
+            'elapsed': elapsed,
+            'rate': self.scanned_here / elapsed if elapsed > 0 else 0.0,
+        }
+
+class AutopinBackfill:
+    """Runs, checkpoints and resumes autopin backfill jobs, a bounded number of channels at a time."""
+    def __init__(self, logger: logging.Logger, bot, db: AsyncDatabase, writes: WriteBehind, channels: int, checkpoint_every: int):
+        self.logger = logger
+        self.bot = bot
+        self.db = db
+        self.writes = writes
+        self.checkpoint_every = checkpoint_every
+        self._slots = asyncio.Semaphore(channels)
+        self._jobs = {}
+
+    def job(self, guild_id: int) -> Optional[BackfillJob]:
+        return self._jobs.get(guild_id)
+
+    def running(self, guild_id: int) -> bool:
+        job = self._jobs.get(guild_id)
+        return job is not None and job.task is not None and not job.task.done()
+
+    async def start(self, guild: discord.Guild, threshold: int) -> BackfillJob:
+        """Start a backfill of guild, resuming an unfinished one with the same threshold if there is one; returns the job.
+
+        An unfinished job with another threshold is started over: one raised would otherwise be
+        ignored, and one lowered would miss what the channels already read now qualify."""
+        if self.running(guild.id):
+            return self._jobs[guild.id]
+
+        job = self._jobs.get(guild.id)
+
+        if job is not None and job.status != DONE and job.threshold == threshold:
+            # Stopped in this process; its progress here is at least as recent as its checkpoints.
+            job.status = RUNNING
+            job.started = time.monotonic()
+            job.scanned_here = 0
+            job.failures = 0
+            self.logger.info('Resuming autopin backfill of %s.', guild)
+
+            self._save_job(job)
+            job.task = asyncio.create_task(self._run(job, guild), name=f'autopin-backfill-{guild.id}')
+            return job
+
+        # An earlier job's last checkpoints may still be queued; write them out before reading
+        # the checkpoints back, or clearing them for a new job.
+        if not await self.writes.flush(JOBS, CHANNELS):
+            raise pymongo.errors.PyMongoError('could not write out earlier autopin backfill checkpoints')
+
+        saved = await self.db[JOBS].find_one({'guild_id': guild.id})
+
+        if saved is not None and saved['status'] != DONE and saved['threshold'] == threshold:
+            job = BackfillJob(guild.id, saved['threshold'], saved['until'])
+
+            for c in await self.db[CHANNELS].find({'guild_id': guild.id}):
+                job.channels[c['channel_id']] = ChannelProgress(c['channel_id'], c['after'], c['scanned'], c['pinned'],
+                                                             c.get('skipped', 0), c['done'])
+
+            self.logger.info('Resuming autopin backfill of %s from %d channel checkpoints.', guild, len(job.channels))
+        else:
+            # Anything posted from now on is seen by the live path.
+            job = BackfillJob(guild.id, threshold, discord.utils.time_snowflake(discord.utils.utcnow()))
+            await self.db[CHANNELS].delete_many({'guild_id': guild.id})
+
+            if saved is not None and saved['status'] != DONE:
+                self.logger.info('Starting autopin backfill of %s over, as its threshold is now %d, not %d.',
+                                 guild, threshold, saved['threshold'])
+            else:
+                self.logger.info('Starting autopin backfill of %s (threshold %d).', guild, threshold)
+
+        self._save_job(job)
+        self._jobs[guild.id] = job
+        job.task = asyncio.create_task(self._run(job, guild), name=f'autopin-backfill-{guild.id}')
+        return job
+
+    async def resume_all(self) -> None:
+        """Resume the jobs left running when the bot last stopped, for the guilds it can see, at
+        their current thresholds."""
+        for saved in await self.db[JOBS].find({'status': RUNNING}):
+            guild = self.bot.get_guild(saved['guild_id'])
+            gc = self.bot.config.guild_config(guild)
+
+            if gc is None or gc.autopin_threshold == 0 or self.bot.channels.autopin(guild) is None:
+                # Autopin has since been turned off here; leave the job for if it is turned on again.
+                continue
+
+            if not self.running(guild.id):
+                await self.start(guild, gc.autopin_threshold)
+
+    def cancel(self, guild_id: int) -> bool:
+        """Stop a running job, keeping its checkpoints to resume from; returns whether one was running."""
+        if not self.running(guild_id):
+            return False
+
+        job = self._jobs[guild_id]
+        job.status = CANCELLED
+        job.task.cancel()
+        return True
+
+    def _save_job(self, job: BackfillJob) -> None:
+        self.writes.upsert(JOBS, {'guild_id': job.guild_id},
+                           {'$set': {'status': job.status, 'threshold': job.threshold, 'until': job.until}})
+
+    def _checkpoint(self, job: BackfillJob, progress: ChannelProgress) -> None:
+        self.writes.upsert(CHANNELS, {'guild_id': job.guild_id, 'channel_id': progress.channel_id},
+                           {'$set': {'after': progress.after, 'scanned': progress.scanned, 'pinned': progress.pinned,
+                                     'skipped': progress.skipped, 'done': progress.done}})
+
+    async def _run(self, job: BackfillJob, guild: discord.Guild) -> None:
+        pinchan = self.bot.channels.autopin(guild)
+        channels = [c for c in guild.text_channels
+                    if c != pinchan and c.permissions_for(guild.me).read_message_history]
+
+        pending = [c for c in channels if not job.channel(c.id).done]
+
+        try:
+            results = await asyncio.gather(*(self._channel(job, c) for c in pending), return_exceptions=True)
+        except asyncio.CancelledError:
+            # Cancelled, or the bot is shutting down; either way the job resumes from its checkpoints.
+            self._save_job(job)
+            raise
+
+        for channel, result in zip(pending, results):
+            if isinstance(result, Exception):
+                # Anything else going wrong in a channel leaves it unfinished, like an HTTP or database error.
+                self.logger.error('Autopin backfill of #%s in %s failed.', channel, guild, exc_info=result)
+                job.failures += 1
+                self._checkpoint(job, job.channel(channel.id))
+
+        unfinished = sum(1 for c in channels if not job.channel(c.id).done)
+
+        if unfinished:
+            # Left running, to resume from its checkpoints when next started.
+            self.logger.warning('Autopin backfill of %s stopped with %d channels unfinished.', guild, unfinished)
+            self._save_job(job)
+            return
+
+        job.status = DONE
+        self._save_job(job)
+
+        p = job.progress()
+        summary = (f"{p['pinned']} messages pinned of {p['scanned']} read, in {p['channels']} channels; "
+                   f"{p['rate']:.0f} messages/s.")
+
+        if p['skipped']:
+            summary += f" {p['skipped']} messages could not be pinned, and were skipped."
+        self.logger.info('Autopin backfill of %s finished: %s', guild, summary)
+
+        modchan = self.bot.channels.moderator(guild)
+
+        if modchan is not None:
+            self.bot.modlog.post(modchan, 'Autopin backfill finished', summary)
+
+    async def _channel(self, job: BackfillJob, channel: discord.TextChannel) -> None:
+        progress = job.channel(channel.id)
+
+        async with self._slots:
+            after = discord.Object(progress.after) if progress.after is not None else None
+
+            try:
+                async for message in channel.history(limit=None, after=after, before=discord.Object(job.until), oldest_first=True):
+                    if count_pins(message) >= job.threshold and not self.bot.pin_index.contains(message.guild.id, message.id):
+                        try:
+                            if await self.bot.pin_flights.run(message.id, lambda m=message: self.bot.pin_message(m)):
+                                progress.pinned += 1
+                        except (discord.Forbidden, discord.NotFound):
+                            # The autopin channel can't be posted to, which is no reason to skip this
+                            # channel (as the same errors reading it would be); left to resume later.
+                            self.logger.error('Autopin backfill of #%s in %s cannot post to the autopin channel.',
+                                              channel, channel.guild, exc_info=True)
+                            job.failures += 1
+                            self._checkpoint(job, progress)
+                            return
+                        except discord.HTTPException as e:
+                            if not refused(e):
+                                raise
+
+                            # It would be refused again every time the job resumed here; move on.
+                            self.logger.warning('Autopin backfill cannot pin message %d in #%s (%s); skipping it.',
+                                                message.id, channel, e.text or e.status)
+                            progress.skipped += 1
+
+                    # Only now is the message done with; a failure pinning it leaves it to be read again.
+                    progress.after = message.id
+                    progress.scanned += 1
+                    job.scanned_here += 1
+
+                    if progress.scanned % self.checkpoint_every == 0:
+                        self._checkpoint(job, progress)
+                        self.logger.debug('Autopin backfill of #%s: %d read, %d pinned.', channel, progress.scanned, progress.pinned)
+            except discord.Forbidden:
+                self.logger.warning('Autopin backfill cannot read #%s in %s; skipping it.', channel, channel.guild)
+            except discord.HTTPException:
+                # Leave the channel unfinished, for the job to resume later.
+                self.logger.error('Autopin backfill of #%s in %s failed.', channel, channel.guild, exc_info=True)
+                job.failures += 1
+                self._checkpoint(job, progress)
+                return
+            except pymongo.errors.PyMongoError:
+                # Checking or recording a pin failed; likewise left to resume later.
+                self.logger.error('Autopin backfill of #%s in %s could not use the database.', channel, channel.guild, exc_info=True)
+                job.failures += 1
+                self._checkpoint(job, progress)
+                return
+            except asyncio.CancelledError:
+                self._checkpoint(job, progress)
+                raise
+
+            progress.done = True
+            self._checkpoint(job, progress)
+
+    def stats(self) -> dict:
+        return {
+            'jobs': len(self._jobs),
+            'running': sum(1 for g in self._jobs if self.running(g)),
+            'scanned': sum(j.progress()['scanned'] for j in self._jobs.values()),
+            'pinned': sum(j.progress()['pinned'] for j in self._jobs.values()),
+            'skipped': sum(j.progress()['skipped'] for j in self._jobs.values()),
+            'failures': sum(j.failures for j in self._jobs.values()),
+        }
+
+    async def close(self) -> None:
+        """Stop the running jobs, checkpointing them to resume at the next start."""
+        tasks = [j.task for j in self._jobs.values() if j.task is not None and not j.task.done()]
+
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
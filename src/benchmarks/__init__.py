@@ -0,0 +1 @@
+# Benchmarks - run from the src directory, e.g. `python3 -m benchmarks.diffing`.
@@ -0,0 +1,217 @@
+# Cluster benchmark - runs the bot split across cluster processes, as cluster.launch does.
+#
+# Each cluster process runs a real HeuristicAlgorithmic, over its own share of fake guilds,
+# with metrics enabled as they would be in production. Once every cluster is up, each one
+# scrapes every cluster's metrics endpoint, checking that each serves on a port of its own;
+# the run fails if any cluster cannot bind its port or any endpoint does not answer.
+#
+# The clusters then share out a stream of synthetic gateway events (as benchmarks.gateway
+# generates them), starting together, and the throughput of the whole host is reported. The
+# run is made with a single cluster and then with the number asked for, to compare the two.
+# Each cluster runs its events back to back, so with the database and HTTP latencies at 0
+# this is the CPU-bound throughput; with them above 0, the waits overlap across clusters:
+#
+#   python3 -m benchmarks.clusters --clusters 4 --events 20000 --port 19090
+
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+
+import aiohttp
+import pymongo
+
+import __about__
+import bot as botmodule
+import cluster
+from bot import HeuristicAlgorithmic
+from configuration import Configuration
+from database import AsyncDatabase
+
+from benchmarks.fakes import FakeHTTP, MemoryDatabase, World
+from benchmarks.gateway import DEFAULT_MIX, Traffic, drive_closed, parse_mix
+
+# Seconds to wait for the other clusters at each step.
+BARRIER_TIMEOUT = 60
+
+def config_data(args, clusters: int, world: World) -> dict:
+    return {
+        'global': {
+            'discordSecret': 'benchmark',
+            'database': {'connectionString': 'memory://', 'databaseName': 'benchmark', 'maxWorkers': args.db_workers},
+            'modlog': {'flushInterval': 0.5, 'diffWorkers': 0},
+            'metrics': {'enabled': True, 'port': args.port},
+            'profiling': {'watchdogThreshold': 0},
+            'sharding': {'enabled': True, 'clusters': clusters},
+        },
+        'guilds': world.config(args.threshold),
+    }
+
+async def scrape(session: aiohttp.ClientSession, port: int) -> bool:
+    try:
+        async with session.get(f'http://127.0.0.1:{port}/metrics') as resp:
+            return resp.status == 200 and 'hal_' in await resp.text()
+    except aiohttp.ClientError:
+        return False
+
+async def run_cluster(args, clusters: int, barrier, results, cluster_id: int, shard_ids: list, shard_count: int) -> bool:
+    logger = logging.getLogger(f'benchmark.cluster{cluster_id}')
+
+    # The guilds, and the events, are shared out among the clusters.
+    world = World(FakeHTTP(args.http_latency), max(args.guilds // clusters, 1), args.channels, args.members)
+    config = Configuration(config_data(args, clusters, world))
+
+    memory = MemoryDatabase(latency=args.db_latency)
+    memory['pin'].create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    db = AsyncDatabase(memory, config.globals.mongodb_max_workers)
+
+    bot = HeuristicAlgorithmic(logger, config, None, db, shard_ids=shard_ids, shard_count=shard_count,
+                               cluster_id=cluster_id)
+    ok = True
+
+    async with bot:
+        world.install(bot)
+        bot.session = aiohttp.ClientSession()
+
+        for extension in botmodule.initial_extensions:
+            await bot.load_extension(extension)
+
+        try:
+            await bot.metrics_server.start()
+        except OSError:
+            logger.error('Cluster %d could not serve its metrics on port %d.', cluster_id, bot.metrics_server.port)
+            barrier.abort()
+            return False
+
+        # Wait for every cluster to be serving, then check each one's endpoint.
+        await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT)
+
+        async with aiohttp.ClientSession() as session:
+            for n in range(clusters):
+                if not await scrape(session, args.port + n):
+                    logger.error('Cluster %d found no metrics for cluster %d on port %d.', cluster_id, n, args.port + n)
+                    ok = False
+
+        # Warm up, then start the measured events together with the other clusters.
+        traffic = Traffic(bot, world, args.mix, args.popular, random.Random(args.seed + cluster_id))
+        await drive_closed(traffic.generate(min(args.events // clusters // 10, 2000)))
+        events = traffic.generate(args.events // clusters)
+
+        await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT)
+        _, elapsed = await drive_closed(events)
+        results.put((cluster_id, len(events), elapsed))
+
+        # Keep serving until every cluster has finished.
+        await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT)
+
+    await asyncio.to_thread(db.close)
+    return ok
+
+def cluster_main(args, clusters: int, barrier, results, cluster_id: int, shard_ids: list, shard_count: int) -> None:
+    """Entry point of a benchmark cluster process."""
+    logging.basicConfig(level=args.log_level)
+
+    try:
+        ok = asyncio.run(run_cluster(args, clusters, barrier, results, cluster_id, shard_ids, shard_count))
+    except threading.BrokenBarrierError:
+        ok = False
+
+    sys.exit(0 if ok else 1)
+
+def run(logger: logging.Logger, args, clusters: int) -> dict:
+    """Run the events across a number of clusters; returns the results, or None if a cluster failed."""
+    assignments = cluster.assign_shards(list(range(args.shards)), clusters)
+    clusters = len(assignments)
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(clusters)
+    results = ctx.Queue()
+
+    if cluster.launch(logger, args.shards, assignments, functools.partial(cluster_main, args, clusters, barrier, results)) != 0:
+        return None
+
+    finished = [results.get(timeout=BARRIER_TIMEOUT) for _ in range(clusters)]
+
+    events = sum(count for _, count, _ in finished)
+    elapsed = max(elapsed for _, _, elapsed in finished)
+
+    return {
+        'clusters': clusters,
+        'events': events,
+        'elapsed': elapsed,
+        'throughput': events / elapsed,
+        'per_cluster': {cluster_id: count / elapsed for cluster_id, count, elapsed in sorted(finished)},
+    }
+
+def report(results: dict) -> None:
+    p = results['parameters']
+    print(f"{p['events']:,} events across {p['guilds']} guilds and {p['shards']} shards; {results['cpus']} CPUs")
+    print(f"{'clusters':>8} {'events/s':>10} {'speedup':>8}  per cluster")
+
+    base = results['runs'][0]['throughput']
+
+    for r in results['runs']:
+        per_cluster = ', '.join(f'{rate:,.0f}' for rate in r['per_cluster'].values())
+        print(f"{r['clusters']:>8} {r['throughput']:>10,.0f} {r['throughput'] / base:>7.2f}x  {per_cluster}")
+
+    print(f"each cluster served its metrics on its own port, from {p['port']}.")
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the bot split across cluster processes with synthetic gateway traffic.')
+    parser.add_argument('--clusters', type=int, default=2, help='clusters to compare with a single one')
+    parser.add_argument('--shards', type=int, default=4, help='shards split across the clusters')
+    parser.add_argument('--port', type=int, default=19090, help='metrics port of cluster 0')
+    parser.add_argument('--events', type=int, default=20000, help='events to measure, shared among the clusters')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'event weights (default {DEFAULT_MIX})')
+    parser.add_argument('--guilds', type=int, default=20, help='guilds, shared among the clusters')
+    parser.add_argument('--channels', type=int, default=20, help='text channels per guild')
+    parser.add_argument('--members', type=int, default=200, help='members per guild')
+    parser.add_argument('--popular', type=int, default=200, help='recent messages that edits, deletes and reactions target')
+    parser.add_argument('--threshold', type=int, default=3, help='autopin threshold')
+    parser.add_argument('--db-latency', type=float, default=0.001, help='seconds per MongoDB call')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--http-latency', type=float, default=0.001, help='seconds per Discord API request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logger = logging.getLogger('benchmark')
+
+    runs = []
+
+    for clusters in sorted({1, args.clusters}):
+        run_results = run(logger, args, clusters)
+
+        if run_results is None:
+            sys.exit(1)
+
+        runs.append(run_results)
+
+    results = {
+        'benchmark': 'clusters',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'runs': runs,
+    }
+
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
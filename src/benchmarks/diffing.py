@@ -0,0 +1,51 @@
+# Microbenchmark for the edit diff engine.
+
+import random
+import string
+import timeit
+
+import diffing
+from modlog import MAX_EMBED_DESCRIPTION
+
+# Budget for the diff inside the fenced moderator notice.
+LIMIT = MAX_EMBED_DESCRIPTION - len('```diff\n\n```')
+
+def words(n: int, rng: random.Random) -> list:
+    return [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(n)]
+
+def cases(rng: random.Random) -> dict:
+    """Build (before, after) pairs covering typical and worst-case edits."""
+    short = ' '.join(words(20, rng))
+    typo = short.replace(short.split()[5], short.split()[5][::-1], 1)
+
+    # A pasted log near the 4000-character Nitro limit, with one line changed.
+    log = '\n'.join(' '.join(words(8, rng)) for _ in range(75))[:4000]
+    loglines = log.split('\n')
+    loglines[40] = ' '.join(words(8, rng))
+    log_edit = '\n'.join(loglines)
+
+    # Worst case: a long message replaced wholesale.
+    rewrite_before = ' '.join(words(600, rng))[:4000]
+    rewrite_after = ' '.join(words(600, rng))[:4000]
+
+    return {
+        'typo (short)': (short, typo),
+        'one line of long log': (log, log_edit),
+        'full rewrite (long)': (rewrite_before, rewrite_after),
+    }
+
+def main():
+    rng = random.Random(1234)
+
+    print(f"{'case':<24} {'mode':<5} {'per edit':>10} {'parts':>6} {'chars':>6}")
+
+    for name, (before, after) in cases(rng).items():
+        for mode in diffing.MODES:
+            number = 20
+            elapsed = timeit.timeit(lambda: diffing.render(before, after, mode, LIMIT, 2), number=number)
+            parts = diffing.render(before, after, mode, LIMIT, 2)
+
+            print(f'{name:<24} {mode:<5} {elapsed / number * 1000:>8.2f}ms {len(parts):>6} {sum(map(len, parts)):>6}')
+
+if __name__ == '__main__':
+    main()
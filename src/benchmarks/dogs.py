@@ -0,0 +1,251 @@
+# Random dog benchmark - `random dog` against a local stand-in for random.dog.
+#
+# A DogServer (a real HTTP server on a local port) plays random.dog, with a given latency and
+# share of failed requests. The dog pool is run with prefetching off (as every dog used to be
+# fetched) and on, and commands are simulated at a given interval: reports how long each
+# waited for its dog, how the pool kept up, and the time and peak memory of each video
+# download, streamed (to memory or, if large, a temporary file), against reading the whole
+# video into memory at once.
+#
+# First, though, it checks against the stand-in that failed requests are retried, and given
+# up after the configured number of retries; that concurrent requests never use more
+# connections to the host than allowed; and that downloads arrive whole, in memory or on
+# disk by size. The run fails if any check does:
+#
+#   python3 -m benchmarks.dogs --requests 200 --interval 0.05 --latency 0.1 --failure-rate 0.05
+
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+
+import __about__
+from configuration import Configuration
+from dogpool import SPOOL_BYTES, VIDEO, Dog, DogPool
+import httpclient
+
+from benchmarks.fakes import DogServer
+from benchmarks.gateway import percentile
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+
+    if not samples:
+        return {'count': 0}
+
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+async def read_whole(session: aiohttp.ClientSession, url: str) -> bytes:
+    """The old way: the whole video in memory at once."""
+    async with session.get(url) as resp:
+        return await resp.read()
+
+async def measure_downloads(pool: DogPool, session: aiohttp.ClientSession, dogs: list, max_bytes: int) -> dict:
+    """Download each video both ways, one at a time under tracemalloc."""
+    results = {}
+
+    for mode in ('streamed', 'whole'):
+        times, peaks, too_big = [], [], 0
+        tracemalloc.start()
+
+        try:
+            for dog in dogs:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                started = time.perf_counter()
+
+                if mode == 'streamed':
+                    fp = await pool.download(dog, max_bytes)
+
+                    if fp is None:
+                        too_big += 1
+                    else:
+                        fp.close()
+                else:
+                    if len(await read_whole(session, dog.url)) > max_bytes:
+                        too_big += 1
+
+                times.append(time.perf_counter() - started)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        results[mode] = dict(summarize(times), too_big=too_big, mean_peak_bytes=sum(peaks) / len(peaks) if peaks else 0)
+
+    return results
+
+# Connections allowed to the stand-in while checking the limit.
+CHECK_CONNECTIONS = 3
+
+async def check(args, logger: logging.Logger) -> list:
+    """Check retries, the connection limit and downloads against the stand-in; returns the checks that failed."""
+    failed = []
+    server = DogServer(args.images, args.videos, args.video_bytes, latency=0.05, seed=args.seed)
+    base_url = await server.start()
+
+    config = Configuration({'global': {'http': {'retries': 3, 'retryBackoff': 0.01, 'maxConnectionsPerHost': CHECK_CONNECTIONS}}})
+    session = httpclient.create_session(config.globals)
+    pool = DogPool(logger, session, httpclient.retry_policy(config.globals), 0, base_url)
+
+    def expect(ok: bool, what: str) -> None:
+        if not ok:
+            failed.append(what)
+
+    try:
+        # Busy answers are retried, until one gets through.
+        server.fail_next = 2
+        dog = await pool.take()
+        expect(dog is not None and server.requests.get('woof') == 3, 'a request answered 503 twice is retried until it succeeds')
+
+        # But no more than the configured number of times.
+        server.requests.clear()
+        server.fail_next = 4
+        dog = await pool.take()
+        expect(dog is None and server.requests.get('woof') == 4 and pool.rejected == 1,
+               'a request answered 503 every time is tried 1 + 3 times, then given up')
+
+        # However many are asked for at once, no more than the limit are in flight to the host.
+        server.max_active = 0
+        dogs = await asyncio.gather(*(pool.take() for _ in range(20)))
+        expect(all(d is not None for d in dogs), 'concurrent requests all succeed')
+        expect(server.max_active == CHECK_CONNECTIONS,
+               f'concurrent requests use {CHECK_CONNECTIONS} connections to the host (used {server.max_active})')
+
+        # Downloads arrive whole: small ones in memory, large ones in a temporary file.
+        for name, size in ((n, s) for n, s in server.files.items() if s <= args.max_bytes):
+            fp = await pool.download(Dog(f'{base_url}/{name}', name, VIDEO, None), args.max_bytes)
+
+            with fp:
+                expect(len(fp.read()) == size, f'{name} downloads whole')
+                expect(isinstance(fp, io.BytesIO) == (size <= SPOOL_BYTES), f'{name} is kept in memory only if small')
+
+        too_big = next((n for n, s in server.files.items() if s > args.max_bytes), None)
+
+        if too_big is not None:
+            fp = await pool.download(Dog(f'{base_url}/{too_big}', too_big, VIDEO, None), args.max_bytes)
+            expect(fp is None, f'{too_big} is abandoned as too big')
+    finally:
+        await session.close()
+        await server.close()
+
+    return failed
+
+async def run(args) -> dict:
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(args.log_level)
+
+    failed = await check(args, logger)
+
+    server = DogServer(args.images, args.videos, args.video_bytes, args.latency, args.failure_rate, args.seed)
+    base_url = await server.start()
+
+    config = Configuration({'global': {'http': {'retries': args.retries}}})
+    session = httpclient.create_session(config.globals)
+    retry = httpclient.retry_policy(config.globals)
+    results = {}
+
+    try:
+        for size in (0, args.pool):
+            pool = DogPool(logger, session, retry, size, base_url)
+            pool.start()
+
+            # Let the pool fill, as it would between the bot starting and the first command.
+            while len(pool) < size:
+                await asyncio.sleep(0.01)
+
+            waits, videos = [], []
+
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                dog = await pool.take()
+                waits.append(time.perf_counter() - started)
+
+                if dog is not None and dog.kind == VIDEO:
+                    videos.append(dog)
+
+                await asyncio.sleep(args.interval)
+
+            pool.close()
+            results[f'pool={size}'] = {'wait': summarize(waits), 'pool': pool.stats()}
+
+        results['downloads'] = await measure_downloads(pool, session, videos, args.max_bytes)
+    finally:
+        await session.close()
+        await server.close()
+
+    return {
+        'benchmark': 'dogs',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'aiohttp': aiohttp.__version__,
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'server_requests': server.requests,
+        'failed_checks': failed,
+        'results': results,
+    }
+
+def report(results: dict) -> None:
+    print(f"{'run':<12} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  notes")
+
+    for name, r in results['results'].items():
+        if name == 'downloads':
+            continue
+
+        w = r['wait']
+        print(f"{name:<12} {w['count']:>6} {w['mean_ms']:>9.2f} {w['p50_ms']:>9.2f} {w['p99_ms']:>9.2f} {w['max_ms']:>9.2f}  "
+              f"{r['pool']['served']} from pool, {r['pool']['missed']} fetched, {r['pool']['failures']} failed")
+
+    for mode, d in results['results']['downloads'].items():
+        if d['count']:
+            print(f"{'video/' + mode:<12} {d['count']:>6} {d['mean_ms']:>9.2f} {d['p50_ms']:>9.2f} {d['p99_ms']:>9.2f} "
+                  f"{d['max_ms']:>9.2f}  peak {d['mean_peak_bytes'] / 1024:.0f} KiB, {d['too_big']} too big")
+
+    print(f"requests served: {json.dumps(results['server_requests'])}")
+
+    for what in results['failed_checks']:
+        print(f'FAILED: {what}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time `random dog` against a local stand-in for random.dog.')
+    parser.add_argument('--requests', type=int, default=200, help='commands simulated per run')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between commands')
+    parser.add_argument('--pool', type=int, default=5, help='dog pool size for the prefetching run')
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--videos', type=int, default=10)
+    parser.add_argument('--video-bytes', type=int, default=4 * 1024 * 1024, help='typical video size')
+    parser.add_argument('--max-bytes', type=int, default=8 * 1024 * 1024, help='upload size limit')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per request to the stand-in')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered 503')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if results['failed_checks']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+# Stand-ins for the bot's external services, for driving it without a network.
+#
+# MemoryDatabase takes the place of a pymongo database (behind the real AsyncDatabase),
+# FakeHTTP takes the place of the Discord REST API, and DogServer (a real local HTTP server)
+# takes the place of random.dog. The remaining classes are minimal
+# guilds, channels, users and messages, carrying just the attributes the bot reads. Each
+# service can be given an artificial latency, to see how the bot behaves when it is slow.
+
+import asyncio
+import datetime
+import itertools
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from aiohttp import web
+import pymongo
+
+# Mongo stand-in
+
+def _matches(doc: dict, query: dict) -> bool:
+    """Equality matching, plus the handful of query operators the bot uses."""
+    for key, cond in query.items():
+        value = doc.get(key)
+
+        if isinstance(cond, dict) and cond and all(k.startswith('$') for k in cond):
+            for op, arg in cond.items():
+                if op == '$in' and value not in arg:
+                    return False
+                elif op == '$gt' and not (value is not None and value > arg):
+                    return False
+                elif op == '$gte' and not (value is not None and value >= arg):
+                    return False
+                elif op == '$lt' and not (value is not None and value < arg):
+                    return False
+                elif op == '$lte' and not (value is not None and value <= arg):
+                    return False
+        elif value != cond:
+            return False
+
+    return True
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return dict(doc)
+
+    included = [k for k, v in projection.items() if v and k != '_id']
+
+    if included:
+        out = {k: doc[k] for k in included if k in doc}
+        if projection.get('_id', 1) and '_id' in doc:
+            out['_id'] = doc['_id']
+        return out
+
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+def _index_keys(keys) -> tuple:
+    if isinstance(keys, str):
+        return (keys,)
+
+    return tuple(k for k, _ in keys)
+
+class MemoryCollection:
+    """In-process stand-in for a pymongo collection, covering the calls the bot makes."""
+    def __init__(self, database: 'MemoryDatabase', name: str):
+        self.database = database
+        self.name = name
+        self.docs = []
+        self.unique = []
+        self._ids = itertools.count(1)
+
+    def _delay(self, operation: str) -> None:
+        calls = self.database.calls
+        calls[operation] = calls.get(operation, 0) + 1
+
+        if self.database.latency > 0:
+            time.sleep(self.database.latency)
+
+    def _check_unique(self, doc: dict) -> None:
+        for keys in self.unique:
+            key = tuple(doc.get(k) for k in keys)
+
+            if any(tuple(d.get(k) for k in keys) == key for d in self.docs):
+                raise pymongo.errors.DuplicateKeyError(f'E11000 duplicate key error collection: {self.name}', 11000)
+
+    def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        if unique:
+            self.unique.append(_index_keys(keys))
+
+        return '_'.join(_index_keys(keys))
+
+    def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        self._delay('find_one')
+
+        with self.database.lock:
+            for doc in self.docs:
+                if _matches(doc, filter or {}):
+                    return _project(doc, projection)
+
+        return None
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, limit: int = 0,
+             skip: int = 0, **kwargs) -> list:
+        self._delay('find')
+
+        with self.database.lock:
+            docs = [doc for doc in self.docs if _matches(doc, filter or {})]
+
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda d: d.get(key), reverse=direction == pymongo.DESCENDING)
+
+        docs = docs[skip:skip + limit] if limit else docs[skip:]
+        return [_project(doc, projection) for doc in docs]
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        self._delay('count_documents')
+
+        with self.database.lock:
+            return sum(1 for doc in self.docs if _matches(doc, filter))
+
+    def insert_one(self, document: dict, **kwargs) -> SimpleNamespace:
+        self._delay('insert_one')
+
+        with self.database.lock:
+            document.setdefault('_id', next(self._ids))
+            self._check_unique(document)
+            self.docs.append(dict(document))
+
+        return SimpleNamespace(inserted_id=document['_id'], acknowledged=True)
+
+    def insert_many(self, documents: list, ordered: bool = True, **kwargs) -> SimpleNamespace:
+        self._delay('insert_many')
+        ids = []
+
+        with self.database.lock:
+            for document in documents:
+                document.setdefault('_id', next(self._ids))
+                self._check_unique(document)
+                self.docs.append(dict(document))
+                ids.append(document['_id'])
+
+        return SimpleNamespace(inserted_ids=ids, acknowledged=True)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        self._delay('update_one')
+
+        with self.database.lock:
+            for doc in self.docs:
+                if _matches(doc, filter):
+                    doc.update(update.get('$set', {}))
+                    return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+
+            if upsert:
+                doc = {k: v for k, v in filter.items() if not isinstance(v, dict)}
+                doc.update(update.get('$set', {}))
+                doc.update(update.get('$setOnInsert', {}))
+                doc['_id'] = next(self._ids)
+                self.docs.append(doc)
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc['_id'])
+
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> SimpleNamespace:
+        """UpdateOne requests only (the write-behind buffer's), in a single round-trip."""
+        self._delay('bulk_write')
+        matched = upserted = 0
+
+        with self.database.lock:
+            for request in requests:
+                update = request._doc
+
+                for doc in self.docs:
+                    if _matches(doc, request._filter):
+                        doc.update(update.get('$set', {}))
+                        matched += 1
+                        break
+                else:
+                    if request._upsert:
+                        doc = {k: v for k, v in request._filter.items() if not isinstance(v, dict)}
+                        doc.update(update.get('$set', {}))
+                        doc.update(update.get('$setOnInsert', {}))
+                        doc['_id'] = next(self._ids)
+                        self.docs.append(doc)
+                        upserted += 1
+
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_count=upserted, acknowledged=True)
+
+    def delete_many(self, filter: dict, **kwargs) -> SimpleNamespace:
+        self._delay('delete_many')
+
+        with self.database.lock:
+            kept = [doc for doc in self.docs if not _matches(doc, filter)]
+            deleted = len(self.docs) - len(kept)
+            self.docs = kept
+
+        return SimpleNamespace(deleted_count=deleted)
+
+class MemoryDatabase:
+    """In-process stand-in for a pymongo database; every call sleeps for the given latency."""
+    def __init__(self, name: str = 'benchmark', latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.collections = {}
+
+        # Round-trips made, by operation.
+        self.calls = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        coll = self.collections.get(name)
+
+        if coll is None:
+            coll = MemoryCollection(self, name)
+            self.collections[name] = coll
+
+        return coll
+
+    def command(self, command, **kwargs) -> dict:
+        return {'ok': 1.0}
+
+# Discord stand-ins
+
+_snowflakes = itertools.count(1 << 40)
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+def message_payload(channel_id: int, author: dict, content: Optional[str], embeds: Optional[list]) -> dict:
+    """A minimal gateway/REST message payload, as Discord returns for a message just sent."""
+    return {
+        'id': str(snowflake()),
+        'channel_id': str(channel_id),
+        'author': author,
+        'content': content or '',
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': embeds or [],
+        'pinned': False,
+        'type': 0,
+        'flags': 0,
+    }
+
+class FakeUser:
+    """A guild member, as far as the bot looks at one."""
+    def __init__(self, name: str, bot: bool = False, administrator: bool = False):
+        self.id = snowflake()
+        self.name = name
+        self.display_name = name
+        self.discriminator = '0'
+        self.bot = bot
+        self.mention = f'<@{self.id}>'
+        self.guild_permissions = SimpleNamespace(administrator=administrator)
+
+    def __eq__(self, other) -> bool:
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self) -> int:
+        return self.id >> 22
+
+    def __str__(self) -> str:
+        return self.name
+
+    def payload(self) -> dict:
+        return {'id': str(self.id), 'username': self.name, 'discriminator': self.discriminator,
+                'global_name': None, 'avatar': None, 'bot': self.bot}
+
+class FakeReaction:
+    def __init__(self, emoji: str, count: int):
+        self.emoji = emoji
+        self.count = count
+
+class FakeMessage:
+    """A message, with the attributes the bot's handlers and commands read."""
+    def __init__(self, state, channel: 'FakeChannel', author: FakeUser, content: str):
+        self._state = state
+        self.id = snowflake()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.embeds = []
+        self.mentions = []
+        self.reactions = []
+        self.webhook_id = None
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.jump_url = f'https://discord.com/channels/{self.guild.id}/{channel.id}/{self.id}'
+
+    def to_message_reference_dict(self) -> dict:
+        return {'message_id': self.id, 'channel_id': self.channel.id, 'guild_id': self.guild.id,
+                'fail_if_not_exists': True}
+
+    def react(self, emoji: str) -> None:
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                reaction.count += 1
+                return
+
+        self.reactions.append(FakeReaction(emoji, 1))
+
+class FakeChannel:
+    """A text channel; sending to and fetching from it goes through the fake HTTP layer."""
+    def __init__(self, http: 'FakeHTTP', guild: 'FakeGuild', name: str):
+        self.http = http
+        self.id = snowflake()
+        self.guild = guild
+        self.name = name
+        self.mention = f'<#{self.id}>'
+        self.messages = {}
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.http.request('send')
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.http.request('fetch')
+        return self.messages[message_id]
+
+class FakeGuild:
+    def __init__(self, http: 'FakeHTTP', name: str, channels: int, members: int):
+        self.id = snowflake()
+        self.name = name
+        self.members = [FakeUser(f'{name}-user-{n}', administrator=n == 0) for n in range(members)]
+        self.text_channels = [FakeChannel(http, self, f'channel-{n}') for n in range(channels)]
+        self.text_channels.append(FakeChannel(http, self, 'mod-log'))
+        self.text_channels.append(FakeChannel(http, self, 'highlights'))
+        self.channels = list(self.text_channels)
+        self._channels = {c.id: c for c in self.text_channels}
+
+    def __str__(self) -> str:
+        return self.name
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)
+
+class FakeHTTP:
+    """Stands in for the Discord REST API: counts requests and sleeps for the given latency."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = {}
+        self.user: Optional[FakeUser] = None
+
+    async def request(self, kind: str) -> None:
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, channel_id: int, *, params) -> dict:
+        """Replaces discord.py's HTTPClient.send_message, returning a minimal message payload."""
+        await self.request('send')
+        return message_payload(channel_id, self.user.payload(), params.payload.get('content'), params.payload.get('embeds'))
+
+class World:
+    """A set of fake guilds, their channels and members, and the bot's own user."""
+    def __init__(self, http: FakeHTTP, guilds: int, channels: int, members: int):
+        self.http = http
+        self.guilds = [FakeGuild(http, f'guild-{n}', channels, members) for n in range(guilds)]
+        self.user = FakeUser('Heuristic Algorithmic', bot=True)
+        self._guilds = {g.id: g for g in self.guilds}
+        self._channels = {c.id: c for g in self.guilds for c in g.text_channels}
+        http.user = self.user
+
+    def config(self, threshold: int) -> list:
+        """Guild configuration entries for the world, with every feature turned on."""
+        return [{'name': g.name, 'id': g.id,
+                 'channels': {'moderator': 'mod-log', 'autopin': 'highlights'},
+                 'options': {'autopinThreshold': threshold, 'showModsDeletes': True, 'showModsEdits': True}}
+                for g in self.guilds]
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self._guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)
+
+    def install(self, bot) -> None:
+        """Point the bot at this world instead of the gateway, and at FakeHTTP instead of Discord."""
+        bot._connection.user = self.user
+        bot.get_guild = self.get_guild
+        bot.get_channel = self.get_channel
+        bot.http.send_message = self.http.send_message
+
+# Web service stand-ins
+
+class DogServer:
+    """A local random.dog: /woof names a random file, and the files are served (or fail) after a delay."""
+    def __init__(self, images: int, videos: int, video_bytes: int, latency: float = 0.0, failure_rate: float = 0.0,
+                 seed: int = 1):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = {}
+
+        # Video sizes spread either side of the given size, so that some are too big to upload.
+        self.files = {f'dog-{n}.jpg': 50 * 1024 for n in range(images)}
+        self.files.update({f'dog-{n}.mp4': self.rng.randint(video_bytes // 2, video_bytes * 2) for n in range(videos)})
+        self.names = list(self.files)
+
+        # Requests to answer 503 before going back to the failure rate.
+        self.fail_next = 0
+
+        # Requests being handled now, and the most at once.
+        self.active = 0
+        self.max_active = 0
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @web.middleware
+    async def _track(self, request: web.Request, handler) -> web.StreamResponse:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            return await handler(request)
+        finally:
+            self.active -= 1
+
+    async def _respond(self, kind: str) -> Optional[web.Response]:
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            return web.Response(status=503)
+
+        if self.rng.random() < self.failure_rate:
+            return web.Response(status=503)
+
+        return None
+
+    async def woof(self, request: web.Request) -> web.StreamResponse:
+        return await self._respond('woof') or web.Response(text=self.rng.choice(self.names))
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        failed = await self._respond(request.method)
+
+        if failed is not None:
+            return failed
+
+        size = self.files.get(request.match_info['name'])
+
+        if size is None:
+            return web.Response(status=404)
+
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(size)})
+
+        response = web.StreamResponse(headers={'Content-Length': str(size)})
+        await response.prepare(request)
+        chunk = bytes(64 * 1024)
+
+        for offset in range(0, size, len(chunk)):
+            await response.write(chunk[:size - offset])
+
+        return response
+
+    async def start(self) -> str:
+        """Start serving on a free local port; returns the base URL."""
+        app = web.Application(middlewares=[self._track])
+        app.router.add_get('/woof', self.woof)
+        app.router.add_get('/{name}', self.file)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+
+        port = self._runner.addresses[0][1]
+        return f'http://127.0.0.1:{port}'
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
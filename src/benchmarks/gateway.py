@@ -0,0 +1,379 @@
+# Gateway load benchmark - drives the bot's event handlers with synthetic traffic.
+#
+# A real HeuristicAlgorithmic instance, with its cogs loaded, is fed fake messages, edits,
+# deletes, pin reactions and commands across a configurable number of guilds and channels.
+# MongoDB is replaced by an in-process stand-in behind the real AsyncDatabase, and the
+# Discord REST API by FakeHTTP, each with an adjustable latency. Reports throughput, latency
+# percentiles and memory allocated per event, and saves the results as JSON so that runs of
+# different versions can be compared:
+#
+#   python3 -m benchmarks.gateway --events 20000 --out before.json
+#   python3 -m benchmarks.gateway --events 20000 --out after.json --compare before.json
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import aiohttp
+import discord
+import pymongo
+
+import __about__
+import bot as botmodule
+from bot import HeuristicAlgorithmic
+from configuration import Configuration
+from database import AsyncDatabase
+from pincounter import PIN_EMOJI
+
+from benchmarks.fakes import FakeHTTP, FakeMessage, MemoryDatabase, World
+
+KINDS = ('message', 'command', 'edit', 'delete', 'reaction')
+DEFAULT_MIX = 'message=70,command=10,edit=8,delete=6,reaction=6'
+
+COMMANDS = ('!ping', '!hello', '!echo {}')
+WORDS = ('the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'pinned', 'server',
+         'message', 'moderator', 'channel', 'hello', 'world', 'python', 'discord', 'bot')
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f'unknown event kind {kind!r}; expected one of {", ".join(KINDS)}')
+
+        mix[kind] = float(weight)
+
+    return mix
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class Traffic:
+    """Generates the synthetic events: each is a kind and a function starting its handler."""
+    def __init__(self, bot: HeuristicAlgorithmic, world: World, mix: dict, popular: int, rng: random.Random):
+        self.bot = bot
+        self.world = world
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.popular = popular
+        self.rng = rng
+        self.recent = []
+
+    def _sentence(self, lo: int, hi: int) -> str:
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(lo, hi)))
+
+    def _post(self, content: str) -> FakeMessage:
+        guild = self.rng.choice(self.world.guilds)
+        channel = self.rng.choice(guild.text_channels[:-2])
+        author = self.rng.choice(guild.members)
+
+        message = FakeMessage(self.bot._connection, channel, author, content)
+        channel.messages[message.id] = message
+        return message
+
+    def _target(self) -> FakeMessage:
+        # Reactions, edits and deletes concentrate on a small set of recent messages.
+        return self.rng.choice(self.recent[-self.popular:])
+
+    def message(self):
+        message = self._post(self._sentence(3, 40))
+        self.recent.append(message)
+        return lambda: self.bot.on_message(message)
+
+    def command(self):
+        message = self._post(self.rng.choice(COMMANDS).format(self._sentence(1, 8)))
+        return lambda: self.bot.on_message(message)
+
+    def edit(self):
+        message = self._target()
+        content = message.content + ' ' + self._sentence(1, 5)
+        payload = SimpleNamespace(message_id=message.id, channel_id=message.channel.id, guild_id=message.guild.id,
+                                  data={'content': content}, cached_message=None)
+
+        def start():
+            message.content = content
+            return self.bot.on_raw_message_edit(payload)
+
+        return start
+
+    def delete(self):
+        message = self.recent.pop(self.rng.randrange(max(len(self.recent) - self.popular, 0), len(self.recent)))
+        payload = SimpleNamespace(message_id=message.id, channel_id=message.channel.id, guild_id=message.guild.id,
+                                  cached_message=None)
+        return lambda: self.bot.on_raw_message_delete(payload)
+
+    def reaction(self):
+        message = self._target()
+        member = self.rng.choice(message.guild.members[1:] or message.guild.members)
+        payload = SimpleNamespace(message_id=message.id, channel_id=message.channel.id, guild_id=message.guild.id,
+                                  member=member, emoji=SimpleNamespace(name=PIN_EMOJI))
+
+        def start():
+            # Discord has counted the reaction by the time the event arrives.
+            message.react(PIN_EMOJI)
+            return self.bot.on_raw_reaction_add(payload)
+
+        return start
+
+    def generate(self, count: int) -> list:
+        # Seed some messages, so that the first edits, deletes and reactions have targets.
+        events = [('message', self.message()) for _ in range(self.popular)]
+
+        while len(events) < count:
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+
+            if kind in ('edit', 'delete', 'reaction') and len(self.recent) < self.popular:
+                kind = 'message'
+
+            events.append((kind, getattr(self, kind)()))
+
+        return events
+
+async def drive_closed(events: list) -> tuple:
+    """Run events back to back, each to completion; returns per-kind latencies and elapsed time."""
+    latencies = {kind: [] for kind in KINDS}
+    began = time.perf_counter()
+
+    for kind, start in events:
+        started = time.perf_counter()
+        await start()
+        latencies[kind].append(time.perf_counter() - started)
+
+    return latencies, time.perf_counter() - began
+
+async def drive_open(events: list, rate: float) -> tuple:
+    """Start events at a fixed rate regardless of completions, as the gateway would; latency
+    is measured from each event's scheduled arrival, so it includes any queueing."""
+    latencies = {kind: [] for kind in KINDS}
+    began = time.perf_counter()
+    tasks = []
+
+    async def run(kind, start, due):
+        await start()
+        latencies[kind].append(time.perf_counter() - due)
+
+    for n, (kind, start) in enumerate(events):
+        due = began + n / rate
+        delay = due - time.perf_counter()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tasks.append(asyncio.create_task(run(kind, start, due)))
+
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - began
+
+async def measure_allocations(events: list) -> dict:
+    """Run events one at a time under tracemalloc; returns per-kind mean net and peak bytes."""
+    totals = {kind: [0, 0, 0] for kind in KINDS}
+    tracemalloc.start()
+
+    try:
+        for kind, start in events:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await start()
+            after, peak = tracemalloc.get_traced_memory()
+
+            total = totals[kind]
+            total[0] += 1
+            total[1] += after - before
+            total[2] += peak - before
+    finally:
+        tracemalloc.stop()
+
+    return {kind: {'net_bytes': net / n, 'peak_bytes': peak / n} for kind, (n, net, peak) in totals.items() if n}
+
+def config_data(args, world: World) -> dict:
+    return {
+        'global': {
+            'discordSecret': 'benchmark',
+            'database': {'connectionString': 'memory://', 'databaseName': 'benchmark', 'maxWorkers': args.db_workers},
+            'modlog': {'flushInterval': 0.5, 'diffWorkers': 0},
+            'journal': {'enabled': False},
+            'metrics': {'enabled': False},
+            'profiling': {'watchdogThreshold': 0},
+        },
+        'guilds': world.config(args.threshold),
+    }
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    http = FakeHTTP(args.http_latency)
+    world = World(http, args.guilds, args.channels, args.members)
+    config = Configuration(config_data(args, world))
+
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(args.log_level)
+
+    memory = MemoryDatabase(latency=args.db_latency)
+    memory['pin'].create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    db = AsyncDatabase(memory, config.globals.mongodb_max_workers)
+
+    bot = HeuristicAlgorithmic(logger, config, None, db)
+
+    async with bot:
+        world.install(bot)
+        bot.session = aiohttp.ClientSession()
+
+        for extension in botmodule.initial_extensions:
+            await bot.load_extension(extension)
+
+        traffic = Traffic(bot, world, args.mix, args.popular, rng)
+
+        # Warm up, so that imports, caches and first-call costs are not measured.
+        await drive_closed(traffic.generate(min(args.events // 10, 2000)))
+
+        events = traffic.generate(args.events)
+
+        if args.rate > 0:
+            latencies, elapsed = await drive_open(events, args.rate)
+        else:
+            latencies, elapsed = await drive_closed(events)
+
+        allocations = {}
+
+        if args.alloc_events > 0:
+            allocations = await measure_allocations(traffic.generate(args.alloc_events))
+
+        # Let the moderator echoes and pending writes drain, then record what the bot did in response.
+        await bot.modlog.close()
+        await bot.writes.close()
+
+        effects = {
+            'http_requests': dict(http.requests),
+            'pins': len(memory['pin'].docs),
+            'db_calls': dict(memory.calls),
+            'pin_index': bot.pin_index.stats(),
+            'message_store': bot.messages.stats(),
+            'modlog': bot.modlog.stats(),
+        }
+
+    await asyncio.to_thread(db.close)
+
+    results = {}
+
+    for kind in KINDS:
+        samples = sorted(latencies[kind])
+
+        if not samples:
+            continue
+
+        results[kind] = {
+            'count': len(samples),
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': samples[-1] * 1000,
+        }
+        results[kind].update(allocations.get(kind, {}))
+
+    return {
+        'benchmark': 'gateway',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'discord.py': discord.__version__,
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'tolerance')},
+        'throughput': len(events) / elapsed,
+        'elapsed': elapsed,
+        'events': results,
+        'effects': effects,
+    }
+
+def report(results: dict) -> None:
+    print(f"{results['parameters']['events']:,} events in {results['elapsed']:.2f}s: "
+          f"{results['throughput']:,.0f} events/s")
+    print(f"{'event':<20} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'net B':>8} {'peak B':>8}")
+
+    for kind, r in results['events'].items():
+        print(f"{kind:<20} {r['count']:>7} {r['mean_ms']:>9.3f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} "
+              f"{r['p99_ms']:>9.3f} {r['max_ms']:>9.3f} {r.get('net_bytes', 0):>8.0f} {r.get('peak_bytes', 0):>8.0f}")
+
+    print(f"effects: {json.dumps(results['effects'])}")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print changes against a baseline run; returns False if anything regressed beyond tolerance."""
+    ok = True
+
+    def change(name: str, new: float, old: float, higher_is_better: bool = False) -> None:
+        nonlocal ok
+
+        if not old:
+            return
+
+        delta = (new - old) / old * 100
+        worse = -delta if higher_is_better else delta
+        flag = ''
+
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            ok = False
+
+        print(f'  {name:<24} {old:>12.3f} -> {new:>12.3f} ({delta:+.1f}%){flag}')
+
+    print(f"compared with {baseline['version']} ({baseline['timestamp']}):")
+    change('throughput (events/s)', results['throughput'], baseline['throughput'], higher_is_better=True)
+
+    for kind, r in results['events'].items():
+        old = baseline['events'].get(kind)
+
+        if old is not None:
+            change(f'{kind} p50 ms', r['p50_ms'], old['p50_ms'])
+            change(f'{kind} p99 ms', r['p99_ms'], old['p99_ms'])
+
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the bot\'s event handlers with synthetic gateway traffic.')
+    parser.add_argument('--events', type=int, default=20000, help='events to measure')
+    parser.add_argument('--rate', type=float, default=0, help='events per second to offer (0: back to back)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'event weights (default {DEFAULT_MIX})')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=20, help='text channels per guild')
+    parser.add_argument('--members', type=int, default=200, help='members per guild')
+    parser.add_argument('--popular', type=int, default=200, help='recent messages that edits, deletes and reactions target')
+    parser.add_argument('--threshold', type=int, default=3, help='autopin threshold')
+    parser.add_argument('--db-latency', type=float, default=0.001, help='seconds per MongoDB call')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--http-latency', type=float, default=0.05, help='seconds per Discord API request')
+    parser.add_argument('--alloc-events', type=int, default=2000, help='events to run under tracemalloc (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent change counted as a regression')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
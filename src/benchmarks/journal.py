@@ -0,0 +1,53 @@
+# Benchmark for the message journal: sustained ingest rate and cold-start replay time.
+
+import logging
+import os
+import tempfile
+import time
+
+from journal import MessageJournal
+from messagestore import MessageStore, StoredMessage
+
+EVENTS = 200000
+GUILDS = 4
+
+def main():
+    logger = logging.getLogger('benchmark')
+
+    with tempfile.TemporaryDirectory() as path:
+        journal = MessageJournal(logger, path, segment_seconds=3600, segment_bytes=16 * 1024 * 1024,
+                                 retain_segments=100, commit_interval=0.5, max_batch=1000, max_queue=EVENTS)
+        journal.start()
+
+        # Ingest: a mix of creates, with one edit and one delete for every ten messages.
+        start = time.perf_counter()
+
+        for n in range(EVENTS):
+            guild_id = n % GUILDS
+            if n % 10 == 8:
+                journal.record_edit(guild_id, n - 1, f'edited message {n - 1}')
+            elif n % 10 == 9:
+                journal.record_delete(guild_id, n - 2)
+            else:
+                journal.record_create(guild_id, StoredMessage(n, 1, 2, 'user#0001', f'message number {n} ' * 4))
+
+        queued = time.perf_counter() - start
+        journal.close()
+        written = time.perf_counter() - start
+
+        size = sum(os.path.getsize(f) for f in journal.segments())
+        print(f'enqueue: {EVENTS / queued:,.0f} events/s on the caller ({queued * 1e6 / EVENTS:.2f}us per event)')
+        print(f'ingest:  {EVENTS / written:,.0f} events/s sustained, {journal.commits} commits, '
+              f'{len(journal.segments())} segments, {size / 1048576:.1f} MB, {journal.dropped} dropped')
+
+        # Replay into a fresh store, as at startup.
+        store = MessageStore(256 * 1024 * 1024, GUILDS)
+        start = time.perf_counter()
+        replayed = journal.replay(store)
+        elapsed = time.perf_counter() - start
+
+        print(f'replay:  {replayed:,} events in {elapsed:.2f}s ({replayed / elapsed:,.0f} events/s); '
+              f'{len(store):,} messages restored')
+
+if __name__ == '__main__':
+    main()
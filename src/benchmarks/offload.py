@@ -0,0 +1,175 @@
+# Event offload benchmark - gateway loop latency while CPU-heavy edit events are handled.
+#
+# A stream of message edits (mostly small, some changing words throughout a long message,
+# diffed word by word) arrives at a given rate, and is handled three ways: entirely on the
+# loop; as the bot does by default, with the diff engine sending only the large diffs to its
+# worker; and with the whole event offloaded to the event worker pool. Meanwhile a ticker
+# stands in for the shard heartbeats, and measures how late the loop wakes it. Reports the
+# loop lag, how long events took from arrival to their notices being ready, and the
+# throughput:
+#
+#   python3 -m benchmarks.offload --events 400 --rate 100 --heavy 0.2 --workers 2
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import string
+import time
+
+import __about__
+import diffing
+from diffing import DiffEngine
+from modlog import MAX_EMBED_DESCRIPTION
+import offload
+from offload import EventOffload
+
+from benchmarks.gateway import percentile
+
+MODES = ('inline', 'diff-engine', 'offload')
+
+# How often the stand-in heartbeat ticks.
+TICK = 0.01
+
+def words(n: int, rng: random.Random) -> str:
+    return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(n))
+
+def make_edits(count: int, heavy: float, rng: random.Random) -> list:
+    edits = []
+
+    for _ in range(count):
+        if rng.random() < heavy:
+            # A long message with every third word changed: the worst case for a word diff.
+            before = words(700, rng)[:4000].split(' ')
+            after = [w[::-1] if i % 3 == 0 else w for i, w in enumerate(before)]
+            edits.append((' '.join(before), ' '.join(after)))
+        else:
+            before = words(20, rng)
+            edits.append((before, before + ' ' + words(2, rng)))
+
+    return edits
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000 if samples else 0.0,
+    }
+
+async def ticker(lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(max(time.perf_counter() - started - TICK, 0.0))
+
+async def run_mode(mode: str, args, edits: list) -> dict:
+    logger = logging.getLogger('benchmark')
+    differ = DiffEngine(diffing.WORD, args.workers if mode == 'diff-engine' else 0, args.max_parts)
+    events = EventOffload(logger, args.workers if mode == 'offload' else 0, (offload.MESSAGE_EDIT,))
+
+    # Start the workers first, as the bot does, so their start-up isn't counted.
+    events.start()
+    if mode == 'diff-engine':
+        await asyncio.get_running_loop().run_in_executor(differ._pool(), os.getpid)
+
+    lags, latencies = [], []
+    notices = 0
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+
+    async def handle(before: str, after: str, arrived: float) -> None:
+        nonlocal notices
+
+        event = {'modchan_id': 1, 'channel': 'general', 'author': 'someone', 'before': before, 'after': after,
+                 'mode': differ.mode, 'limit': MAX_EMBED_DESCRIPTION, 'max_parts': differ.max_parts}
+
+        if not events.offloads(offload.MESSAGE_EDIT):
+            event['parts'] = await differ.diff(before, after, MAX_EMBED_DESCRIPTION - len(offload.EDIT_FENCE.format('')))
+
+        notices += len(await events.run(offload.MESSAGE_EDIT, event))
+        latencies.append(time.perf_counter() - arrived)
+
+    began = time.perf_counter()
+    tasks = []
+
+    for n, (before, after) in enumerate(edits):
+        due = began + n / args.rate
+        delay = due - time.perf_counter()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tasks.append(asyncio.create_task(handle(before, after, due)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    stop.set()
+    await tick_task
+    differ.close()
+    events.close()
+
+    return {
+        'loop_lag': summarize(lags),
+        'late_ticks': sum(1 for lag in lags if lag > args.late),
+        'event_latency': summarize(latencies),
+        'events_per_second': len(edits) / elapsed,
+        'notices': notices,
+        'offload': events.stats(),
+    }
+
+async def run(args) -> dict:
+    edits = make_edits(args.events, args.heavy, random.Random(args.seed))
+    results = {mode: await run_mode(mode, args, edits) for mode in MODES}
+
+    return {
+        'benchmark': 'offload',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'modes': results,
+    }
+
+def report(results: dict) -> None:
+    p = results['parameters']
+    print(f"{p['events']} edits at {p['rate']:.0f}/s, {p['heavy']:.0%} heavy; {p['workers']} workers; {results['cpus']} CPUs")
+    print(f"{'mode':<12} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'late':>5} {'event p50':>10} {'event p99':>10} {'events/s':>9}")
+
+    for mode, r in results['modes'].items():
+        lag, ev = r['loop_lag'], r['event_latency']
+        print(f"{mode:<12} {lag['p50_ms']:>8.2f} {lag['p99_ms']:>8.2f} {lag['max_ms']:>8.2f} {r['late_ticks']:>5} "
+              f"{ev['p50_ms']:>10.2f} {ev['p99_ms']:>10.2f} {r['events_per_second']:>9.1f}")
+
+    print(f"(milliseconds; 'late' counts ticks more than {p['late'] * 1000:.0f}ms late)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure gateway loop latency while edit events are handled inline or offloaded.')
+    parser.add_argument('--events', type=int, default=400)
+    parser.add_argument('--rate', type=float, default=100.0, help='edits arriving per second')
+    parser.add_argument('--heavy', type=float, default=0.2, help='share of edits changing words throughout a long message')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-parts', type=int, default=2)
+    parser.add_argument('--late', type=float, default=0.05, help='seconds past which a tick counts as late')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
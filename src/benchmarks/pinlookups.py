@@ -0,0 +1,159 @@
+# Pin lookup benchmark - event loop lag while pin lookups wait on a slow database.
+#
+# Pin lookups (the find_one that pin_message makes on an index miss) arrive at a given rate,
+# faster than the in-memory stand-in for MongoDB can answer them, slowed to a given latency
+# per call as a slow or distant server would be, so that many are waiting at once. They are made two ways: through AsyncDatabase, as the bot
+# makes them, and calling the blocking collection directly on the loop, as the bot once did.
+# Meanwhile a ticker stands in for the shard heartbeats, and measures how late the loop wakes
+# it. The run fails if, through AsyncDatabase, the loop lag goes past the bound given:
+#
+#   python3 -m benchmarks.pinlookups --lookups 2000 --rate 1000 --db-latency 0.02 --max-lag 0.05
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import pymongo
+
+import __about__
+from database import AsyncDatabase
+
+from benchmarks.fakes import MemoryDatabase, snowflake
+from benchmarks.offload import summarize, ticker
+
+MODES = ('async', 'blocking')
+
+def make_pins(memory: MemoryDatabase, guilds: list, count: int, rng: random.Random) -> list:
+    """Fill the pin collection; returns the (guild ID, message ID) pairs, pinned or not, to look up."""
+    pin = memory['pin']
+    pin.create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    keys = [(rng.choice(guilds), snowflake()) for _ in range(count)]
+
+    for guild_id, message_id in keys[::2]:
+        pin.docs.append({'guild_id': guild_id, 'message_id': message_id})
+
+    return keys
+
+async def run_mode(mode: str, args, memory: MemoryDatabase, keys: list) -> dict:
+    db = AsyncDatabase(memory, args.db_workers)
+    pin = db['pin']
+    found = 0
+
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+
+    # Let the ticker settle before the lookups start.
+    await asyncio.sleep(0.05)
+
+    async def lookup(guild_id: int, message_id: int) -> None:
+        nonlocal found
+        query = {'guild_id': guild_id, 'message_id': message_id}
+
+        if mode == 'async':
+            result = await pin.find_one(query)
+        else:
+            result = pin.sync.find_one(query)
+            await asyncio.sleep(0)
+
+        if result is not None:
+            found += 1
+
+    began = time.perf_counter()
+    tasks = []
+
+    for n, (guild_id, message_id) in enumerate(keys):
+        delay = began + n / args.rate - time.perf_counter()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tasks.append(asyncio.create_task(lookup(guild_id, message_id)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    stop.set()
+    await tick_task
+    await asyncio.to_thread(db.close)
+
+    return {
+        'loop_lag': summarize(lags),
+        'late_ticks': sum(1 for lag in lags if lag > args.max_lag),
+        'lookups_per_second': len(keys) / elapsed,
+        'found': found,
+    }
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    memory = MemoryDatabase(latency=args.db_latency)
+    keys = make_pins(memory, [snowflake() for _ in range(args.guilds)], args.lookups, rng)
+
+    # Leave what is already loaded out of the collector's full passes, whose pauses (tens of
+    # milliseconds, over discord.py and the rest) would otherwise be taken for database waits.
+    gc.freeze()
+
+    return {
+        'benchmark': 'pinlookups',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'modes': {mode: await run_mode(mode, args, memory, keys) for mode in args.modes},
+    }
+
+def report(results: dict) -> None:
+    p = results['parameters']
+    print(f"{p['lookups']} pin lookups arriving at {p['rate']:.0f}/s, taking {p['db_latency'] * 1000:.0f}ms each; "
+          f"{p['db_workers']} database workers")
+    print(f"{'mode':<10} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'late':>5} {'lookups/s':>10} {'found':>6}")
+
+    for mode, r in results['modes'].items():
+        lag = r['loop_lag']
+        print(f"{mode:<10} {lag['p50_ms']:>8.2f} {lag['p99_ms']:>8.2f} {lag['max_ms']:>8.2f} {r['late_ticks']:>5} "
+              f"{r['lookups_per_second']:>10.1f} {r['found']:>6}")
+
+    print(f"(milliseconds; 'late' counts ticks more than {p['max_lag'] * 1000:.0f}ms late)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure event loop lag while concurrent pin lookups wait on a slow database.')
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=1000.0, help='lookups arriving per second')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.02, help='seconds per MongoDB call')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--max-lag', type=float, default=0.05, help='loop lag, in seconds, that fails the run')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    # Through AsyncDatabase, however slow the database, the loop should never wait on it.
+    measured = results['modes'].get('async')
+
+    if measured is not None:
+        if measured['found'] != (args.lookups + 1) // 2:
+            print(f"FAILED: {measured['found']} pinned messages found, of {(args.lookups + 1) // 2}")
+            sys.exit(1)
+
+        if measured['loop_lag']['max_ms'] > args.max_lag * 1000:
+            print(f"FAILED: loop lag reached {measured['loop_lag']['max_ms']:.2f}ms through AsyncDatabase")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# Command pre-filter benchmark - the per-message cost of on_message, with and without the filter.
+#
+# The same messages are fed to the bot's on_message twice over: once as it used to handle
+# them, with every message going to discord.py's process_commands (and so having a Context
+# built and its prefix resolved through when_mentioned_or), and once as it does now, with the
+# prefix pre-filter in front. Ordinary chat is the interesting case; a share of commands can
+# be mixed in to check they still get through. Reports the time and memory allocated per
+# message for each:
+#
+#   python3 -m benchmarks.prefilter --messages 50000 --commands 0.01 --out prefilter.json
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import random
+import time
+import tracemalloc
+
+import aiohttp
+import discord
+from discord.ext import commands
+import pymongo
+
+import __about__
+import bot as botmodule
+from bot import HeuristicAlgorithmic
+from configuration import Configuration
+from database import AsyncDatabase
+
+from benchmarks.fakes import FakeHTTP, FakeMessage, MemoryDatabase, World
+from benchmarks.gateway import COMMANDS, WORDS, config_data, percentile
+
+MODES = ('unfiltered', 'filtered')
+
+def make_messages(bot: HeuristicAlgorithmic, world: World, count: int, commands_share: float, rng: random.Random) -> list:
+    """(kind, message) pairs: chat, or (with the given probability) a command."""
+    messages = []
+
+    for _ in range(count):
+        guild = rng.choice(world.guilds)
+        channel = rng.choice(guild.text_channels[:-2])
+        author = rng.choice(guild.members)
+
+        if rng.random() < commands_share:
+            kind, content = 'command', rng.choice(COMMANDS).format(' '.join(rng.choices(WORDS, k=rng.randint(1, 8))))
+        else:
+            kind, content = 'chat', ' '.join(rng.choices(WORDS, k=rng.randint(3, 40)))
+
+        messages.append((kind, FakeMessage(bot._connection, channel, author, content)))
+
+    return messages
+
+async def measure(bot: HeuristicAlgorithmic, messages: list, alloc_messages: int) -> dict:
+    """Time on_message for each message, then trace the allocations of a sample of them."""
+    samples = {}
+
+    for kind, message in messages:
+        started = time.perf_counter()
+        await bot.on_message(message)
+        samples.setdefault(kind, []).append(time.perf_counter() - started)
+
+    allocations = {}
+    tracemalloc.start()
+
+    try:
+        for kind, message in messages[:alloc_messages]:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await bot.on_message(message)
+            after, peak = tracemalloc.get_traced_memory()
+
+            total = allocations.setdefault(kind, [0, 0, 0])
+            total[0] += 1
+            total[1] += after - before
+            total[2] += peak - before
+    finally:
+        tracemalloc.stop()
+
+    results = {}
+
+    for kind, times in sorted(samples.items()):
+        times.sort()
+        n, net, peak = allocations.get(kind, (0, 0, 0))
+        results[kind] = {
+            'count': len(times),
+            'mean_us': sum(times) / len(times) * 1e6,
+            'p50_us': percentile(times, 0.50) * 1e6,
+            'p99_us': percentile(times, 0.99) * 1e6,
+            'net_bytes': net / n if n else 0.0,
+            'peak_bytes': peak / n if n else 0.0,
+        }
+
+    return results
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    http = FakeHTTP(0.0)
+    world = World(http, args.guilds, args.channels, args.members)
+    config = Configuration(config_data(args, world))
+
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(args.log_level)
+
+    memory = MemoryDatabase()
+    memory['pin'].create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    db = AsyncDatabase(memory, config.globals.mongodb_max_workers)
+
+    bot = HeuristicAlgorithmic(logger, config, None, db)
+    results = {}
+
+    async with bot:
+        world.install(bot)
+        bot.session = aiohttp.ClientSession()
+
+        for extension in botmodule.initial_extensions:
+            await bot.load_extension(extension)
+
+        messages = make_messages(bot, world, args.messages, args.commands, rng)
+        filtered = (bot.command_prefix, bot.prefixes.may_be_command)
+        unfiltered = (commands.when_mentioned_or(config.globals.command_prefix), lambda content, gc, user_id: True)
+
+        for mode in MODES:
+            bot.command_prefix, bot.prefixes.may_be_command = filtered if mode == 'filtered' else unfiltered
+
+            # Warm up, so that first-call costs are not measured.
+            await measure(bot, messages[:min(len(messages) // 10, 2000)], 0)
+            results[mode] = await measure(bot, messages, args.alloc_messages)
+
+        await bot.modlog.close()
+
+    await asyncio.to_thread(db.close)
+
+    return {
+        'benchmark': 'prefilter',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'discord.py': discord.__version__,
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'modes': results,
+    }
+
+def report(results: dict) -> None:
+    print(f"{'mode':<12} {'messages':<10} {'count':>7} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'net B':>8} {'peak B':>8}")
+
+    for mode, kinds in results['modes'].items():
+        for kind, r in kinds.items():
+            print(f"{mode:<12} {kind:<10} {r['count']:>7} {r['mean_us']:>9.2f} {r['p50_us']:>9.2f} {r['p99_us']:>9.2f} "
+                  f"{r['net_bytes']:>8.0f} {r['peak_bytes']:>8.0f}")
+
+    before = results['modes']['unfiltered'].get('chat')
+    after = results['modes']['filtered'].get('chat')
+
+    if before and after:
+        print(f"chat messages: {before['mean_us'] - after['mean_us']:.2f}us "
+              f"({(1 - after['mean_us'] / before['mean_us']) * 100:.0f}%) less per message with the pre-filter")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the per-message cost of on_message with and without the command pre-filter.')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--commands', type=float, default=0.0, help='share of messages that are commands')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=10, help='text channels per guild')
+    parser.add_argument('--members', type=int, default=100, help='members per guild')
+    parser.add_argument('--threshold', type=int, default=3, help='autopin threshold')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--alloc-messages', type=int, default=2000, help='messages traced for allocations (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
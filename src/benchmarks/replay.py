@@ -0,0 +1,314 @@
+# Gateway replay - plays a recorded gateway capture back into the bot, timing its handlers.
+#
+# The capture's dispatch events are fed through discord.py's own parsers, exactly as if
+# they had arrived from the gateway, at the recorded pace, some multiple of it, or as fast
+# as possible. Discord's REST API is answered locally from what the capture has shown
+# (messages sent, fetched messages and their reactions), and MongoDB is the in-process
+# stand-in. Results use the same format as benchmarks.gateway, so runs compare the same way:
+#
+#   python3 -m benchmarks.replay captures/gateway-20240101T000000Z.jsonl.gz --speed 10 --out before.json
+#   python3 -m benchmarks.replay captures/gateway-20240101T000000Z.jsonl.gz --speed 10 --compare before.json
+
+import argparse
+import asyncio
+from collections import defaultdict
+import datetime
+import json
+import logging
+import platform
+import sys
+import time
+from types import SimpleNamespace
+
+import aiohttp
+import discord
+import pymongo
+
+import __about__
+import bot as botmodule
+from bot import HeuristicAlgorithmic
+from capture import read_capture
+from configuration import Configuration
+from database import AsyncDatabase
+
+from benchmarks.fakes import FakeHTTP, MemoryDatabase, message_payload
+from benchmarks.gateway import compare, percentile, report
+
+def _emoji_key(emoji: dict) -> str:
+    # Custom emoji are identified by ID, Unicode emoji by the character itself.
+    return emoji.get('id') or emoji.get('name')
+
+class ReplayREST:
+    """Answers the bot's Discord REST requests locally, from what the capture has shown."""
+    def __init__(self, http: FakeHTTP):
+        self.http = http
+        self.author = {'id': '1', 'username': 'Heuristic Algorithmic', 'discriminator': '0', 'avatar': None, 'bot': True}
+        self.messages = {}
+        self.reactions = {}
+
+    def observe(self, event: str, data: dict) -> None:
+        """Follow the messages and reactions in the capture, to answer fetches as Discord would."""
+        if event == 'MESSAGE_CREATE':
+            self.messages[data['id']] = data
+        elif event == 'MESSAGE_UPDATE' and data.get('id') in self.messages and 'content' in data:
+            self.messages[data['id']] = dict(self.messages[data['id']], content=data['content'])
+        elif event == 'MESSAGE_DELETE':
+            self.messages.pop(data['id'], None)
+            self.reactions.pop(data['id'], None)
+        elif event == 'MESSAGE_DELETE_BULK':
+            for message_id in data['ids']:
+                self.messages.pop(message_id, None)
+                self.reactions.pop(message_id, None)
+        elif event == 'MESSAGE_REACTION_ADD':
+            counts = self.reactions.setdefault(data['message_id'], {})
+            _, count = counts.get(_emoji_key(data['emoji']), (None, 0))
+            counts[_emoji_key(data['emoji'])] = (data['emoji'], count + 1)
+        elif event == 'MESSAGE_REACTION_REMOVE':
+            counts = self.reactions.get(data['message_id'], {})
+            key = _emoji_key(data['emoji'])
+
+            if key in counts:
+                emoji, count = counts[key]
+                counts[key] = (emoji, max(count - 1, 0))
+        elif event == 'MESSAGE_REACTION_REMOVE_ALL':
+            self.reactions.pop(data['message_id'], None)
+        elif event == 'MESSAGE_REACTION_REMOVE_EMOJI':
+            self.reactions.get(data['message_id'], {}).pop(_emoji_key(data['emoji']), None)
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        """Replaces discord.py's HTTPClient.request."""
+        await self.http.request(f'{route.method} {route.path}')
+
+        if route.path == '/channels/{channel_id}/messages':
+            if route.method != 'POST':
+                return []
+
+            payload = kwargs.get('json') or (json.loads(form[0]['value']) if form else {})
+            return message_payload(route.channel_id, self.author, payload.get('content'), payload.get('embeds'))
+
+        if route.path == '/channels/{channel_id}/messages/{message_id}' and route.method == 'GET':
+            message_id = route.url.rsplit('/', 1)[-1]
+            data = self.messages.get(message_id)
+
+            if data is None:
+                raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), {'code': 10008, 'message': 'Unknown Message'})
+
+            reactions = [{'emoji': emoji, 'count': count, 'me': False}
+                         for emoji, count in self.reactions.get(message_id, {}).values() if count > 0]
+            return dict(data, reactions=reactions)
+
+        return None
+
+class Replayer:
+    """Feeds capture events to a bot through discord.py's gateway parsers."""
+    def __init__(self, bot: HeuristicAlgorithmic, rest: ReplayREST, logger: logging.Logger):
+        self.bot = bot
+        self.rest = rest
+        self.logger = logger
+        self.parsers = bot._connection.parsers
+        self.latencies = defaultdict(list)
+        self.fed = 0
+        self.skipped = 0
+        self.failed = 0
+
+        # Time every handler the events are dispatched to.
+        run_event = bot._run_event
+
+        async def timed(coro, event_name, *args, **kwargs):
+            started = time.perf_counter()
+
+            try:
+                await run_event(coro, event_name, *args, **kwargs)
+            finally:
+                self.latencies[event_name].append(time.perf_counter() - started)
+
+        bot._run_event = timed
+
+    def feed(self, event: str, data: dict) -> None:
+        self.rest.observe(event, data)
+
+        if event == 'READY':
+            # Only the bot's own identity is taken from READY; the guilds follow as GUILD_CREATEs.
+            self.bot._connection.user = discord.ClientUser(state=self.bot._connection, data=data['user'])
+            self.rest.author = data['user']
+            return
+
+        parser = self.parsers.get(event)
+
+        if parser is None:
+            self.skipped += 1
+            return
+
+        try:
+            parser(data)
+        except Exception:
+            self.failed += 1
+            self.logger.debug('Failed to parse a %s event.', event, exc_info=True)
+
+        self.fed += 1
+
+    async def settle(self) -> None:
+        """Wait for every dispatched handler to finish."""
+        current = asyncio.current_task()
+
+        while True:
+            pending = [t for t in asyncio.all_tasks() if t is not current and t.get_name().startswith('discord.py: ')]
+
+            if not pending:
+                return
+
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def play(self, events, speed: float, start: float) -> tuple:
+        """Play events; those before start are fast-forwarded, untimed, to build up state.
+
+        Returns the time taken and the furthest the replay fell behind the requested pace."""
+        began = None
+        first = None
+        behind = 0.0
+
+        for t, event, data in events:
+            if t < start:
+                self.feed(event, data)
+                await asyncio.sleep(0)
+                continue
+
+            if began is None:
+                # Fast-forward over: measure from here.
+                await self.settle()
+                self.latencies.clear()
+                self.rest.http.requests.clear()
+                self.fed = 0
+                began = time.perf_counter()
+                first = t
+
+            if speed > 0:
+                delay = began + (t - first) / speed - time.perf_counter()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    behind = max(behind, -delay)
+
+            self.feed(event, data)
+
+            # Let handlers run between events, as they would between gateway messages.
+            await asyncio.sleep(0)
+
+        await self.settle()
+        return time.perf_counter() - (began or time.perf_counter()), behind
+
+def config_data(args, header: dict) -> dict:
+    return {
+        'global': {
+            'discordSecret': 'replay',
+            'database': {'connectionString': 'memory://', 'databaseName': 'replay', 'maxWorkers': args.db_workers},
+            'modlog': {'diffWorkers': args.diff_workers},
+            'journal': {'enabled': False},
+            'metrics': {'enabled': False},
+            'profiling': {'watchdogThreshold': 0},
+        },
+        'guilds': header['guilds'],
+    }
+
+async def run(args) -> dict:
+    header, events = read_capture(args.capture)
+    config = Configuration(config_data(args, header))
+
+    logger = logging.getLogger('replay')
+    logger.setLevel(args.log_level)
+
+    memory = MemoryDatabase(latency=args.db_latency)
+    memory['pin'].create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    db = AsyncDatabase(memory, config.globals.mongodb_max_workers)
+
+    http = FakeHTTP(args.http_latency)
+    rest = ReplayREST(http)
+    bot = HeuristicAlgorithmic(logger, config, None, db)
+
+    async with bot:
+        bot.http.request = rest.request
+        bot.session = aiohttp.ClientSession()
+
+        for extension in botmodule.initial_extensions:
+            await bot.load_extension(extension)
+
+        replayer = Replayer(bot, rest, logger)
+        elapsed, behind = await replayer.play(events, args.speed, args.start)
+
+        await bot.modlog.close()
+        await bot.writes.close()
+
+        effects = {
+            'http_requests': dict(http.requests),
+            'pins': len(memory['pin'].docs),
+            'db_calls': dict(memory.calls),
+            'message_store': bot.messages.stats(),
+            'modlog': bot.modlog.stats(),
+            'skipped_events': replayer.skipped,
+            'failed_events': replayer.failed,
+            'max_behind_seconds': behind,
+        }
+
+    await asyncio.to_thread(db.close)
+
+    results = {}
+
+    for name, samples in sorted(replayer.latencies.items()):
+        samples.sort()
+        results[name] = {
+            'count': len(samples),
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': samples[-1] * 1000,
+        }
+
+    return {
+        'benchmark': 'replay',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'discord.py': discord.__version__,
+        'capture': {k: v for k, v in header.items() if k != 'guilds'},
+        'parameters': {'capture': args.capture, 'speed': args.speed, 'start': args.start, 'events': replayer.fed,
+                       'db_latency': args.db_latency, 'http_latency': args.http_latency},
+        'throughput': replayer.fed / elapsed if elapsed > 0 else 0.0,
+        'elapsed': elapsed,
+        'events': results,
+        'effects': effects,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a gateway capture into the bot and time its event handlers.')
+    parser.add_argument('capture', help='capture file recorded with global.capture enabled')
+    parser.add_argument('--speed', type=float, default=1.0, help='multiple of the recorded pace (0: as fast as possible)')
+    parser.add_argument('--start', type=float, default=0.0,
+                        help='seconds into the capture to start measuring; earlier events are fast-forwarded')
+    parser.add_argument('--db-latency', type=float, default=0.001, help='seconds per MongoDB call')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--diff-workers', type=int, default=0, help='processes for large edit diffs')
+    parser.add_argument('--http-latency', type=float, default=0.05, help='seconds per Discord API request')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent change counted as a regression')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# Write-behind benchmark - database round-trips for pin-style records, direct and batched.
+#
+# The same stream of records (some repeated, as when two pin requests for a message race) is
+# written to the in-process MongoDB stand-in two ways: one insert_one per record, as pins
+# used to be recorded, and through the WriteBehind buffer. Records arrive at a given rate
+# from concurrent callers. Reports round-trips per thousand records, how long callers wait,
+# how long until everything is written, and that both ways store the same records:
+#
+#   python3 -m benchmarks.writes --records 5000 --rate 2000 --db-latency 0.002
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import random
+import time
+
+import pymongo
+
+import __about__
+from database import AsyncDatabase
+from writebehind import WriteBehind
+
+from benchmarks.fakes import MemoryDatabase
+from benchmarks.gateway import percentile
+
+MODES = ('direct', 'write-behind')
+
+def make_records(count: int, guilds: int, repeats: float, rng: random.Random) -> list:
+    records = []
+
+    for n in range(count):
+        if records and rng.random() < repeats:
+            records.append(dict(rng.choice(records)))
+        else:
+            records.append({'guild_id': rng.randrange(guilds), 'message_id': n})
+
+    return records
+
+async def run_mode(mode: str, args, records: list) -> dict:
+    memory = MemoryDatabase(latency=args.db_latency)
+    memory['pin'].create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    db = AsyncDatabase(memory, args.db_workers)
+    writes = WriteBehind(logging.getLogger('benchmark'), db, args.flush_interval, args.max_batch, len(records))
+
+    waits = []
+    duplicates = 0
+
+    async def record(doc: dict, due: float) -> None:
+        nonlocal duplicates
+
+        if mode == 'direct':
+            try:
+                await db['pin'].insert_one(dict(doc))
+            except pymongo.errors.DuplicateKeyError:
+                duplicates += 1
+        else:
+            writes.insert('pin', dict(doc), key=('guild_id', 'message_id'))
+
+        waits.append(time.perf_counter() - due)
+
+    began = time.perf_counter()
+    tasks = []
+
+    for n, doc in enumerate(records):
+        due = began + n / args.rate
+        delay = due - time.perf_counter()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tasks.append(asyncio.create_task(record(doc, due)))
+
+    await asyncio.gather(*tasks)
+    await writes.close()
+    elapsed = time.perf_counter() - began
+
+    await asyncio.to_thread(db.close)
+
+    waits.sort()
+    calls = sum(memory.calls.values())
+
+    return {
+        'round_trips': calls,
+        'round_trips_per_1000': calls / len(records) * 1000,
+        'db_calls': dict(memory.calls),
+        'wait_mean_ms': sum(waits) / len(waits) * 1000,
+        'wait_p99_ms': percentile(waits, 0.99) * 1000,
+        'elapsed': elapsed,
+        'stored': len(memory['pin'].docs),
+        'duplicates': duplicates,
+        'writes': writes.stats(),
+    }
+
+async def run(args) -> dict:
+    records = make_records(args.records, args.guilds, args.repeats, random.Random(args.seed))
+    results = {mode: await run_mode(mode, args, records) for mode in MODES}
+
+    return {
+        'benchmark': 'writes',
+        'version': str(__about__.__version__),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'out'},
+        'unique_records': len({(r['guild_id'], r['message_id']) for r in records}),
+        'modes': results,
+    }
+
+def report(results: dict) -> None:
+    print(f"{results['parameters']['records']:,} records ({results['unique_records']:,} unique) "
+          f"at {results['parameters']['rate']:,.0f}/s")
+    print(f"{'mode':<14} {'round-trips':>11} {'per 1000':>9} {'wait ms':>9} {'p99 ms':>9} {'total s':>8} {'stored':>7}")
+
+    for mode, r in results['modes'].items():
+        print(f"{mode:<14} {r['round_trips']:>11} {r['round_trips_per_1000']:>9.1f} {r['wait_mean_ms']:>9.3f} "
+              f"{r['wait_p99_ms']:>9.3f} {r['elapsed']:>8.2f} {r['stored']:>7}")
+
+    direct, batched = (results['modes'][m] for m in MODES)
+    print(f"round-trips saved per 1000 records: {direct['round_trips_per_1000'] - batched['round_trips_per_1000']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare direct and write-behind database writes of pin records.')
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=2000.0, help='records arriving per second')
+    parser.add_argument('--repeats', type=float, default=0.05, help='share of records repeating an earlier one')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.002, help='seconds per MongoDB call')
+    parser.add_argument('--db-workers', type=int, default=4)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--max-batch', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
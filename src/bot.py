@@ -2,93 +2,421 @@
 
 # Imports
 
-import aiohttp
-from difflib import unified_diff
+import asyncio
 import discord
 from discord.ext import commands
 import logging
 import pymongo
-import traceback
-from typing import Union
+import threading
+import time
+from typing import Optional, Union
 
 import __about__
+from audit import AuditLog
+from backfill import AutopinBackfill
+from capture import GatewayRecorder
+from channelcache import ChannelCache
+import cluster
 import configuration
 from context import Context
+from database import AsyncDatabase
+from diffing import DiffEngine
+import features
 import helper
+import httpclient
+import memory
+import offload
+from offload import EventOffload
+from journal import MessageJournal
+from messagestore import MessageStore, StoredMessage
+from metrics import Metrics, MetricsServer
+from modlog import MAX_EMBED_DESCRIPTION, ModEchoPipeline
+from profiler import LoopWatchdog
+from pincounter import PIN_EMOJI, PinReactionCounter, count_pins
+from pinindex import PinIndex
+from prefixes import PrefixTable
+from search import MessageSearch
+from ratelimit import CommandLimiter, RateLimited
+from writebehind import WriteBehind
 
 # Extension configuration
 initial_extensions = (
     'cogs.core',
     'cogs.admin',
     'cogs.botadmin',
+)
+
+# Extensions with rarely-used commands, loaded the first time one of their commands (or help) is asked for.
+lazy_extensions = (
     'cogs.dev',
     'cogs.random',
 )
 
+def command_prefixes(bot: 'HeuristicAlgorithmic', message: discord.Message) -> tuple:
+    """The prefixes a command in this message may start with (discord.py's command_prefix)."""
+    return bot.prefixes.prefixes(bot.config.guild_config(message.guild), bot.user.id)
+
 # Bot class
-class HeuristicAlgorithmic (commands.Bot):
+class HeuristicAlgorithmic (commands.AutoShardedBot):
+    audit: AuditLog
+    backfill: AutopinBackfill
+    backfill_resumed: bool
     bot_app_info: discord.AppInfo
+    channels: ChannelCache
+    cluster_id: Optional[int]
     config: configuration.Configuration
+    connect_started: Optional[float]
     connection: pymongo.MongoClient
-    db: pymongo.database.Database
+    db: AsyncDatabase
+    differ: DiffEngine
+    extension_flights: helper.SingleFlight
+    fetch_flights: helper.SingleFlight
+    gateway_plan: features.GatewayPlan
+    http_retry: httpclient.RetryPolicy
+    journal: Optional[MessageJournal]
+    lazy_extensions_loaded: bool
+    limiter: CommandLimiter
     logger: logging.Logger
+    loop_thread_id: int
+    message_logger: logging.Logger
+    messages: MessageStore
+    metrics: Metrics
+    metrics_server: Optional[MetricsServer]
+    modlog: ModEchoPipeline
+    offload: EventOffload
     owner_id: int
-
-    def __init__ (self, logger: logging.Logger, config: configuration.Configuration, connection: pymongo.MongoClient, db: pymongo.database.Database):
-
+    pin_counts: PinReactionCounter
+    pin_flights: helper.SingleFlight
+    pin_index: PinIndex
+    prefixes: PrefixTable
+    recorder: Optional[GatewayRecorder]
+    search: MessageSearch
+    startup: helper.StartupTimer
+    watchdog: Optional[LoopWatchdog]
+    writes: WriteBehind
+
+    def __init__ (self, logger: logging.Logger, config: configuration.Configuration, connection: pymongo.MongoClient, db: AsyncDatabase,
+                  shard_ids: Optional[list] = None, shard_count: Optional[int] = None, startup: Optional[helper.StartupTimer] = None,
+                  cluster_id: Optional[int] = None):
+
+        self.startup = startup or helper.StartupTimer()
+        self.connect_started = None
         self.logger = logger
+        self.cluster_id = cluster_id
+        self.message_logger = logger.getChild('messages')
         self.config = config
         self.connection = connection
         self.db = db
-
-        intents = discord.Intents.default()
-        intents.bans = True
-        intents.members = True
-        intents.messages = True
-        intents.message_content = True
-        intents.guild_reactions = True
-
-        super().__init__(command_prefix=commands.when_mentioned_or('!'),
+        self.metrics = Metrics()
+        self.db.observer = self.metrics.database.observe
+        self.pin_index = PinIndex(config.pin_index_size())
+        self.channels = ChannelCache(config)
+        self.prefixes = PrefixTable(config.globals.command_prefix)
+        self.http_retry = httpclient.retry_policy(config.globals)
+        self.limiter = CommandLimiter(config.globals.command_limits, config.globals.command_limit_buckets)
+        self.pin_counts = PinReactionCounter(config.globals.reaction_counter_size)
+        self.fetch_flights = helper.SingleFlight()
+        self.pin_flights = helper.SingleFlight()
+        self.extension_flights = helper.SingleFlight()
+        self.lazy_extensions_loaded = False
+        self.backfill_resumed = False
+        self.modlog = ModEchoPipeline(logger.getChild('modlog'),
+                                      config.globals.modlog_flush_interval,
+                                      config.globals.modlog_max_queue)
+        self.writes = WriteBehind(logger.getChild('writes'),
+                                  db,
+                                  config.globals.write_flush_interval,
+                                  config.globals.write_max_batch,
+                                  config.globals.write_max_queue)
+        self.audit = AuditLog(logger.getChild('audit'), db, self.writes, config.globals.audit_enabled)
+        self.backfill = AutopinBackfill(logger.getChild('backfill'), self, db, self.writes,
+                                        config.globals.backfill_channels,
+                                        config.globals.backfill_checkpoint)
+        self.search = MessageSearch(logger.getChild('search'), db, self.writes,
+                                    config.globals.search_enabled,
+                                    config.globals.search_timeout)
+        # Ask for, and cache, only what the configured features need.
+        self.gateway_plan = features.plan(config)
+        self.messages = MessageStore(self.gateway_plan.message_store_budget, len(config.guildData))
+        self.journal = None
+
+        if config.globals.journal_enabled:
+            # Cluster processes each keep (and replay) a journal of their own shards' messages.
+            self.journal = MessageJournal(logger.getChild('journal'),
+                                          cluster.cluster_path(config.globals.journal_path, cluster_id),
+                                          config.globals.journal_segment_seconds,
+                                          config.globals.journal_segment_bytes,
+                                          config.globals.journal_retain_segments,
+                                          config.globals.journal_commit_interval,
+                                          config.globals.journal_max_batch)
+
+        self.recorder = None
+
+        if config.globals.capture_enabled:
+            self.recorder = GatewayRecorder(logger.getChild('capture'),
+                                            cluster.cluster_path(config.globals.capture_path, cluster_id),
+                                            config.globals.capture_anonymize,
+                                            config.globals.capture_max_bytes)
+
+        self.differ = DiffEngine(config.globals.diff_mode,
+                                 config.globals.diff_workers,
+                                 config.globals.diff_max_parts)
+        self.offload = EventOffload(logger.getChild('offload'),
+                                    config.globals.offload_workers,
+                                    config.globals.offload_events)
+
+        for intent, feature in self.gateway_plan.needs:
+            self.logger.info ('Enabling %s, for %s.', intent, feature)
+
+        super().__init__(command_prefix=command_prefixes,
                          description='Heuristic Algorithmic: a general-purpose Discord supervisor',
-                         intents=intents,
+                         intents=self.gateway_plan.intents,
+                         member_cache_flags=self.gateway_plan.member_cache_flags,
+                         max_messages=self.gateway_plan.max_messages,
                          activity=discord.Game(name="https://github.com/arkane-systems/heuristic-algorithmic"),
                          allowed_mentions=discord.AllowedMentions.all(),
                          chunk_guilds_at_startup=False,
+                         shard_ids=shard_ids,
+                         shard_count=shard_count,
+                         http_trace=self.metrics.http_trace(),
+                         enable_debug_events=self.recorder is not None,
                         )
 
+        # Time every command.
+        self.before_invoke(self.command_started)
+        self.after_invoke(self.command_finished)
+
+        # Gauges read when the metrics are collected.
+        self.metrics.gauge('hal_gateway_latency_seconds', 'Heartbeat latency of each shard.', ('shard',),
+                           lambda: {(shard,): latency for shard, latency in self.latencies if latency == latency})
+        self.metrics.gauge('hal_cache_entries', 'Entries held in each in-memory cache.', ('cache',),
+                           lambda: {(name,): size for name, size in self.cache_sizes().items()})
+        self.metrics.gauge('hal_cache_bytes', 'Estimated memory held by each in-memory cache.', ('cache',),
+                           lambda: {(name,): size for name, size in memory.report(self)['caches'].items()})
+
+        self.metrics_server = None
+        self.watchdog = None
+        self.closing = None
+
+        if config.globals.metrics_enabled:
+            # Each cluster process serves its own metrics, on the configured port plus its cluster ID.
+            self.metrics_server = MetricsServer(logger.getChild('metrics'), self.metrics,
+                                                config.globals.metrics_host, config.globals.metrics_port + (cluster_id or 0))
+
     async def setup_hook(self) -> None:
+        # Shut down already (the database could not be reached while logging in)?
+        if self.is_closed():
+            return
+
         # Record self information
-        self.bot_app_info = await self.application_info()
+        with self.startup.phase('application info'):
+            self.bot_app_info = await self.application_info()
+
         self.owner_id = self.bot_app_info.owner.id
 
         # Maintain AIOHTTP client session
-        self.session = aiohttp.ClientSession()
+        self.session = httpclient.create_session(self.config.globals, trace_configs=[self.metrics.http_trace()])
+
+        # Watch for anything blocking the event loop.
+        self.loop_thread_id = threading.get_ident()
 
-        # Add the commands in cogs to the system.
-        for extension in initial_extensions:
+        if self.config.globals.watchdog_threshold > 0:
+            self.watchdog = LoopWatchdog(self.logger.getChild('watchdog'), self.config.globals.watchdog_threshold)
+            self.watchdog.start()
+            self.metrics.gauge('hal_event_loop_stalls', 'Times the event loop was blocked past the watchdog threshold.',
+                               (), lambda: {(): self.watchdog.stalls})
+
+        # Start the event workers now, so that the first offloaded event doesn't wait for them.
+        self.offload.start()
+
+        # Start collecting and serving metrics.
+        self.loop_lag_task = asyncio.create_task(self.metrics.watch_loop_lag(), name='loop-lag')
+
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+        # Record gateway traffic from the start, so the capture includes the guilds' creation.
+        if self.recorder is not None:
+            self.recorder.start(self.config.guildData.values())
+
+        # Warm the pinned-message index in the background; until it is warm, pin checks fall
+        # back on the pin collection, as they do for any miss.
+        self.pin_warm_task = asyncio.create_task(self.warm_pin_index(), name='pin-index-warm')
+
+        # Add the commands in cogs to the system, while the journal is replayed.
+        await asyncio.gather(self.replay_journal(), self.load_initial_extensions())
+
+    async def load_initial_extensions(self) -> None:
+        with self.startup.phase('extensions'):
+            await self.load_extensions(initial_extensions)
+
+    async def load_extensions(self, extensions: tuple) -> None:
+        """Load extensions concurrently; one failing to load is logged, and doesn't stop the others."""
+        async def load(extension: str):
             try:
                 await self.load_extension(extension)
-                self.logger.info(f'Loaded extension {extension}.')
-            except Exception as e:
-                self.logger.error(f'Failed to load extension {extension}.')
-                traceback.print_exc()
+                self.logger.info('Loaded extension %s.', extension)
+            except Exception:
+                self.logger.exception('Failed to load extension %s.', extension)
+
+        await asyncio.gather(*(load(extension) for extension in extensions))
+
+    async def load_lazy_extensions(self) -> None:
+        """Load the extensions deferred until first use, if that hasn't been done already."""
+        if not self.lazy_extensions_loaded:
+            await self.extension_flights.run('lazy', lambda: self.load_extensions(lazy_extensions))
+            self.lazy_extensions_loaded = True
+
+    async def replay_journal(self) -> None:
+        """Reload recent message content from the journal, then start journalling."""
+        if self.journal is None:
+            return
+
+        with self.startup.phase('journal replay'):
+            replayed = await asyncio.to_thread(self.journal.replay, self.messages)
+
+        self.logger.info('Replayed %d message journal events into the message store.', replayed)
+        self.journal.start()
+
+    async def warm_pin_index(self) -> None:
+        try:
+            with self.startup.phase('pin index'):
+                loaded = await self.pin_index.warm(self.db['pin'], len(self.config.guildData))
+        except pymongo.errors.PyMongoError:
+            self.logger.warning('Could not load pin records into the pinned-message index.', exc_info=True)
+            return
+
+        self.logger.info('Loaded %d pin records into the pinned-message index.', loaded)
 
     async def start(self, token: str) -> None:
-        await super().start(token, reconnect=True)
+        # As Client.start, but timing the login (which runs setup_hook) and the gateway connection.
+        with self.startup.phase('login and setup'):
+            await self.login(token)
+
+        self.connect_started = time.perf_counter()
+        await self.connect(reconnect=True)
 
     async def close(self) -> None:
-        # Close down AIOHTTP client session
-        await self.session.close()
+        # Closing can be asked for more than once (by a signal, by the shutdown command, and as
+        # run_bot finishes); everything is written out once, and later calls wait for that.
+        if self.closing is None:
+            self.closing = asyncio.create_task(self.drain(), name='close')
+
+        await self.closing
         await super().close()
 
+    async def drain(self) -> None:
+        """Write out what is queued, and stop the bot's own tasks, workers and threads."""
+        # Checkpoint any autopin backfills, to resume at the next start.
+        await self.backfill.close()
+
+        # Flush any moderator notices still waiting to be sent, and records waiting to be written.
+        await self.modlog.close()
+        await self.writes.close()
+
+        # Stop collecting and serving metrics.
+        if hasattr (self, 'loop_lag_task'):
+            self.loop_lag_task.cancel()
+
+        if hasattr (self, 'pin_warm_task'):
+            self.pin_warm_task.cancel()
+
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+
+        if self.watchdog is not None:
+            await asyncio.to_thread(self.watchdog.stop)
+
+        # Close down AIOHTTP client session
+        if hasattr (self, 'session'):
+            await self.session.close()
+
+        # Stop the diff and event workers.
+        self.differ.close()
+        self.offload.close()
+
+        # Write out the message journal and any gateway capture.
+        if self.journal is not None:
+            await asyncio.to_thread(self.journal.close)
+
+        if self.recorder is not None:
+            await asyncio.to_thread(self.recorder.close)
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs) -> None:
+        # Every event handler is run through here, which makes it the place to time them.
+        started = time.perf_counter()
+
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            self.metrics.events.observe(time.perf_counter() - started, event_name)
+
+    async def on_error(self, event_method: str, /, *args, **kwargs) -> None:
+        self.metrics.event_errors.inc(event_method)
+        await super().on_error(event_method, *args, **kwargs)
+
+    async def command_started(self, ctx: Context) -> None:
+        # Refuse commands over their rate limits before they do any work.
+        try:
+            self.limiter.check(ctx)
+        except RateLimited as e:
+            self.metrics.commands_throttled.inc(e.command, e.scope)
+            raise
+
+        ctx.invoke_started = time.perf_counter()
+
+        # Help lists every command, so first load those not loaded yet.
+        if ctx.command.qualified_name == 'help':
+            await self.load_lazy_extensions()
+
+    async def command_finished(self, ctx: Context) -> None:
+        if ctx.invoke_started is not None:
+            self.metrics.commands.observe(time.perf_counter() - ctx.invoke_started, ctx.command.qualified_name)
+
+    def cache_sizes(self) -> dict:
+        """The number of entries in each of the bot's in-memory caches."""
+        sizes = {
+            'channels': len(self.channels),
+            'discord_messages': len(self.cached_messages),
+            'discord_users': len(self.users),
+            'message_store': len(self.messages),
+            'modlog_queue': self.modlog.depth,
+            'pin_counts': len(self.pin_counts),
+            'pin_index': len(self.pin_index),
+            'prefixes': len(self.prefixes),
+            'rate_limit_buckets': len(self.limiter),
+            'write_queue': self.writes.depth,
+        }
+
+        if self.journal is not None:
+            sizes['journal_queue'] = self.journal.depth
+
+        if self.recorder is not None:
+            sizes['capture_queue'] = self.recorder.stats()['depth']
+
+        return sizes
+
     async def get_context(self, origin: Union[discord.Interaction, discord.Message], /, *, cls=Context) -> Context:
         """Deliver the custom context class instead of the default."""
         return await super().get_context(origin, cls=cls)
 
     async def on_command_error(self, ctx: Context, exception: commands.CommandError) -> None:
+        if isinstance (exception, commands.CommandNotFound):
+            # The command may be in an extension loaded on first use; if so, run it now that it is.
+            await self.load_lazy_extensions()
+
+            if ctx.invoked_with in self.all_commands:
+                await self.invoke(await self.get_context(ctx.message))
+            else:
+                await super().on_command_error(ctx, exception)
+        elif isinstance (exception, RateLimited):
+            # Answer the first refusal; drop the rest quietly until the command is allowed again.
+            if exception.notify:
+                self.logger.info ("User %s is rate limited from `%s` (per %s).", ctx.author.name, exception.command, exception.scope)
+                await ctx.reply(str(exception))
         # Check for check failures.
-        if isinstance (exception, commands.CheckFailure):
-            self.logger.info (f"User {ctx.author.name} is not permitted to run the command `{ctx.message.content}`.")
+        elif isinstance (exception, commands.CheckFailure):
+            self.logger.info ("User %s is not permitted to run the command `%s`.", ctx.author.name, ctx.message.content)
             await ctx.reply(f'You are not permitted to run the command `{ctx.message.content}`.')
         elif isinstance(exception, commands.NoPrivateMessage):
             await ctx.reply('This command cannot be used in private messages.')
@@ -106,138 +434,373 @@ class HeuristicAlgorithmic (commands.Bot):
         else:
             await super().on_command_error(ctx, exception)
 
+    async def on_socket_raw_receive(self, msg: str):
+        # Only dispatched when debug events are enabled, i.e. when capturing.
+        if self.recorder is not None:
+            self.recorder.record(msg)
+
     async def on_message(self, message):
+        self.metrics.messages_seen.inc()
+
         # Do not process own messages.
         if message.author == self.user:
             return
 
+        # Remember the content of messages, if we may later need to audit or echo their deletion or
+        # edit; other bots' messages too, whether or not they are processed as commands.
+        gc = self.config.guild_config(message.guild)
+
+        record = None
+
+        if gc is not None and (self.audit.enabled or gc.show_mods_deletes or gc.show_mods_edits):
+            record = self.messages.add(message)
+
+            if self.journal is not None:
+                self.journal.record_create(message.guild.id, record)
+
+        # Add it to the search index.
+        if gc is not None and self.search.enabled:
+            self.search.index(message.guild.id, record if record is not None else StoredMessage.from_message(message))
+
         # Do not process bot messages unless configured otherwise.
-        if (self.config.parse_bot_msgs() is False) and (message.author.bot is True):
+        if message.author.bot and not self.config.globals.parse_bot_msgs:
             return
 
         # Perform message-level debug logging if it is enabled.
-        if self.config.log_each_message() is True:
-            self.logger.debug("Message received: %s", message.content)
+        if self.config.globals.log_each_message:
+            self.message_logger.debug("Message received: %s", message.content)
+
+        # Process bot commands; only messages starting with a command prefix can be one, and
+        # checking for that first spares the rest building a Context.
+        if self.prefixes.may_be_command(message.content, gc, self.user.id):
+            self.metrics.command_candidates.inc()
+            await self.process_commands (message)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        # Prefer our own record of the message; fall back on discord.py's cache.
+        record = self.messages.pop(payload.guild_id, payload.message_id) if payload.guild_id else None
+
+        if record is not None and self.journal is not None:
+            self.journal.record_delete(payload.guild_id, payload.message_id)
+
+        guild = self.get_guild (payload.guild_id) if payload.guild_id else None
+        gc = self.config.guild_config(guild)
+
+        # Only configured guilds' messages are indexed.
+        if gc is not None:
+            self.search.delete(payload.guild_id, payload.message_id)
+
+        if record is None and payload.cached_message is not None:
+            record = StoredMessage.from_message(payload.cached_message)
 
-        # Default to processing bot commands.
-        await self.process_commands (message)
+        if gc is None:
+            return
+
+        # Get the moderator channel.
+        modchan = self.channels.moderator(guild)
+
+        # If the delete is in the moderator channel, discard it.
+        if modchan is not None and payload.channel_id == modchan.id:
+            return
+
+        if record is None:
+            self.logger.info ('Message %d deleted in %s, but its content is no longer known.', payload.message_id, guild)
+            return
+
+        self.audit.record_delete(payload.guild_id, record)
+
+        # Only echo deletes in guilds configured to have them echoed.
+        if not gc.show_mods_deletes:
+            return
+
+        # Echo the deleted message on the moderator channel.
+        if modchan is None:
+            self.logger.error ("Cannot echo deleted message; moderator channel not configured.")
+            return
+
+        channel = self.get_channel (payload.channel_id)
+
+        self.perform(await self.offload.run(offload.MESSAGE_DELETE, {
+            'modchan_id': modchan.id,
+            'channel': str(channel),
+            'author': record.author,
+            'content': record.content,
+            'attachments': record.attachments,
+        }))
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        # Gather whatever we know of the deleted messages, from our record or discord.py's cache.
+        records = {r.id: r for r in self.messages.pop_many(payload.guild_id, payload.message_ids)}
+
+        if self.journal is not None:
+            for message_id in records:
+                self.journal.record_delete(payload.guild_id, message_id)
+
+        guild = self.get_guild (payload.guild_id)
+        gc = self.config.guild_config(guild)
+
+        # Only configured guilds' messages are indexed.
+        if gc is not None:
+            for message_id in payload.message_ids:
+                self.search.delete(payload.guild_id, message_id)
+
+        for m in payload.cached_messages:
+            records.setdefault(m.id, StoredMessage.from_message(m))
+
+        if gc is None:
+            return
 
-    async def on_message_delete(self, message: discord.Message):
         # Get the moderator channel.
-        modchan = self.config.get_moderator_channel(message.guild)
+        modchan = self.channels.moderator(guild)
 
         # If the delete is in the moderator channel, discard it.
-        if message.channel == modchan:
+        if modchan is not None and payload.channel_id == modchan.id:
             return
 
-        # If configured to do so, echo deleted messages on the moderator channel.
-        if message.guild is not None:
-            if self.config.show_mods_deletes(message.guild) is True:
-                msg = f'**@{message.author}, in channel #{message.channel.name}, has deleted the message:**\n\n{message.content}'
+        for record in records.values():
+            self.audit.record_delete(payload.guild_id, record, bulk=True)
 
-                if modchan is None:
-                    self.logger.error ("Cannot echo deleted message; moderator channel not configured.")
+        # Only echo deletes in guilds configured to have them echoed.
+        if not gc.show_mods_deletes:
+            return
+
+        if modchan is None:
+            self.logger.error ("Cannot echo bulk delete; moderator channel not configured.")
+            return
+
+        # Summarize the whole purge as a single notice, listing what we still know of.
+        channel = self.get_channel (payload.channel_id)
+
+        self.perform(await self.offload.run(offload.BULK_MESSAGE_DELETE, {
+            'modchan_id': modchan.id,
+            'channel': str(channel),
+            'count': len(payload.message_ids),
+            'messages': [(r.author, r.content) for _, r in sorted(records.items())],
+            'unknown': len(payload.message_ids) - len(records),
+        }))
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # Only content changes are of interest (embeds being resolved also raise this event).
+        content = payload.data.get('content')
+
+        if content is None or payload.guild_id is None:
+            return
 
-                await modchan.send(msg, allowed_mentions=discord.AllowedMentions.none())
+        # Prefer our own record of the message; fall back on discord.py's cache.
+        before = self.messages.update(payload.guild_id, payload.message_id, content)
+
+        if before is not None and self.journal is not None:
+            self.journal.record_edit(payload.guild_id, payload.message_id, content)
+
+        if before is None and payload.cached_message is not None:
+            before = StoredMessage.from_message(payload.cached_message)
+
+        guild = self.get_guild (payload.guild_id)
+        gc = self.config.guild_config(guild)
+
+        # Keep the search index up to date (only configured guilds' messages are indexed), unless
+        # this is known not to be a change.
+        if gc is not None and (before is None or before.content != content):
+            self.search.edit(payload.guild_id, payload.message_id, content)
 
-    async def on_message_edit(self, before: discord.Message, after: discord.Message):
         # Is this a true (content) change?
-        if before.content == after.content:
-            # If not, don't bother with the rest.
+        if before is None or before.content == content:
+            # If not (or we can't tell), don't bother with the rest.
+            return
+
+        if gc is None:
             return
 
         # Get the moderator channel.
-        modchan = self.config.get_moderator_channel(before.guild)
+        modchan = self.channels.moderator(guild)
 
         # If the edit is in the moderator channel, discard it.
-        if before.channel == modchan:
+        if modchan is not None and payload.channel_id == modchan.id:
             return
 
-        # If configured to do so, echo edited messages on the moderator channel.
-        if before.guild is not None:
-            if self.config.show_mods_edits(before.guild) is True:
-                # Make the diff.
-                diff = list(unified_diff(before.content.split('\n'), after.content.split('\n'),
-                                         fromfile='before', tofile='after', n=0, lineterm=''))
-                difftxt= '\n'.join(diff)
+        self.audit.record_edit(payload.guild_id, before, content)
 
-                msg = f'**@{before.author}, in channel #{before.channel.name}, has edited their message:**\n```diff\n{difftxt}\n```'                
+        # Only echo edits in guilds configured to have them echoed.
+        if not gc.show_mods_edits:
+            return
 
-                if modchan is None:
-                    self.logger.error ("Cannot echo edited message; moderator channel not configured.")
+        if modchan is None:
+            self.logger.error ("Cannot echo edited message; moderator channel not configured.")
+            return
 
-                await modchan.send(msg, allowed_mentions=discord.AllowedMentions.none())
+        # Echo the edited message on the moderator channel, with the diff sized to fit it.
+        channel = self.get_channel (payload.channel_id)
+        event = {
+            'modchan_id': modchan.id,
+            'channel': str(channel),
+            'author': before.author,
+            'before': before.content,
+            'after': content,
+            'mode': self.differ.mode,
+            'limit': MAX_EMBED_DESCRIPTION,
+            'max_parts': self.differ.max_parts,
+        }
+
+        # Unless the whole edit is offloaded, the diff engine decides where the diff is made.
+        if not self.offload.offloads(offload.MESSAGE_EDIT):
+            fence = offload.EDIT_FENCE
+            event['parts'] = await self.differ.diff(before.content, content, MAX_EMBED_DESCRIPTION - len(fence.format('')))
+
+        self.perform(await self.offload.run(offload.MESSAGE_EDIT, event))
+
+    def perform(self, actions: list) -> None:
+        """Carry out the actions an event handler decided on."""
+        for action in actions:
+            if action[0] == offload.MODLOG:
+                _, channel_id, title, description = action
+                channel = self.get_channel (channel_id)
+
+                if channel is not None:
+                    self.modlog.post(channel, title, description)
+            else:
+                self.logger.error ('Unknown event action %s.', action[0])
 
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         user = payload.member
         emoji = payload.emoji.name
 
-        if emoji == '📌':
+        if emoji == PIN_EMOJI:
             # Handle pin reactions.
             guild = self.get_guild (payload.guild_id)
-            threshold = self.config.autopin_threshold(guild)
+            gc = self.config.guild_config(guild)
 
-            if threshold == 0:
+            if gc is None or gc.autopin_threshold == 0:
                 # Autopinning is disabled.
                 return
 
-            pinchan = self.config.get_autopin_channel(guild)
+            threshold = gc.autopin_threshold
+            pinchan = self.channels.autopin(guild)
             channel = self.get_channel (payload.channel_id)
 
             if channel == pinchan:
-                self.logger.info (f"Pin added to message in {guild}'s autopin channel; ignoring.")
+                self.logger.info ("Pin added to message in %s's autopin channel; ignoring.", guild)
                 return
 
-            # Get the message.
-            message = await channel.fetch_message (payload.message_id)
-
-            # Check for pinability; count reactions
-            pincount = discord.utils.find(lambda r: r.emoji == '📌', message.reactions).count
+            # Count the reaction locally, from the first one seen; the message is only fetched once
+            # the count reaches the threshold (or an administrator reacts), to confirm it. With no
+            # counts kept, every reaction fetches it.
+            pincount = self.pin_counts.increment (payload.message_id)
             by_admin = user.guild_permissions.administrator
 
-            self.logger.info (f'Pin added to message on #{channel}@{guild} by {user}; count = {pincount}; by_admin={by_admin}')
+            self.logger.info ('Pin added to message on #%s@%s by %s; count = %s; by_admin=%s', channel, guild, user, pincount, by_admin)
+
+            if (pincount is None) or (pincount >= threshold) or by_admin:
+                # Already pinned? Then there's nothing to fetch.
+                if self.pin_index.contains (guild.id, payload.message_id):
+                    return
+
+                # The fetch corrects the local count, which misses reactions added before it began.
+                message = await self.fetch_pin_candidate (channel, payload.message_id)
+
+                if count_pins (message) < threshold and not by_admin:
+                    return
+
+                # Pin the message; concurrent requests to pin the same message share one attempt.
+                await self.pin_flights.run (message.id, lambda: self.pin_message (message))
+
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if payload.emoji.name == PIN_EMOJI:
+            self.pin_counts.decrement (payload.message_id)
 
-            if (pincount >= threshold) or by_admin:
-                # Pin the message.
-                await self.pin_message (message)
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        self.pin_counts.forget (payload.message_id)
+
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        if payload.emoji.name == PIN_EMOJI:
+            self.pin_counts.forget (payload.message_id)
+
+    async def fetch_pin_candidate(self, channel: discord.TextChannel, message_id: int) -> discord.Message:
+        """Fetch a message that has had a 📌 added, and record its true 📌 count.
+
+        Concurrent fetches of the same message share a single request."""
+        message = await self.fetch_flights.run (message_id, lambda: channel.fetch_message (message_id))
+        self.pin_counts.set (message_id, count_pins (message))
+        return message
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        self.channels.invalidate(channel)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if before.name != after.name:
+            self.channels.invalidate(before)
+            self.channels.invalidate(after)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.channels.invalidate(channel)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.channels.invalidate_guild(guild)
+        self.messages.forget_guild(guild.id)
+
+    async def on_shard_ready(self, shard_id: int):
+        self.logger.info('Shard %d of %s is ready.', shard_id, self.shard_count)
 
     async def on_ready(self):
         # Log on successful login.
-        self.logger.info(f'We have logged in as {self.user} (ID: {self.user.id})')
+        self.logger.info('We have logged in as %s (ID: %d)', self.user, self.user.id)
 
         # Store the uptime (if the first call).
         if not hasattr (self, 'uptime'):
             self.uptime = discord.utils.utcnow()
 
+            # Report how long startup took, and where the time went.
+            if self.connect_started is not None:
+                self.startup.record('gateway', self.connect_started)
+                self.logger.info('Started up in %s', self.startup.summary())
+
         # Check for configs for our guilds; self-eject if there is wrongness.
         for guild in self.guilds:
-            if self.config.does_guild_config_exist(guild.name):
+            if self.config.does_guild_config_exist(guild):
                 result = self.config.verify_guild_id (guild)
 
                 if result == configuration.GuildVerified.VERIFIED:
-                    self.logger.info (f'Successfully connected to guild {guild.name} (ID: {guild.id})')
+                    self.logger.info ('Successfully connected to guild %s (ID: %d)', guild.name, guild.id)
                 elif result == configuration.GuildVerified.UNVERIFIED:
-                    self.logger.error (f'Incorrect ID specified for guild {guild.name}; self-ejecting.')
+                    self.logger.error ('Incorrect ID specified for guild %s; self-ejecting.', guild.name)
                     await guild.leave()
                 else:
-                    self.logger.warning (f'No id specified for guild {guild.name}; connecting anyway.')
+                    self.logger.warning ('No id specified for guild %s; connecting anyway.', guild.name)
             else:
-                self.logger.error (f'No configuration exists for guild {guild.name}; self-ejecting.')
+                self.logger.error ('No configuration exists for guild %s; self-ejecting.', guild.name)
                 await guild.leave()
 
-    async def pin_message(self, message: discord.Message):
-        # Check for duplicates so we don't pin the same message twice.
-        result = self.db['pin'].find_one ({ 'guild_id' : message.guild.id, 'message_id' : message.id })
+        # Resume any autopin backfills interrupted when the bot last stopped.
+        if not self.backfill_resumed:
+            self.backfill_resumed = True
+
+            try:
+                await self.backfill.resume_all()
+            except pymongo.errors.PyMongoError:
+                self.logger.error ('Could not resume autopin backfills.', exc_info=True)
+
+    async def pin_message(self, message: discord.Message) -> bool:
+        """Pin a message to the autopin channel, unless it already has been; returns whether it was pinned.
+
+        Callers look the message up in the pinned-message index first, which counts as its lookup."""
+        # Check for duplicates so we don't pin the same message twice. The caller's lookup in the
+        # index answered most of these; check it again (without counting a second lookup) in case
+        # the message was pinned since, and confirm a miss against the database.
+        if self.pin_index.peek (message.guild.id, message.id):
+            self.logger.info ("No need to pin message; it has already been pinned.")
+            return False
+
+        result = await self.db['pin'].find_one ({ 'guild_id' : message.guild.id, 'message_id' : message.id })
 
         if result is not None:
+            self.pin_index.add (message.guild.id, message.id)
             self.logger.info ("No need to pin message; it has already been pinned.")
-            return
+            return False
 
         # Pin the message.
         author = message.author.name
         originalchan = message.channel.name
 
-        self.logger.info (f'Pinning message {message.id} to highlights channel (from @{author} on #{originalchan}).')
+        self.logger.info ('Pinning message %d to highlights channel (from @%s on #%s).', message.id, author, originalchan)
 
         content = f'**@{author} said on channel #{originalchan}:**\n' + message.content + f'\n**Original message: <{message.jump_url}>**'
         attachments = message.attachments
@@ -246,11 +809,13 @@ class HeuristicAlgorithmic (commands.Bot):
         for att in attachments:
             embeds.append(discord.Embed(title=att.name,url=att.url))
 
-        highchan = self.config.get_autopin_channel(message.guild)
+        highchan = self.channels.autopin(message.guild)
         await highchan.send (content, embeds=embeds)
 
-        # Record the pinning of the message.
-        self.db['pin'].insert_one ({ 'guild_id' : message.guild.id, 'message_id' : message.id })
+        # Record the pinning of the message; the index answers for it until the record is written.
+        self.pin_index.add (message.guild.id, message.id)
+        self.writes.insert ('pin', { 'guild_id' : message.guild.id, 'message_id' : message.id }, key=('guild_id', 'message_id'))
+        return True
 
     @property
     def owner(self) -> discord.User:
@@ -0,0 +1,260 @@
+# Gateway capture - records raw gateway dispatch events for offline replay.
+#
+# When enabled, every message received on the gateway is handed to a background thread,
+# which keeps the dispatch events and writes them as gzip-compressed JSON lines, one
+# capture file per run. Anonymized captures replace message text, names and snowflake IDs
+# with stand-ins that are consistent within the capture, so that a replay still sees the
+# same users, channels and messages interacting. benchmarks.replay plays captures back.
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from hashlib import blake2b
+from typing import Iterable, Iterator, Optional
+
+import __about__
+from configuration import GuildConfig
+
+CAPTURE_FORMAT = 1
+CAPTURE_SUFFIX = '.jsonl.gz'
+
+# Events written between flushes of the compressed stream, at most.
+FLUSH_EVERY = 1000
+
+# Queue marker asking the writer thread to finish.
+_STOP = object()
+
+# Text scrambled word by word, URLs replaced, and image hashes and contact details dropped.
+TEXT_KEYS = frozenset(('content', 'username', 'global_name', 'nick', 'name', 'topic', 'description',
+                       'title', 'value', 'text', 'filename', 'bio', 'placeholder', 'label'))
+URL_KEYS = frozenset(('url', 'proxy_url', 'icon_url', 'vanity_url_code'))
+DROP_KEYS = frozenset(('avatar', 'icon', 'banner', 'splash', 'discovery_splash', 'email', 'phone',
+                       'avatar_decoration', 'avatar_decoration_data'))
+
+_SNOWFLAKE = re.compile(r'^\d{15,21}$')
+_TOKENS = re.compile(r'(\d{15,21})|([^\W\d_]+)')
+_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+class Anonymizer:
+    """Consistently replaces identifying content in gateway payloads."""
+    def __init__(self, salt: bytes):
+        self.salt = salt
+        self._ids = {}
+        self._sequence = 0
+
+    def snowflake(self, value: str) -> str:
+        """Map a snowflake to a stand-in with the same timestamp, so that ordering is kept."""
+        mapped = self._ids.get(value)
+
+        if mapped is None:
+            self._sequence += 1
+            mapped = str((int(value) >> 22 << 22) | (self._sequence & 0x3FFFFF))
+            self._ids[value] = mapped
+
+        return mapped
+
+    def word(self, word: str) -> str:
+        digest = blake2b(word.lower().encode(), key=self.salt, digest_size=32).digest()
+        out = ''.join(_LETTERS[digest[n % len(digest)] % 26] for n in range(len(word)))
+        return out.capitalize() if word[:1].isupper() else out
+
+    def _token(self, match: re.Match) -> str:
+        return self.snowflake(match.group(1)) if match.group(1) else self.word(match.group(2))
+
+    def text(self, text: str) -> str:
+        """Scramble each word, keeping length, punctuation and any leading command."""
+        command = ''
+
+        if text.startswith('!'):
+            command, sep, text = text.partition(' ')
+            command += sep
+
+        return command + _TOKENS.sub(self._token, text)
+
+    def apply(self, value, key: Optional[str] = None):
+        if isinstance(value, dict):
+            return {k: self.apply(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.apply(v, key) for v in value]
+        if not isinstance(value, str):
+            return value
+
+        if _SNOWFLAKE.match(value):
+            return self.snowflake(value)
+        if key in TEXT_KEYS:
+            return self.text(value)
+        if key in URL_KEYS:
+            return 'https://example.invalid/' + self.word(os.path.basename(value) or 'x')
+        if key in DROP_KEYS:
+            return None
+
+        return value
+
+class GatewayRecorder:
+    """Write-behind recorder of gateway dispatch events, to a compressed capture file."""
+    path: str
+    anonymize: bool
+    max_bytes: int
+
+    def __init__(self, logger: logging.Logger, path: str, anonymize: bool, max_bytes: int, max_queue: int = 100000):
+        self.logger = logger
+        self.path = path
+        self.anonymize = anonymize
+        self.max_bytes = max_bytes
+        self.file: Optional[str] = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+        # Statistics
+        self.recorded = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.full = False
+
+    def record(self, msg: str) -> None:
+        """Queue one raw gateway message; called on the event loop for everything received."""
+        if self.full:
+            return
+
+        try:
+            self._queue.put_nowait((time.monotonic(), msg))
+        except queue.Full:
+            self.dropped += 1
+
+    def _header(self, guilds: Iterable[GuildConfig], anonymizer: Optional[Anonymizer]) -> dict:
+        # The configuration of each guild, with names and IDs passed through the same
+        # anonymization as the events, so that a replay can recreate it.
+        text = anonymizer.text if anonymizer is not None else str
+        configs = []
+
+        for gc in guilds:
+            config = {'name': text(gc.name),
+                      'channels': {'moderator': text(gc.moderator_channel) if gc.moderator_channel else None,
+                                   'autopin': text(gc.autopin_channel) if gc.autopin_channel else None},
+                      'options': {'autopinThreshold': gc.autopin_threshold,
+                                  'showModsDeletes': gc.show_mods_deletes,
+                                  'showModsEdits': gc.show_mods_edits,
+                                  'commandPrefix': gc.command_prefix}}
+
+            if gc.id is not None:
+                config['id'] = int(anonymizer.snowflake(str(gc.id))) if anonymizer is not None else gc.id
+
+            configs.append(config)
+
+        return {'capture': CAPTURE_FORMAT, 'version': str(__about__.__version__),
+                'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'anonymized': anonymizer is not None, 'guilds': configs}
+
+    def _run(self, header: dict, anonymizer: Optional[Anonymizer]) -> None:
+        with open(self.file, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            gz.write(json.dumps(header).encode() + b'\n')
+
+            while not self.full:
+                received, msg = self._queue.get()
+
+                if msg is _STOP:
+                    break
+
+                try:
+                    payload = json.loads(msg)
+                except (TypeError, ValueError):
+                    continue
+
+                # Only dispatches (opcode 0) are replayed; heartbeats and the like are not.
+                if payload.get('op') != 0:
+                    continue
+
+                data = payload.get('d')
+
+                if anonymizer is not None:
+                    data = anonymizer.apply(data)
+
+                event = {'t': round(received - self._started, 6), 'e': payload.get('t'), 'd': data}
+                gz.write(json.dumps(event, separators=(',', ':')).encode() + b'\n')
+                self.recorded += 1
+
+                # Flush whenever the queue runs dry (and regularly under sustained load), so that
+                # the file stays readable while recording.
+                if self._queue.empty() or self.recorded % FLUSH_EVERY == 0:
+                    gz.flush(zlib.Z_SYNC_FLUSH)
+                    self.bytes = raw.tell()
+
+                    if self.bytes >= self.max_bytes:
+                        self.full = True
+                        self.logger.warning('Gateway capture %s reached its size limit; recording stopped.', self.file)
+
+    def start(self, guilds: Iterable[GuildConfig]) -> None:
+        """Start recording to a new capture file."""
+        os.makedirs(self.path, exist_ok=True)
+
+        self._started = time.monotonic()
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.file = os.path.join(self.path, f'gateway-{stamp}{CAPTURE_SUFFIX}')
+
+        anonymizer = Anonymizer(os.urandom(16)) if self.anonymize else None
+        header = self._header(guilds, anonymizer)
+
+        self._thread = threading.Thread(target=self._run, args=(header, anonymizer), name='hal-capture', daemon=True)
+        self._thread.start()
+
+        self.logger.info('Recording gateway events to %s.', self.file)
+
+    def close(self) -> None:
+        """Write out everything queued and finish the capture file. Blocks until done."""
+        if self._thread is None:
+            return
+
+        if self._thread.is_alive():
+            self._queue.put((0.0, _STOP))
+
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            'file': self.file,
+            'recorded': self.recorded,
+            'depth': self._queue.qsize(),
+            'dropped': self.dropped,
+            'bytes': self.bytes,
+        }
+
+def read_capture(path: str) -> tuple:
+    """Read a capture file, returning its header and an iterator over (time, event, data).
+
+    A capture cut short (the bot was killed while recording) is read up to where it ends."""
+    f = gzip.open(path, 'rt')
+
+    try:
+        header = json.loads(f.readline())
+    except Exception:
+        f.close()
+        raise
+
+    if header.get('capture') != CAPTURE_FORMAT:
+        f.close()
+        raise ValueError(f'{path} is not a gateway capture this version can read')
+
+    def events() -> Iterator[tuple]:
+        with f:
+            try:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+
+                    yield event['t'], event['e'], event['d']
+            except (EOFError, zlib.error, OSError):
+                return
+
+    return header, events()
@@ -0,0 +1,90 @@
+# Cache of resolved special channels (moderator, autopin) for each guild.
+
+import discord
+from typing import Optional
+
+import configuration
+
+# Special channel roles, and the GuildConfig field naming the channel for each.
+ROLES = {
+    'moderator': 'moderator_channel',
+    'autopin': 'autopin_channel',
+}
+
+class ChannelCache:
+    """Maps (guild, role) to the ID of the configured special channel.
+
+    Channels are resolved by name once, then fetched by ID in O(1) thereafter. Entries are
+    invalidated from the guild channel create/update/delete events."""
+    config: configuration.Configuration
+
+    def __init__(self, config: configuration.Configuration):
+        self.config = config
+        self._resolved = {}
+
+    def __len__(self) -> int:
+        return len(self._resolved)
+
+    def moderator(self, guild: discord.Guild) -> Optional[discord.TextChannel]:
+        """Get the moderator channel of a guild, if one is configured and exists."""
+        return self.get(guild, 'moderator')
+
+    def autopin(self, guild: discord.Guild) -> Optional[discord.TextChannel]:
+        """Get the autopin (highlights) channel of a guild, if one is configured and exists."""
+        return self.get(guild, 'autopin')
+
+    def get(self, guild: discord.Guild, role: str) -> Optional[discord.TextChannel]:
+        if guild is None:
+            return None
+
+        key = (guild.id, role)
+
+        if key in self._resolved:
+            chan_id = self._resolved[key]
+
+            if chan_id is None:
+                return None
+
+            chan = guild.get_channel(chan_id)
+
+            if chan is not None:
+                return chan
+
+        # Not resolved yet, or the cached channel has gone away.
+        chan = self._resolve(guild, role)
+        self._resolved[key] = chan.id if chan is not None else None
+        return chan
+
+    def _configured_name(self, guild: discord.Guild, role: str) -> Optional[str]:
+        gc = self.config.guild_config(guild)
+
+        if gc is None:
+            return None
+
+        return getattr(gc, ROLES[role])
+
+    def _resolve(self, guild: discord.Guild, role: str) -> Optional[discord.TextChannel]:
+        name = self._configured_name(guild, role)
+
+        if name is None:
+            return None
+
+        return discord.utils.get(guild.text_channels, name=name)
+
+    def invalidate(self, channel: discord.abc.GuildChannel) -> None:
+        """Forget any resolution the given channel may affect."""
+        guild = channel.guild
+
+        for role in ROLES:
+            key = (guild.id, role)
+
+            if key not in self._resolved:
+                continue
+
+            if self._resolved[key] == channel.id or self._configured_name(guild, role) == channel.name:
+                del self._resolved[key]
+
+    def invalidate_guild(self, guild: discord.Guild) -> None:
+        """Forget all resolutions for a guild."""
+        for role in ROLES:
+            self._resolved.pop((guild.id, role), None)
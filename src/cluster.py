@@ -0,0 +1,111 @@
+# Shard cluster launcher - splits the bot's shards across several local processes.
+
+import aiohttp
+import asyncio
+import logging
+import multiprocessing
+import os.path
+import signal
+from typing import Callable, Optional
+
+import configuration
+
+# Gateway endpoint reporting the recommended shard count.
+GATEWAY_BOT_URL = 'https://discord.com/api/v10/gateway/bot'
+
+async def fetch_recommended_shards(token: str) -> int:
+    """Ask Discord how many shards the bot should run."""
+    headers = {'Authorization': f'Bot {token}'}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_BOT_URL, headers=headers) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+
+    return data['shards']
+
+def assign_shards(shard_ids: list, clusters: int) -> list:
+    """Split a list of shard IDs into contiguous, near-equal ranges, one per cluster."""
+    clusters = max(1, min(clusters, len(shard_ids)))
+    base, extra = divmod(len(shard_ids), clusters)
+
+    assignments = []
+    start = 0
+
+    for n in range(clusters):
+        size = base + (1 if n < extra else 0)
+        assignments.append(shard_ids[start:start + size])
+        start += size
+
+    return assignments
+
+def cluster_path(path: str, cluster_id: Optional[int]) -> str:
+    """The directory a cluster process keeps its files in: its own subdirectory of path, if clustered."""
+    if cluster_id is None:
+        return path
+
+    return os.path.join(path, f'cluster-{cluster_id}')
+
+def plan(logger: logging.Logger, config: configuration.Configuration) -> tuple:
+    """Work out the total shard count and the shard IDs each local process should run.
+
+    Returns (shard_count, assignments). An assignment of None lets discord.py pick the shards."""
+    settings = config.globals
+
+    if not settings.sharding_enabled:
+        return 1, [None]
+
+    shard_count = settings.shard_count
+    shard_ids = settings.shard_ids
+
+    if shard_ids is None and settings.clusters == 1:
+        # One process running every shard; discord.py can work the count out for itself.
+        return shard_count, [None]
+
+    if shard_count is None:
+        shard_count = asyncio.run(fetch_recommended_shards(settings.discord_secret))
+        logger.info ("Discord recommends %d shards", shard_count)
+
+    if shard_ids is None:
+        shard_ids = range(shard_count)
+
+    return shard_count, assign_shards(list(shard_ids), settings.clusters)
+
+def launch(logger: logging.Logger, shard_count: int, assignments: list, target: Callable) -> int:
+    """Run target(cluster_id, shard_ids, shard_count) in one process per assignment.
+
+    Each process builds its own database client and gateway connections. Returns the exit
+    code of the first process to fail, or 0."""
+    ctx = multiprocessing.get_context('spawn')
+    processes = []
+
+    for cluster_id, shard_ids in enumerate(assignments):
+        logger.info ("Starting cluster %d with shards %s of %d", cluster_id, shard_ids, shard_count)
+        proc = ctx.Process(target=target, args=(cluster_id, shard_ids, shard_count),
+                           name=f'hal-cluster-{cluster_id}')
+        proc.start()
+        processes.append(proc)
+
+    # Pass termination requests on to the clusters.
+    def terminate(signum, frame):
+        for proc in processes:
+            if proc.is_alive():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    result = 0
+
+    try:
+        for proc in processes:
+            proc.join()
+
+            if proc.exitcode != 0:
+                logger.error ("Cluster process %s exited with code %s", proc.name, proc.exitcode)
+                result = result or proc.exitcode or 1
+    except KeyboardInterrupt:
+        # The clusters receive the interrupt too; wait for them to finish closing.
+        for proc in processes:
+            proc.join()
+
+    return result
@@ -1,8 +1,18 @@
 # Administrator commands - commands for server administrators.
 
+import datetime
 import discord
 from discord.ext import commands
 import logging
+import pymongo
+from typing import Optional
+
+import audit
+import search
+from modlog import MAX_EMBED_DESCRIPTION, MAX_EMBED_TITLE, truncate
+
+# Characters of content shown for each audit record.
+AUDIT_EXCERPT = 200
 
 class Administration(commands.Cog):
     """Server administration commands (administrators only)."""
@@ -15,7 +25,7 @@ class Administration(commands.Cog):
         if ctx.guild is None:
             raise commands.NoPrivateMessage()
 
-        self.logger.debug (f"is server administrator? {ctx.author.guild_permissions.administrator}")
+        self.logger.debug ("is server administrator? %s", ctx.author.guild_permissions.administrator)
         return ctx.author.guild_permissions.administrator
 
     @commands.group()
@@ -29,15 +39,168 @@ class Administration(commands.Cog):
         """List the special channels available on this server."""
         self.logger.info('command invoked: admin get-special-channels')
         
-        modchan = ctx.config.get_moderator_channel(ctx.guild)
+        clist = ''
+
+        modchan = ctx.channels.moderator(ctx.guild)
         if modchan is not None:
             clist += f'Moderator channel: {modchan.name}\n'
 
+        pinchan = ctx.channels.autopin(ctx.guild)
+        if pinchan is not None:
+            clist += f'Autopin channel: {pinchan.name}\n'
+
+        if clist == '':
+            clist = 'No special channels are configured.'
+
         embed = discord.Embed(color=0x0000ff)
         embed.title = 'Special channels'
         embed.description = clist
 
         await ctx.send(embed=embed, reference=ctx.message)
 
+    @admin.group(name='autopin-backfill', invoke_without_command=True)
+    async def autopin_backfill(self, ctx):
+        """Pin older messages that already have enough pins, resuming an unfinished backfill."""
+        self.logger.info('command invoked: admin autopin-backfill')
+
+        gc = ctx.config.guild_config(ctx.guild)
+
+        if gc is None or gc.autopin_threshold == 0 or ctx.channels.autopin(ctx.guild) is None:
+            await ctx.reply('Autopin is not enabled on this server.')
+            return
+
+        if self.bot.backfill.running(ctx.guild.id):
+            await ctx.reply('An autopin backfill is already running; `admin autopin-backfill status` to see how it is going.')
+            return
+
+        try:
+            job = await self.bot.backfill.start(ctx.guild, gc.autopin_threshold)
+        except pymongo.errors.PyMongoError:
+            self.logger.error('Could not start an autopin backfill.', exc_info=True)
+            await ctx.reply('The database is unavailable, so the autopin backfill could not start; try again later.')
+            return
+
+        resumed = 'Resumed' if job.channels else 'Started'
+
+        await ctx.reply(f'{resumed} an autopin backfill (threshold {job.threshold}); '
+                        '`admin autopin-backfill status` to see how it is going.')
+
+    @autopin_backfill.command(name='status')
+    async def autopin_backfill_status(self, ctx):
+        """Show the progress of this server's autopin backfill."""
+        self.logger.info('command invoked: admin autopin-backfill status')
+
+        job = self.bot.backfill.job(ctx.guild.id)
+
+        if job is None:
+            await ctx.reply('No autopin backfill has run since the bot started.')
+            return
+
+        p = job.progress()
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = 'Autopin backfill'
+        embed.description = (f"**{p['status'].capitalize()}** (threshold {p['threshold']})\n"
+                             f"{p['channels_done']} of {p['channels']} channels done\n"
+                             f"{p['scanned']} messages read, {p['pinned']} pinned, {p['skipped']} skipped\n"
+                             f"{p['rate']:.0f} messages/s over {p['elapsed']:.0f}s")
+
+        if p['failures']:
+            embed.description += f"\n{p['failures']} channels stopped by errors; running the backfill again resumes them"
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
+    @autopin_backfill.command(name='cancel')
+    async def autopin_backfill_cancel(self, ctx):
+        """Stop this server's autopin backfill; running the backfill again resumes it."""
+        self.logger.info('command invoked: admin autopin-backfill cancel')
+
+        if self.bot.backfill.cancel(ctx.guild.id):
+            await ctx.reply('Autopin backfill cancelled; `admin autopin-backfill` resumes it.')
+        else:
+            await ctx.reply('No autopin backfill is running.')
+
+    @admin.command(name='search')
+    async def search_messages(self, ctx, *, terms: str):
+        """Search this server's messages, deleted ones too; "quote" phrases, and -exclude words."""
+        self.logger.info('command invoked: admin search')
+
+        if not self.bot.search.enabled:
+            await ctx.reply('The message search index is not enabled.')
+            return
+
+        try:
+            results = await self.bot.search.search(ctx.guild.id, terms, ctx.config.globals.search_results)
+        except pymongo.errors.ExecutionTimeout:
+            await ctx.reply('That search took too long; try more specific terms.')
+            return
+
+        lines = []
+
+        for r in results:
+            when = discord.utils.format_dt(r['time'].replace(tzinfo=datetime.timezone.utc), 'd')
+            notes = ''.join(note for flag, note in (('edited', ' (edited)'), ('deleted', ' **(deleted)**')) if r.get(flag))
+            lines.append(f"{when} @{r['author']} in <#{r['channel_id']}>{notes}: "
+                         f"{truncate(r['content'], AUDIT_EXCERPT)} [jump]({search.jump_url(r)})")
+
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = truncate(f'Messages matching {terms}', MAX_EMBED_TITLE)
+        embed.description = truncate('\n'.join(lines), MAX_EMBED_DESCRIPTION) if lines else 'No messages found.'
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
+    @admin.group(name='audit')
+    async def audit_group(self, ctx):
+        """search the record of deleted and edited messages; !help admin audit for details."""
+        if ctx.invoked_subcommand is None:
+            await ctx.reply('You must specify a subcommand to `admin audit`.')
+
+    @audit_group.command(name='user')
+    async def audit_user(self, ctx, user: discord.User, page: Optional[str] = None):
+        """List a user's deleted and edited messages, newest first; give the page code shown to see more."""
+        self.logger.info('command invoked: admin audit user')
+
+        await self.send_audit_page(ctx, audit.AUTHOR, user.id, f'Deleted and edited messages of @{user}',
+                                   f'admin audit user {user.id}', page)
+
+    @audit_group.command(name='channel')
+    async def audit_channel(self, ctx, channel: discord.TextChannel, page: Optional[str] = None):
+        """List the deleted and edited messages in a channel, newest first; give the page code shown to see more."""
+        self.logger.info('command invoked: admin audit channel')
+
+        await self.send_audit_page(ctx, audit.CHANNEL, channel.id, f'Deleted and edited messages in #{channel}',
+                                   f'admin audit channel {channel.id}', page)
+
+    async def send_audit_page(self, ctx, by: str, value: int, title: str, command: str, page: Optional[str]):
+        if not self.bot.audit.enabled:
+            await ctx.reply('The audit record is not enabled.')
+            return
+
+        try:
+            records, following = await self.bot.audit.search(ctx.guild.id, by, value, ctx.config.globals.audit_page_size, page)
+        except ValueError:
+            raise commands.BadArgument(f'`{page}` is not a page code.')
+
+        lines = []
+
+        for r in records:
+            when = discord.utils.format_dt(r['time'].replace(tzinfo=datetime.timezone.utc), 'f')
+            where = f"<#{r['channel_id']}>" if by == audit.AUTHOR else f"@{r['author']}"
+
+            if r['kind'] == audit.EDIT:
+                text = f"{truncate(r['content'], AUDIT_EXCERPT)} → {truncate(r['edited'], AUDIT_EXCERPT)}"
+            else:
+                text = truncate('\n'.join([r['content']] + r.get('attachments', [])), AUDIT_EXCERPT)
+
+            lines.append(f"{when} **{r['kind']}** {where}: {text}")
+
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = title
+        embed.description = truncate('\n'.join(lines), MAX_EMBED_DESCRIPTION) if lines else 'Nothing recorded.'
+
+        if following is not None:
+            embed.set_footer(text=f'More: {ctx.clean_prefix}{command} {following}')
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
 async def setup(bot):
     await bot.add_cog(Administration(bot))
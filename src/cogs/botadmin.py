@@ -1,10 +1,20 @@
 # HAL Administrator commands - commands for bot administrators.
 
+import asyncio
 import discord
 from discord.ext import commands
+import io
 import logging
+import os
+import time
 
 from bot import HeuristicAlgorithmic
+from helper import format_bytes, format_duration
+import logconfig
+import memory
+from modlog import truncate
+from metrics import process_rss
+from profiler import StackSampler
 
 class Hal(commands.Cog):
     bot: HeuristicAlgorithmic
@@ -17,7 +27,7 @@ class Hal(commands.Cog):
     async def cog_check(self, ctx):
         """Only the bot owner can use these commands."""
         valid = await self.bot.is_owner (ctx.author)
-        self.logger.debug (f"is owner? {valid}")
+        self.logger.debug ("is owner? %s", valid)
         return valid
 
     @commands.group()
@@ -37,6 +47,193 @@ class Hal(commands.Cog):
 
         await ctx.send(embed=embed, reference=ctx.message)
 
+    @hal.command(name='cache-stats')
+    async def cache_stats(self, ctx):
+        """Display the sizes and hit rates of the bot's in-memory caches."""
+        self.logger.info('command invoked: hal cache-stats')
+
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = 'HAL cache statistics'
+
+        pins = self.bot.pin_index.stats()
+        embed.add_field(name='**Pinned-message index**',
+                        value=f"{pins['entries']} entries in {pins['guilds']} guilds; {pins['hits']} hits, {pins['misses']} misses",
+                        inline=False)
+
+        embed.add_field(name='**Special channel cache**',
+                        value=f'{len(self.bot.channels)} resolved channels',
+                        inline=False)
+
+        embed.add_field(name='**Pin reaction counter**',
+                        value=f'{len(self.bot.pin_counts)} messages tracked',
+                        inline=False)
+
+        store = self.bot.messages.stats()
+        embed.add_field(name='**Message content store**',
+                        value=f"{store['messages']} messages in {store['guilds']} guilds; "
+                              f"{store['bytes'] / 1048576:.1f} of {store['budget'] / 1048576:.0f} MB; {store['evicted']} evicted",
+                        inline=False)
+
+        if self.bot.journal is not None:
+            journal = self.bot.journal.stats()
+            embed.add_field(name='**Message journal**',
+                            value=f"{journal['segments']} segments; {journal['written']} events written in {journal['commits']} commits; "
+                                  f"{journal['depth']} queued, {journal['dropped']} dropped",
+                            inline=False)
+
+        if self.bot.recorder is not None:
+            capture = self.bot.recorder.stats()
+            embed.add_field(name='**Gateway capture**',
+                            value=f"{capture['recorded']} events, {capture['bytes'] / 1048576:.1f} MB written to "
+                                  f"`{os.path.basename(capture['file'] or '')}`; {capture['depth']} queued, {capture['dropped']} dropped",
+                            inline=False)
+
+        writes = self.bot.writes.stats()
+        embed.add_field(name='**Write-behind queue**',
+                        value=f"{writes['depth']} records waiting in {writes['collections']} collections; "
+                              f"{writes['written']} written in {writes['batches']} batches; "
+                              f"{writes['retried']} retried, {writes['failed']} failed, {writes['dropped']} dropped",
+                        inline=False)
+
+        audit = self.bot.audit.stats()
+        embed.add_field(name='**Moderation audit record**',
+                        value=f"{audit['recorded']} deletes and edits recorded; {audit['searches']} searches"
+                              if audit['enabled'] else 'Disabled',
+                        inline=False)
+
+        found = self.bot.search.stats()
+        embed.add_field(name='**Message search index**',
+                        value=f"{found['indexed']} messages indexed, {found['edited']} edits, {found['deleted']} deletes; "
+                              f"{found['searches']} searches"
+                              if found['enabled'] else 'Disabled',
+                        inline=False)
+
+        limits = self.bot.limiter.stats()
+        embed.add_field(name='**Command rate limits**',
+                        value=f"{limits['buckets']} buckets; {limits['allowed']} commands allowed, {limits['refused']} refused; "
+                              f"{limits['expired']} buckets expired, {limits['evicted']} evicted",
+                        inline=False)
+
+        random_cog = self.bot.get_cog('Random')
+
+        if random_cog is not None:
+            dogs = random_cog.dogs.stats()
+            embed.add_field(name='**Random dog pool**',
+                            value=f"{dogs['depth']} of {dogs['size']} ready; {dogs['served']} served from the pool, "
+                                  f"{dogs['missed']} fetched on demand; {dogs['rejected']} rejected, {dogs['failures']} failures",
+                            inline=False)
+
+        echo = self.bot.modlog.stats()
+        embed.add_field(name='**Moderator echo queue**',
+                        value=f"{echo['depth']} notices waiting in {echo['channels']} channels; "
+                              f"{echo['sent']} sent in {echo['messages']} messages, {echo['dropped']} dropped; "
+                              f"flush latency {echo['last_flush_latency']:.2f}s (max {echo['max_flush_latency']:.2f}s)",
+                        inline=False)
+
+        embed.add_field(name='**Edit diff engine**',
+                        value=f'{self.bot.differ.inline} diffed inline, {self.bot.differ.offloaded} in worker processes',
+                        inline=False)
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
+    @hal.command()
+    async def stats(self, ctx):
+        """Display operational metrics: latencies, memory, and the slowest handlers."""
+        self.logger.info('command invoked: hal stats')
+
+        metrics = self.bot.metrics
+
+        def summary(histograms: dict, top: int = 5) -> str:
+            rows = sorted(histograms.items(), key=lambda kv: kv[1].sum, reverse=True)[:top]
+            if not rows:
+                return 'none yet'
+            return '\n'.join(f'`{"/".join(map(str, labels)) or "-"}`: {h.count} calls, p50 {h.quantile(0.5) * 1000:g}ms, '
+                             f'p99 {h.quantile(0.99) * 1000:g}ms' for labels, h in rows)
+
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = 'HAL operational statistics'
+
+        latencies = ', '.join(f'{shard}: {latency * 1000:.0f}ms' for shard, latency in self.bot.latencies)
+        lag = metrics.loop_lag.children.get(())
+
+        embed.add_field(name='**Gateway latency**', value=latencies or 'not connected', inline=False)
+        embed.add_field(name='**Event loop lag**',
+                        value=f'p50 {lag.quantile(0.5) * 1000:g}ms, p99 {lag.quantile(0.99) * 1000:g}ms' if lag else 'none yet',
+                        inline=False)
+        embed.add_field(name='**Memory**', value=format_bytes(process_rss()), inline=True)
+        embed.add_field(name='**Messages seen**',
+                        value=f'{metrics.messages_seen.total()} ({metrics.command_candidates.total()} possible commands)',
+                        inline=True)
+        embed.add_field(name='**Up time**', value=format_duration(time.time() - metrics.started), inline=True)
+        embed.add_field(name='**Busiest events**', value=summary(metrics.events.children), inline=False)
+        embed.add_field(name='**Busiest commands**', value=summary(metrics.commands.children), inline=False)
+        embed.add_field(name='**Database calls**', value=summary(metrics.database.children), inline=False)
+        embed.add_field(name='**HTTP requests**', value=summary(metrics.http.children), inline=False)
+
+        if logconfig.pipeline is not None:
+            logs = logconfig.pipeline.stats()
+            embed.add_field(name='**Logging**',
+                            value=f"{logs['depth']} records queued; {logs['dropped']} dropped when full, "
+                                  f"{logs['sampled_out']} sampled out, {logs['rate_limited']} rate limited",
+                            inline=False)
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
+    @hal.command(name='memory')
+    async def memory_report(self, ctx):
+        """Show the memory each cache (and the feature it serves) uses, in all and in the busiest servers."""
+        self.logger.info('command invoked: hal memory')
+
+        report = memory.report(self.bot)
+        plan = self.bot.gateway_plan
+
+        embed = discord.Embed(color=0x0000ff)
+        embed.title = 'HAL memory'
+
+        budget = f" of a {format_bytes(report['budget'])} budget" if report['budget'] is not None else ''
+        embed.description = (f"Process: {format_bytes(report['rss'])}{budget}\n"
+                             f"Intents: {', '.join(name for name, on in plan.intents if on)}\n"
+                             f"discord.py message cache: {plan.max_messages or 'off'}; member cache: "
+                             f"{', '.join(name for name, on in plan.member_cache_flags if on) or 'own member only'}")
+
+        caches = sorted(report['caches'].items(), key=lambda kv: kv[1], reverse=True)
+        embed.add_field(name='**By cache**',
+                        value='\n'.join(f'`{cache}` ({memory.FEATURES.get(cache, "-")}): {format_bytes(size)}'
+                                        for cache, size in caches) or 'nothing cached',
+                        inline=False)
+
+        busiest = sorted(report['guilds'].items(), key=lambda kv: sum(kv[1].values()), reverse=True)[:10]
+        lines = []
+
+        for guild_id, per_cache in busiest:
+            guild = self.bot.get_guild(guild_id)
+            detail = ', '.join(f'{cache} {format_bytes(size)}' for cache, size in sorted(per_cache.items()))
+            lines.append(f'**{guild or guild_id}**: {format_bytes(sum(per_cache.values()))} ({detail})')
+
+        embed.add_field(name='**By server**', value=truncate('\n'.join(lines), 1024) or 'nothing cached', inline=False)
+
+        await ctx.send(embed=embed, reference=ctx.message)
+
+    @hal.command()
+    async def profile(self, ctx, seconds: float = 10.0):
+        """Sample what the event loop is doing for a number of seconds; returns collapsed stacks."""
+        self.logger.info('command invoked: hal profile %s', seconds)
+
+        seconds = min(max(seconds, 1.0), ctx.config.globals.profile_max_seconds)
+        sampler = StackSampler(self.bot.loop_thread_id, ctx.config.globals.profile_interval)
+
+        await ctx.reply(f'Profiling for {seconds:g} seconds...')
+
+        # The sampler runs on a worker thread, looking in on the event loop thread.
+        stacks = await asyncio.to_thread(sampler.sample, seconds)
+        samples = sum(stacks.values())
+
+        data = io.BytesIO(StackSampler.render(stacks).encode('utf-8'))
+        filename = f'hal-profile-{int(time.time())}.folded'
+
+        await ctx.send(f'{samples} samples of {len(stacks)} distinct stacks (collapsed format, for flamegraph tools).',
+                       file=discord.File(data, filename=filename), reference=ctx.message)
+
     @hal.command()
     async def shutdown(self, ctx):
         """Shut down the bot (this command affects all servers)."""
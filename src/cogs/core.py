@@ -9,7 +9,8 @@ import __about__
 from bot import HeuristicAlgorithmic
 from context import Context
 from configuration import Configuration
-from helper import NotYetImplemented
+from helper import NotYetImplemented, format_bytes, format_duration
+from metrics import process_rss
 
 class Core(commands.Cog):
     bot: HeuristicAlgorithmic
@@ -22,18 +23,21 @@ class Core(commands.Cog):
     @commands.command()
     async def about(self, ctx):
         """Display information about the bot."""
-        self.logger.info(f'command invoked: about')
+        self.logger.info('command invoked: about')
         
         embed = discord.Embed(title='About The Bot', type='rich', color=0x0000ff)
         embed.set_author (name=f'Heuristic Algorithmic ({__about__.__version__})',
                           url='https://github.com/arkane-systems/heuristic-algorithmic',
                           icon_url='https://raw.githubusercontent.com/arkane-systems/heuristic-algorithmic/master/hal_eye.jpg')
 
-        # Latency
-        # Memory
-        # Messages Seen
-        # Presence
-        # Up Time
+        latency = self.bot.latency
+        uptime = discord.utils.utcnow() - self.bot.uptime if hasattr (self.bot, 'uptime') else None
+
+        embed.add_field(name='**Latency**', value=f'{latency * 1000:.0f}ms' if latency == latency else 'unknown', inline=True)
+        embed.add_field(name='**Memory**', value=format_bytes(process_rss()), inline=True)
+        embed.add_field(name='**Messages Seen**', value=str(self.bot.metrics.messages_seen.total()), inline=True)
+        embed.add_field(name='**Presence**', value=f'{len(self.bot.guilds)} servers', inline=True)
+        embed.add_field(name='**Up Time**', value=format_duration(uptime.total_seconds()) if uptime else 'unknown', inline=True)
 
         embed.add_field(name='**Author**', value='Cerebrate#5337', inline=True)
         embed.add_field(name='**Owner**', value=self.bot.owner.name, inline=True)
@@ -49,7 +53,7 @@ class Core(commands.Cog):
     @commands.command()
     async def echo(self, ctx, *, message):
         """Repeat back a given message to you."""
-        self.logger.info(f'command invoked: echo with parameters `{message}`')
+        self.logger.info('command invoked: echo with parameters `%s`', message)
         await ctx.reply(message)
 
     @commands.command()
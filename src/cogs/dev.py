@@ -13,7 +13,7 @@ class Developer(commands.Cog, command_attrs=dict(hidden=True)):
     async def cog_check(self, ctx):
         """Only the bot owner can use these commands."""
         valid = await self.bot.is_owner (ctx.author)
-        self.logger.debug (f"is owner? {valid}")
+        self.logger.debug ("is owner? %s", valid)
         return valid
 
     @commands.command()
@@ -1,5 +1,7 @@
 # Random commands - commands powered by randomness and chaos.
 
+import aiohttp
+import asyncio
 import discord
 from discord.ext import commands
 import logging
@@ -7,15 +9,24 @@ import random
 
 from bot import HeuristicAlgorithmic
 from context import Context
+from dogpool import VIDEO, DogPool
 from helper import NotYetImplemented
 
 class Random(commands.Cog):
     """Commands powered by randomness and chaos."""
     bot: HeuristicAlgorithmic
+    dogs: DogPool
 
     def __init__(self, bot: HeuristicAlgorithmic):
         self.bot = bot
         self.logger = bot.logger.getChild("commands.random")
+        self.dogs = DogPool(self.logger.getChild('dogs'), bot.session, bot.http_retry, bot.config.globals.dog_pool_size)
+
+    async def cog_load(self):
+        self.dogs.start()
+
+    async def cog_unload(self):
+        self.dogs.close()
 
     @property
     def display_emoji(self) -> discord.PartialEmoji:
@@ -32,28 +43,28 @@ class Random(commands.Cog):
         """Display a randomly chosen dog picture."""
         self.logger.info('command invoked: random dog')
 
-        async with ctx.session.get('https://random.dog/woof') as resp:
-            if resp.status != 200:
-                return await ctx.reply('No dog found :(')
+        dog = await self.dogs.take()
+
+        if dog is None:
+            return await ctx.reply('No dog found :(')
 
-            filename = await resp.text()
-            url = f'https://random.dog/{filename}'
-            filesize = ctx.guild.filesize_limit if ctx.guild else 8388608
+        if dog.kind != VIDEO:
+            return await ctx.send(embed=discord.Embed(title='Random Dog').set_image(url=dog.url), reference=ctx.message)
 
-            if filename.endswith(('.mp4', '.webm')):
-                async with ctx.typing():
-                    async with ctx.session.get(url) as other:
-                        if other.status != 200:
-                            return await ctx.reply('Could not download dog video :(')
+        filesize = ctx.guild.filesize_limit if ctx.guild else 8388608
 
-                        if int(other.headers['Content-Length']) >= filesize:
-                            return await ctx.reply(f'Video was too big to upload... See it here: {url} instead.')
+        async with ctx.typing():
+            try:
+                fp = await self.dogs.download(dog, filesize - 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.logger.warning('Could not download dog video %s.', dog.url, exc_info=True)
+                return await ctx.reply('Could not download dog video :(')
 
-                        fp = io.BytesIO(await other.read())
-                        await ctx.send(file=discord.File(fp, filename=filename, reference=ctx.message))
+            if fp is None:
+                return await ctx.reply(f'Video was too big to upload... See it here: {dog.url} instead.')
 
-            else:
-                await ctx.send(embed=discord.Embed(title='Random Dog').set_image(url=url), reference=ctx.message)
+            with fp:
+                await ctx.send(file=discord.File(fp, filename=dog.filename), reference=ctx.message)
 
     @random.command()
     async def number(self, ctx: Context, minimum: int = 0, maximum: int = 100):
@@ -1,11 +1,18 @@
 # Configuration data module
+#
+# The YAML configuration is validated and compiled once, at load time, into immutable
+# snapshots: a GlobalConfig for the bot as a whole and one GuildConfig per configured guild.
+# Event handlers read precomputed fields from these rather than walking the raw YAML.
 
+import constants
 import copy
+from dataclasses import dataclass
 import discord
 import helper
 from enum import Enum
 import os.path
 import sys
+from typing import Optional
 import yaml
 
 class GuildVerified(Enum):
@@ -13,11 +20,415 @@ class GuildVerified(Enum):
     UNVERIFIED = 2
     NOTPRESENT = 3
 
+class ConfigurationError(Exception):
+    """The configuration file is not valid."""
+    pass
+
+# What a command rate limit can apply to.
+LIMIT_SCOPES = ('user', 'channel', 'guild')
+
+@dataclass(frozen=True, slots=True)
+class CommandLimit:
+    scope: str
+    uses: int
+    seconds: float
+
+@dataclass(frozen=True, slots=True)
+class GlobalConfig:
+    discord_secret: Optional[str]
+    mongodb_connection: Optional[str]
+    mongodb_db_name: Optional[str]
+    mongodb_max_workers: int
+    write_flush_interval: float
+    write_max_batch: int
+    write_max_queue: int
+    audit_enabled: bool
+    audit_retention_days: int
+    audit_page_size: int
+    search_enabled: bool
+    search_retention_days: int
+    search_results: int
+    search_timeout: float
+    backfill_channels: int
+    backfill_checkpoint: int
+    pin_index_size: int
+    reaction_counter_size: int
+    message_store_budget: int
+    discord_message_cache: int
+    memory_budget: Optional[int]
+    log_each_message: bool
+    log_level: str
+    log_format: str
+    log_queue_size: int
+    log_sample_rates: tuple
+    log_rate_limits: tuple
+    parse_bot_msgs: bool
+    command_prefix: str
+    command_limits: tuple
+    command_limit_buckets: int
+    http_max_connections: int
+    http_max_connections_per_host: int
+    http_timeout: float
+    http_retries: int
+    http_retry_backoff: float
+    http_retry_max_delay: float
+    dog_pool_size: int
+    sharding_enabled: bool
+    shard_count: Optional[int]
+    shard_ids: Optional[tuple]
+    clusters: int
+    modlog_flush_interval: float
+    modlog_max_queue: int
+    diff_mode: str
+    diff_workers: int
+    diff_max_parts: int
+    offload_workers: int
+    offload_events: tuple
+    journal_enabled: bool
+    journal_path: str
+    journal_segment_seconds: float
+    journal_segment_bytes: int
+    journal_retain_segments: int
+    journal_commit_interval: float
+    journal_max_batch: int
+    metrics_enabled: bool
+    metrics_host: str
+    metrics_port: int
+    watchdog_threshold: float
+    profile_max_seconds: float
+    profile_interval: float
+    capture_enabled: bool
+    capture_path: str
+    capture_anonymize: bool
+    capture_max_bytes: int
+
+@dataclass(frozen=True, slots=True)
+class GuildConfig:
+    name: str
+    id: Optional[int]
+    faq: Optional[str]
+    autopin_channel: Optional[str]
+    moderator_channel: Optional[str]
+    autopin_threshold: int
+    show_mods_deletes: bool
+    show_mods_edits: bool
+    command_prefix: str
+
+class _Settings(dict):
+    """A mapping from the configuration that remembers which of its keys have been read."""
+    __slots__ = ('path', 'read')
+
+    def __init__(self, value: dict, path: str):
+        super().__init__(value)
+        self.path = path
+        self.read = set()
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+def _unknown(errors: list, *sections: _Settings) -> None:
+    """Report the keys of mappings from the configuration that nothing has read, such as misspelled ones."""
+    for settings in sections:
+        for key in settings:
+            if key not in settings.read:
+                errors.append(f'{settings.path}{key} is not a known setting')
+
+def _section(parent: dict, key: str, path: str, errors: list) -> _Settings:
+    """Get a nested mapping from the configuration, or an empty one if absent."""
+    value = parent.get(key)
+
+    if value is None:
+        return _Settings({}, f'{path}{key}.')
+
+    if not isinstance(value, dict):
+        errors.append(f'{path}{key} must be a mapping')
+        return _Settings({}, f'{path}{key}.')
+
+    return _Settings(value, f'{path}{key}.')
+
+def _value(parent: dict, key: str, kind: type, default, path: str, errors: list, minimum: int = None):
+    """Get a typed scalar from the configuration, or the default if absent."""
+    value = parent.get(key)
+
+    if value is None:
+        return default
+
+    # Whole numbers are acceptable where a float is wanted.
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+
+    # bool is a subclass of int; don't let one stand in for the other.
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        errors.append(f'{path}{key} must be of type {kind.__name__}')
+        return default
+
+    if minimum is not None and value < minimum:
+        errors.append(f'{path}{key} must be at least {minimum}')
+        return default
+
+    return value
+
+def _choice(parent: dict, key: str, choices: tuple, default: str, path: str, errors: list) -> str:
+    """Get one of a fixed set of strings from the configuration, or the default if absent."""
+    value = _value(parent, key, str, default, path, errors)
+
+    if value not in choices:
+        errors.append(f'{path}{key} must be one of: {", ".join(choices)}')
+        return default
+
+    return value
+
+def _prefix(parent: dict, key: str, default: str, path: str, errors: list) -> str:
+    """Get a command prefix from the configuration, or the default if absent."""
+    value = _value(parent, key, str, default, path, errors)
+
+    if not value.strip():
+        errors.append(f'{path}{key} must not be empty')
+        return default
+
+    return value
+
+def _megabytes(parent: dict, key: str, path: str, errors: list, minimum: int) -> Optional[int]:
+    """Get an optional size in megabytes from the configuration, in bytes, or None if absent."""
+    value = _value(parent, key, int, None, path, errors, minimum=minimum)
+    return value * 1024 * 1024 if value is not None else None
+
+def _choice_list(parent: dict, key: str, choices: tuple, default: tuple, path: str, errors: list) -> tuple:
+    """Get a list of strings, each one of a fixed set, from the configuration, or the default if absent."""
+    value = parent.get(key)
+
+    if value is None:
+        return default
+
+    if not isinstance(value, list) or not all(v in choices for v in value):
+        errors.append(f'{path}{key} must be a list of: {", ".join(choices)}')
+        return default
+
+    return tuple(value)
+
+def _int_list(parent: dict, key: str, path: str, errors: list) -> Optional[tuple]:
+    """Get a list of non-negative integers from the configuration, or None if absent."""
+    value = parent.get(key)
+
+    if value is None:
+        return None
+
+    if not isinstance(value, list) or not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in value):
+        errors.append(f'{path}{key} must be a list of non-negative integers')
+        return None
+
+    return tuple(value)
+
+def _number_map(parent: dict, key: str, path: str, errors: list, maximum: float = None) -> tuple:
+    """Get a mapping of names to non-negative numbers from the configuration, as (name, value) pairs."""
+    value = parent.get(key)
+
+    if value is None:
+        return ()
+
+    if (not isinstance(value, dict)
+            or not all(isinstance(k, str) and isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0
+                       and (maximum is None or v <= maximum) for k, v in value.items())):
+        limit = f' no more than {maximum}' if maximum is not None else ''
+        errors.append(f'{path}{key} must map names to non-negative numbers{limit}')
+        return ()
+
+    return tuple((k, float(v)) for k, v in value.items())
+
+def _command_limits(parent: dict, key: str, path: str, errors: list) -> tuple:
+    """Get per-command rate limits from the configuration, as (command, (CommandLimit, ...)) pairs."""
+    value = _section(parent, key, path, errors)
+    limits = []
+
+    for command, scopes in value.items():
+        cpath = f'{path}{key}.{command}.'
+
+        if not isinstance(scopes, dict) or not scopes:
+            errors.append(f'{path}{key}.{command} must map scopes ({", ".join(LIMIT_SCOPES)}) to limits')
+            continue
+
+        compiled = []
+
+        for scope in scopes:
+            if scope not in LIMIT_SCOPES:
+                errors.append(f'{cpath}{scope} must be one of: {", ".join(LIMIT_SCOPES)}')
+                continue
+
+            limit = _section(scopes, scope, cpath, errors)
+            uses = _value(limit, 'uses', int, None, f'{cpath}{scope}.', errors, minimum=1)
+            seconds = _value(limit, 'seconds', float, None, f'{cpath}{scope}.', errors)
+
+            if uses is None or seconds is None or seconds <= 0:
+                errors.append(f'{cpath}{scope} must give a number of uses and a positive number of seconds')
+                continue
+
+            _unknown(errors, limit)
+            compiled.append(CommandLimit(scope, uses, seconds))
+
+        limits.append((str(command), tuple(compiled)))
+
+    return tuple(limits)
+
+def compile_globals(data: dict, errors: list) -> GlobalConfig:
+    """Compile the global section of the configuration."""
+    glob = _section(data, 'global', '', errors)
+    database = _section(glob, 'database', 'global.', errors)
+    writes = _section(database, 'writeBehind', 'global.database.', errors)
+    audit = _section(glob, 'audit', 'global.', errors)
+    search = _section(glob, 'search', 'global.', errors)
+    autopin = _section(glob, 'autopin', 'global.', errors)
+    cache = _section(glob, 'cache', 'global.', errors)
+    memory = _section(glob, 'memory', 'global.', errors)
+    logcfg = _section(glob, 'logging', 'global.', errors)
+    options = _section(glob, 'options', 'global.', errors)
+    sharding = _section(glob, 'sharding', 'global.', errors)
+    modlog = _section(glob, 'modlog', 'global.', errors)
+    journal = _section(glob, 'journal', 'global.', errors)
+    metrics = _section(glob, 'metrics', 'global.', errors)
+    profiling = _section(glob, 'profiling', 'global.', errors)
+    capture = _section(glob, 'capture', 'global.', errors)
+    limits = _section(glob, 'commandLimits', 'global.', errors)
+    http = _section(glob, 'http', 'global.', errors)
+    random_cfg = _section(glob, 'random', 'global.', errors)
+    offload_cfg = _section(glob, 'offload', 'global.', errors)
+
+    journal_path = _value(journal, 'path', str, 'journal', 'global.journal.', errors)
+    if not os.path.isabs(journal_path):
+        journal_path = os.path.join(os.path.dirname(__file__), journal_path)
+
+    capture_path = _value(capture, 'path', str, 'captures', 'global.capture.', errors)
+    if not os.path.isabs(capture_path):
+        capture_path = os.path.join(os.path.dirname(__file__), capture_path)
+
+    shard_count = _value(sharding, 'shardCount', int, None, 'global.sharding.', errors, minimum=1)
+    shard_ids = _int_list(sharding, 'shardIds', 'global.sharding.', errors)
+
+    if shard_ids is not None:
+        if not shard_ids:
+            # Would start a cluster process running no shards at all.
+            errors.append('global.sharding.shardIds must not be empty')
+        elif shard_count is None:
+            errors.append('global.sharding.shardIds requires global.sharding.shardCount')
+        elif any(i >= shard_count for i in shard_ids):
+            errors.append('global.sharding.shardIds must all be less than global.sharding.shardCount')
+
+    # Each cluster serves its metrics on the next port up.
+    clusters = _value(sharding, 'clusters', int, 1, 'global.sharding.', errors, minimum=1)
+    metrics_port = _value(metrics, 'port', int, 9090, 'global.metrics.', errors, minimum=1)
+
+    if metrics_port + clusters - 1 > 65535:
+        errors.append('global.metrics.port must leave a port for each of global.sharding.clusters')
+
+    config = GlobalConfig(
+        discord_secret = _value(glob, 'discordSecret', str, None, 'global.', errors),
+        mongodb_connection = _value(database, 'connectionString', str, None, 'global.database.', errors),
+        mongodb_db_name = _value(database, 'databaseName', str, None, 'global.database.', errors),
+        mongodb_max_workers = _value(database, 'maxWorkers', int, 4, 'global.database.', errors, minimum=1),
+        write_flush_interval = _value(writes, 'flushInterval', float, 1.0, 'global.database.writeBehind.', errors, minimum=0),
+        write_max_batch = _value(writes, 'maxBatch', int, 500, 'global.database.writeBehind.', errors, minimum=1),
+        write_max_queue = _value(writes, 'maxQueue', int, 100000, 'global.database.writeBehind.', errors, minimum=1),
+        audit_enabled = _value(audit, 'enabled', bool, False, 'global.audit.', errors),
+        audit_retention_days = _value(audit, 'retentionDays', int, 90, 'global.audit.', errors, minimum=1),
+        audit_page_size = _value(audit, 'pageSize', int, 10, 'global.audit.', errors, minimum=1),
+        search_enabled = _value(search, 'enabled', bool, False, 'global.search.', errors),
+        search_retention_days = _value(search, 'retentionDays', int, 365, 'global.search.', errors, minimum=1),
+        search_results = _value(search, 'results', int, 10, 'global.search.', errors, minimum=1),
+        search_timeout = _value(search, 'timeout', float, 2.0, 'global.search.', errors, minimum=0.1),
+        backfill_channels = _value(autopin, 'backfillChannels', int, 3, 'global.autopin.', errors, minimum=1),
+        backfill_checkpoint = _value(autopin, 'backfillCheckpoint', int, 500, 'global.autopin.', errors, minimum=1),
+        pin_index_size = _value(cache, 'pinIndexSize', int, 1000, 'global.cache.', errors, minimum=0),
+        reaction_counter_size = _value(cache, 'reactionCounterSize', int, 10000, 'global.cache.', errors, minimum=0),
+        message_store_budget = _value(cache, 'messageStoreMegabytes', int, 64, 'global.cache.', errors, minimum=0) * 1024 * 1024,
+        discord_message_cache = _value(cache, 'discordMessages', int, 1000, 'global.cache.', errors, minimum=0),
+        memory_budget = _megabytes(memory, 'budgetMegabytes', 'global.memory.', errors, minimum=16),
+        log_each_message = _value(logcfg, 'logMessages', bool, False, 'global.logging.', errors),
+        log_level = _choice(logcfg, 'level', constants.LEVELS, 'DEBUG', 'global.logging.', errors),
+        log_format = _choice(logcfg, 'format', constants.FORMATS, constants.COLOR, 'global.logging.', errors),
+        log_queue_size = _value(logcfg, 'queueSize', int, 10000, 'global.logging.', errors, minimum=1),
+        log_sample_rates = _number_map(logcfg, 'sampling', 'global.logging.', errors, maximum=1),
+        log_rate_limits = _number_map(logcfg, 'rateLimits', 'global.logging.', errors),
+        parse_bot_msgs = _value(options, 'parseBotMessages', bool, False, 'global.options.', errors),
+        command_prefix = _prefix(options, 'commandPrefix', '!', 'global.options.', errors),
+        command_limits = _command_limits(limits, 'commands', 'global.commandLimits.', errors),
+        command_limit_buckets = _value(limits, 'maxBuckets', int, 100000, 'global.commandLimits.', errors, minimum=len(LIMIT_SCOPES)),
+        http_max_connections = _value(http, 'maxConnections', int, 100, 'global.http.', errors, minimum=1),
+        http_max_connections_per_host = _value(http, 'maxConnectionsPerHost', int, 10, 'global.http.', errors, minimum=1),
+        http_timeout = _value(http, 'timeout', float, 30.0, 'global.http.', errors, minimum=1),
+        http_retries = _value(http, 'retries', int, 3, 'global.http.', errors, minimum=0),
+        http_retry_backoff = _value(http, 'retryBackoff', float, 0.5, 'global.http.', errors, minimum=0),
+        http_retry_max_delay = _value(http, 'retryMaxDelay', float, 10.0, 'global.http.', errors, minimum=0),
+        dog_pool_size = _value(random_cfg, 'dogPoolSize', int, 5, 'global.random.', errors, minimum=0),
+        sharding_enabled = _value(sharding, 'enabled', bool, False, 'global.sharding.', errors),
+        shard_count = shard_count,
+        shard_ids = shard_ids,
+        clusters = clusters,
+        modlog_flush_interval = _value(modlog, 'flushInterval', float, 2.0, 'global.modlog.', errors, minimum=0),
+        modlog_max_queue = _value(modlog, 'maxQueue', int, 1000, 'global.modlog.', errors, minimum=1),
+        diff_mode = _choice(modlog, 'diffMode', constants.MODES, constants.LINE, 'global.modlog.', errors),
+        diff_workers = _value(modlog, 'diffWorkers', int, 1, 'global.modlog.', errors, minimum=0),
+        diff_max_parts = _value(modlog, 'diffMaxParts', int, 2, 'global.modlog.', errors, minimum=1),
+        offload_workers = _value(offload_cfg, 'workers', int, 0, 'global.offload.', errors, minimum=0),
+        offload_events = _choice_list(offload_cfg, 'events', constants.EVENTS, (constants.MESSAGE_EDIT,), 'global.offload.', errors),
+        journal_enabled = _value(journal, 'enabled', bool, False, 'global.journal.', errors),
+        journal_path = journal_path,
+        journal_segment_seconds = _value(journal, 'segmentSeconds', float, 3600.0, 'global.journal.', errors, minimum=1),
+        journal_segment_bytes = _value(journal, 'segmentMegabytes', int, 64, 'global.journal.', errors, minimum=1) * 1024 * 1024,
+        journal_retain_segments = _value(journal, 'retainSegments', int, 24, 'global.journal.', errors, minimum=1),
+        journal_commit_interval = _value(journal, 'commitInterval', float, 0.5, 'global.journal.', errors, minimum=0),
+        journal_max_batch = _value(journal, 'maxBatch', int, 1000, 'global.journal.', errors, minimum=1),
+        metrics_enabled = _value(metrics, 'enabled', bool, False, 'global.metrics.', errors),
+        metrics_host = _value(metrics, 'host', str, '127.0.0.1', 'global.metrics.', errors),
+        metrics_port = metrics_port,
+        watchdog_threshold = _value(profiling, 'watchdogThreshold', float, 0.25, 'global.profiling.', errors, minimum=0),
+        profile_max_seconds = _value(profiling, 'maxSeconds', float, 60.0, 'global.profiling.', errors, minimum=1),
+        profile_interval = _value(profiling, 'sampleInterval', float, 0.005, 'global.profiling.', errors, minimum=0.0001),
+        capture_enabled = _value(capture, 'enabled', bool, False, 'global.capture.', errors),
+        capture_path = capture_path,
+        capture_anonymize = _value(capture, 'anonymize', bool, True, 'global.capture.', errors),
+        capture_max_bytes = _value(capture, 'maxMegabytes', int, 256, 'global.capture.', errors, minimum=1) * 1024 * 1024,
+    )
+
+    _unknown(errors, glob, database, writes, audit, search, autopin, cache, memory, logcfg, options, sharding, modlog,
+             journal, metrics, profiling, capture, limits, http, random_cfg, offload_cfg)
+    return config
+
+def compile_guild(data: dict, path: str, errors: list, default_prefix: str) -> GuildConfig:
+    """Compile the configuration for a single guild; the command prefix defaults to the global one."""
+    channels = _section(data, 'channels', path, errors)
+    options = _section(data, 'options', path, errors)
+
+    config = GuildConfig(
+        name = data['name'],
+        id = _value(data, 'id', int, None, path, errors),
+        faq = _value(data, 'faq', str, None, path, errors),
+        autopin_channel = _value(channels, 'autopin', str, None, path + 'channels.', errors),
+        moderator_channel = _value(channels, 'moderator', str, None, path + 'channels.', errors),
+        autopin_threshold = _value(options, 'autopinThreshold', int, 0, path + 'options.', errors, minimum=0),
+        show_mods_deletes = _value(options, 'showModsDeletes', bool, False, path + 'options.', errors),
+        show_mods_edits = _value(options, 'showModsEdits', bool, False, path + 'options.', errors),
+        command_prefix = _prefix(options, 'commandPrefix', default_prefix, path + 'options.', errors),
+    )
+
+    _unknown(errors, data, channels, options)
+    return config
+
 class Configuration:
     configData: dict
     guildData: dict
+    globals: GlobalConfig
+
+    def __init__(self, data: Optional[dict] = None):
+        if data is not None:
+            # Configuration supplied directly (e.g. by the benchmarks); errors are the caller's.
+            self.configData = data
+            self.compile()
+            return
 
-    def __init__(self):
         try:
             with open (os.path.join (os.path.dirname(__file__), 'config.yaml'), "r") as yamlfile:
                 self.configData = yaml.safe_load (yamlfile)
@@ -25,14 +436,63 @@ class Configuration:
             print ("error reading configuration file.")
             sys.exit(2)
 
+        try:
+            self.compile()
+        except ConfigurationError as e:
+            print (f"error in configuration file: {e}")
+            sys.exit(2)
+
+    def compile(self) -> None:
+        """Validate the raw configuration and compile it into snapshots."""
+        if not isinstance(self.configData, dict):
+            raise ConfigurationError('top level must be a mapping')
+
+        errors = []
+        data = _Settings(self.configData, '')
+        self.globals = compile_globals(data, errors)
+
         # Set up guilds.
         self.guildData = {}
+        self._guilds_by_id = {}
+
+        guilds = data.get('guilds')
+
+        if guilds is not None and not isinstance(guilds, list):
+            errors.append('guilds must be a list')
+            guilds = None
+
+        # Where each guild name and ID was first given, for reporting duplicates.
+        names = {}
+        ids = {}
+
+        for index, guild in enumerate(guilds or []):
+            path = f'guilds[{index}].'
+
+            if not isinstance(guild, dict) or not isinstance(guild.get('name'), str):
+                errors.append(f'{path}name must be specified')
+                continue
 
-        if 'guilds' in self.configData:
-            if isinstance(self.configData['guilds'], list):
-                for guild in self.configData['guilds']:
-                    if 'name' in guild:
-                        self.guildData[guild['name']] = guild
+            gc = compile_guild(_Settings(guild, path), path, errors, self.globals.command_prefix)
+
+            if gc.name in names:
+                errors.append(f'{path}name duplicates guilds[{names[gc.name]}]')
+                continue
+
+            if gc.id is not None and gc.id in ids:
+                errors.append(f'{path}id duplicates guilds[{ids[gc.id]}]')
+                continue
+
+            names[gc.name] = index
+            self.guildData[gc.name] = gc
+
+            if gc.id is not None:
+                ids[gc.id] = index
+                self._guilds_by_id[gc.id] = gc
+
+        _unknown(errors, data)
+
+        if errors:
+            raise ConfigurationError('; '.join(errors))
 
     def get_config_dump(self) -> str:
         """Get the actual config as parsed, as a string."""
@@ -47,151 +507,87 @@ class Configuration:
     # Globals
     def discord_secret(self) -> str:
         """Get the Discord secret permitting bot login."""
-        if 'global' in self.configData:
-            if 'discordSecret' in self.configData['global']:
-                value = self.configData['global']['discordSecret']
-
-                if isinstance(value, str):
-                    return value
-
-        return None
+        return self.globals.discord_secret
 
     ## Database
     def mongodb_connection(self) -> str:
         """Get the mongodb connection string for the back-end database."""
-        if 'global' in self.configData:
-            if 'database' in self.configData['global']:
-                if 'connectionString' in self.configData['global']['database']:
-                    value = self.configData['global']['database']['connectionString']
-
-                    if isinstance(value,str):
-                        return value
-
-        return None
+        return self.globals.mongodb_connection
 
     def mongodb_db_name(self) -> str:
         """Get the mongodb database name for the back-end database."""
-        if 'global' in self.configData:
-            if 'database' in self.configData['global']:
-                if 'connectionString' in self.configData['global']['database']:
-                    value = self.configData['global']['database']['databaseName']
+        return self.globals.mongodb_db_name
 
-                    if isinstance(value,str):
-                        return value
+    def mongodb_max_workers(self) -> int:
+        """Get the maximum number of concurrent calls to the back-end database."""
+        return self.globals.mongodb_max_workers
 
-        return None
+    ## Caches
+    def pin_index_size(self) -> int:
+        """Get the maximum number of pinned message IDs to remember per guild."""
+        return self.globals.pin_index_size
 
     ## Logging
     def log_each_message(self) -> bool:
         """Log every Discord message received, or not?"""
-        if 'global' in self.configData:
-            if 'logging' in self.configData['global']:
-                if 'logMessages' in self.configData['global']['logging']:
-                    value = self.configData['global']['logging']['logMessages']
-
-                    if isinstance(value,bool):
-                        return value
-
-        return False
+        return self.globals.log_each_message
 
     ## Options
     def parse_bot_msgs(self) -> bool:
         """Parse messages from other bots, or not?"""
-        if 'global' in self.configData:
-            if 'options' in self.configData['global']:
-                if 'parseBotMessages' in self.configData['global']['options']:
-                    value = self.configData['global']['options']['parseBotMessages']
-
-                    if isinstance(value,bool):
-                        return value
-
-        return False
+        return self.globals.parse_bot_msgs
 
     # Guilds
-    def does_guild_config_exist(self, name: str) -> bool:
-        return name in self.guildData
+    def guild_config(self, guild: discord.Guild) -> Optional[GuildConfig]:
+        """Get the compiled configuration for a guild, by ID where possible.
 
-    def verify_guild_id(self, guild: discord.Guild) -> GuildVerified:
-        if guild.name in self.guildData:
-            if 'id' in self.guildData[guild.name]:
-                if self.guildData[guild.name]['id'] == guild.id:
-                    return GuildVerified.VERIFIED
-                else:
-                    return GuildVerified.UNVERIFIED
+        Guilds configured without an ID are matched by name the first time they are seen,
+        and by ID thereafter, so renaming a guild does not lose its configuration."""
+        if guild is None:
+            return None
 
-        return GuildVerified.NOTPRESENT
-
-    def get_faq_url(self, guild: discord.Guild) -> str:
-        if guild.name in self.guildData:
-            if 'faq' in self.guildData[guild.name]:
-                return self.guildData[guild.name]['faq']
+        gc = self._guilds_by_id.get(guild.id)
 
-        return None
+        if gc is None:
+            gc = self.guildData.get(guild.name)
 
-    ## Guild channels
-    def get_autopin_channel(self, guild: discord.Guild) -> discord.TextChannel:
-        gc = self.guildData[guild.name]
+            if gc is None or gc.id is not None:
+                # Unknown, or configured with some other guild's ID.
+                return None
 
-        if 'channels' in gc:
-            if 'moderator' in gc['channels']:
-                value = gc['channels']['autopin']
+            self._guilds_by_id[guild.id] = gc
 
-                if not isinstance (value, str):
-                    return None
+        return gc
 
-                chan = discord.utils.get(guild.text_channels, name=value)
-                return chan
+    def does_guild_config_exist(self, guild: discord.Guild) -> bool:
+        return (guild.id in self._guilds_by_id) or (guild.name in self.guildData)
 
-        return None
+    def verify_guild_id(self, guild: discord.Guild) -> GuildVerified:
+        gc = self._guilds_by_id.get(guild.id)
 
-    def get_moderator_channel(self, guild: discord.Guild) -> discord.TextChannel:
-        gc = self.guildData[guild.name]
+        if gc is not None and gc.id is not None:
+            return GuildVerified.VERIFIED
 
-        if 'channels' in gc:
-            if 'moderator' in gc['channels']:
-                value = gc['channels']['moderator']
+        gc = self.guildData.get(guild.name)
 
-                if not isinstance (value, str):
-                    return None
+        if gc is not None and gc.id is not None:
+            return GuildVerified.UNVERIFIED
 
-                chan = discord.utils.get(guild.text_channels, name=value)
-                return chan
+        return GuildVerified.NOTPRESENT
 
-        return None
+    def get_faq_url(self, guild: discord.Guild) -> str:
+        gc = self.guild_config(guild)
+        return gc.faq if gc is not None else None
 
     ## Guild options
     def autopin_threshold(self, guild: discord.Guild) -> int:
-        gc = self.guildData[guild.name]
-
-        if 'options' in gc:
-            if 'autopinThreshold' in gc['options']:
-                value = gc['options']['autopinThreshold']
-
-                if isinstance(value, int):
-                    return value
-
-        return 0
+        gc = self.guild_config(guild)
+        return gc.autopin_threshold if gc is not None else 0
 
     def show_mods_deletes(self, guild: discord.Guild) -> bool:
-        gc = self.guildData[guild.name]
-
-        if 'options' in gc:
-            if 'showModsDeletes' in gc['options']:
-                value = gc['options']['showModsDeletes']
-
-                if isinstance(value, bool):
-                    return value
+        gc = self.guild_config(guild)
+        return gc.show_mods_deletes if gc is not None else False
 
-        return False
-            
     def show_mods_edits(self, guild: discord.Guild) -> bool:
-        gc = self.guildData[guild.name]
-
-        if 'options' in gc:
-            if 'showModsEdits' in gc['options']:
-                value = gc['options']['showModsEdits']
-
-                if isinstance(value, bool):
-                    return value
-
-        return False
+        gc = self.guild_config(guild)
+        return gc.show_mods_edits if gc is not None else False
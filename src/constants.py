@@ -0,0 +1,25 @@
+# Shared constants - the names of the choices the configuration offers.
+#
+# Kept apart, with no imports of its own, so that the configuration can validate against them
+# without loading the modules that act on them, and worker processes that only need those
+# modules do not load the configuration.
+
+# Diff modes.
+LINE = 'line'
+WORD = 'word'
+MODES = (LINE, WORD)
+
+# Event types that can be offloaded.
+MESSAGE_DELETE = 'message_delete'
+BULK_MESSAGE_DELETE = 'bulk_message_delete'
+MESSAGE_EDIT = 'message_edit'
+EVENTS = (MESSAGE_DELETE, BULK_MESSAGE_DELETE, MESSAGE_EDIT)
+
+# Log output formats.
+COLOR = 'color'
+PLAIN = 'plain'
+JSON = 'json'
+FORMATS = (COLOR, PLAIN, JSON)
+
+# Log levels.
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
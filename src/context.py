@@ -3,25 +3,32 @@
 import aiohttp
 import discord
 from discord.ext import commands
-from typing import Union
+from typing import Optional, Union
 
 from aiohttp import ClientSession
+from channelcache import ChannelCache
 import configuration
-from pymongo.database import Database
+from database import AsyncDatabase
 
 class Context(commands.Context):
+    invoke_started: Optional[float]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.invoke_started = None
 
     @property
     def session(self) -> ClientSession:
         return self.bot.session
 
     @property
-    def db(self) -> Database:
+    def db(self) -> AsyncDatabase:
         return self.bot.db
 
+    @property
+    def channels(self) -> ChannelCache:
+        return self.bot.channels
+
     @property
     def config(self) -> configuration.Configuration:
         return self.bot.config
@@ -0,0 +1,139 @@
+# Asynchronous data-access layer over the MongoDB back-end.
+#
+# pymongo is a blocking driver; calling it directly from an event handler stalls the
+# event loop (and with it, gateway heartbeats and dispatch for every guild) for the
+# length of each round-trip. Everything the bot does with the database therefore goes
+# through the wrappers here, which run the pymongo calls on a small, bounded thread pool
+# and hand back awaitables.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import time
+import pymongo
+from pymongo.collection import Collection
+from pymongo.database import Database
+from typing import Any, Callable, Optional
+
+# MongoDB's error for an index that exists with different options.
+INDEX_OPTIONS_CONFLICT = 85
+
+def ensure_ttl_index(db: Database, collection: str, field: str, seconds: int) -> None:
+    """Create a TTL index expiring documents seconds after their field's time, or update the expiry of an existing one.
+
+    Blocking; for use while preparing the database."""
+    try:
+        db[collection].create_index(field, expireAfterSeconds=seconds)
+    except pymongo.errors.OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+
+        # The retention period was changed in the configuration.
+        db.command('collMod', collection, index={'keyPattern': {field: 1}, 'expireAfterSeconds': seconds})
+
+class AsyncCollection:
+    """Awaitable wrapper around a single pymongo collection."""
+    def __init__(self, database: 'AsyncDatabase', collection: Collection):
+        self._database = database
+        self._collection = collection
+
+    @property
+    def name(self) -> str:
+        return self._collection.name
+
+    @property
+    def sync(self) -> Collection:
+        """The underlying blocking collection; never use this from the event loop."""
+        return self._collection
+
+    async def find_one(self, *args, **kwargs) -> Optional[dict]:
+        return await self._database.run(self._collection.find_one, *args, **kwargs)
+
+    async def find(self, *args, limit: int = 0, **kwargs) -> list:
+        """Run a query and return the matching documents as a list.
+
+        The cursor is drained on the worker thread, since iterating it also performs I/O."""
+        def find():
+            return list(self._collection.find(*args, limit=limit, **kwargs))
+
+        return await self._database.run(find)
+
+    async def count_documents(self, *args, **kwargs) -> int:
+        return await self._database.run(self._collection.count_documents, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._database.run(self._collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self._database.run(self._collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._database.run(self._collection.update_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self._database.run(self._collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._database.run(self._collection.bulk_write, *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs) -> str:
+        return await self._database.run(self._collection.create_index, *args, **kwargs)
+
+class AsyncDatabase:
+    """Awaitable wrapper around a pymongo database, backed by a bounded thread pool."""
+    def __init__(self, db: Database, max_workers: int = 4):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hal-db')
+        self._collections = {}
+        self._ready: Optional[asyncio.Future] = None
+
+        # Called with (seconds, operation name) after each call, if set.
+        self.observer: Optional[Callable[[float, str], None]] = None
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        coll = self._collections.get(name)
+
+        if coll is None:
+            coll = AsyncCollection(self, self._db[name])
+            self._collections[name] = coll
+
+        return coll
+
+    @property
+    def name(self) -> str:
+        return self._db.name
+
+    @property
+    def sync(self) -> Database:
+        """The underlying blocking database; never use this from the event loop."""
+        return self._db
+
+    def prepare(self, func: Callable[[], Any]) -> asyncio.Future:
+        """Start a blocking setup call (connecting, creating indexes) on the worker pool.
+
+        Database calls made before it completes wait for it, so startup can carry on meanwhile."""
+        loop = asyncio.get_running_loop()
+        self._ready = loop.run_in_executor(self._executor, func)
+        return self._ready
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking database call on the worker pool and await its result."""
+        if self._ready is not None and not self._ready.done():
+            # Shielded, so that a cancelled call doesn't cancel the setup for everyone.
+            await asyncio.shield(self._ready)
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            if self.observer is not None:
+                self.observer(time.perf_counter() - started, func.__name__)
+
+    async def command(self, *args, **kwargs) -> dict:
+        return await self.run(self._db.command, *args, **kwargs)
+
+    def close(self) -> None:
+        """Wait for in-flight calls to complete, then release the worker threads."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,167 @@
+# Edit diff engine - renders moderator-facing diffs of edited messages.
+#
+# Diffing long messages costs real CPU, so anything beyond a small edit is rendered in a
+# bounded pool of worker processes rather than on the event loop. Output is always sized to
+# fit the moderator channel: it is split into at most a fixed number of parts, and
+# truncated beyond that.
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher, unified_diff
+import multiprocessing
+import re
+from typing import Optional
+
+from constants import LINE, WORD, MODES
+
+# Edits where both versions are shorter than this are diffed inline on the event loop.
+FAST_PATH_CHARS = 512
+
+# Unchanged text kept either side of a change in word mode.
+WORD_CONTEXT = 40
+
+# Above this many token comparisons, let SequenceMatcher's junk heuristic keep a word diff fast.
+WORD_AUTOJUNK_ABOVE = 250000
+
+TRUNCATED = '… (diff truncated)'
+
+_TOKENS = re.compile(r'\s+|\w+|[^\w\s]')
+
+def line_diff(before: str, after: str) -> list:
+    """Line-by-line unified diff, without context lines."""
+    return list(unified_diff(before.split('\n'), after.split('\n'),
+                             fromfile='before', tofile='after', n=0, lineterm=''))
+
+def _elide(text: str, first: bool, last: bool) -> str:
+    """Trim a run of unchanged text down to the context either side of the changes."""
+    head = 0 if first else WORD_CONTEXT
+    tail = 0 if last else WORD_CONTEXT
+
+    if len(text) <= head + tail + len(' … '):
+        return text
+
+    return text[:head] + ' … ' + text[len(text) - tail:]
+
+def _word_segment(before: str, after: str) -> str:
+    """Word-level diff of one changed region."""
+    a = _TOKENS.findall(before)
+    b = _TOKENS.findall(after)
+    matcher = SequenceMatcher(None, a, b, autojunk=len(a) * len(b) > WORD_AUTOJUNK_ABOVE)
+
+    out = []
+
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            out.append(''.join(a[i1:i2]))
+            continue
+
+        if i2 > i1:
+            out.append('[-' + ''.join(a[i1:i2]) + '-]')
+        if j2 > j1:
+            out.append('{+' + ''.join(b[j1:j2]) + '+}')
+
+    return ''.join(out)
+
+def word_diff(before: str, after: str) -> list:
+    """Word-level diff, marking removals as [-text-] and insertions as {+text+}.
+
+    Lines are matched first, so only the changed regions are diffed word by word."""
+    a = before.split('\n')
+    b = after.split('\n')
+    opcodes = SequenceMatcher(None, a, b).get_opcodes()
+
+    out = []
+
+    for n, (op, i1, i2, j1, j2) in enumerate(opcodes):
+        if op == 'equal':
+            out.append(_elide('\n'.join(a[i1:i2]), n == 0, n == len(opcodes) - 1))
+        else:
+            out.append(_word_segment('\n'.join(a[i1:i2]), '\n'.join(b[j1:j2])))
+
+    return '\n'.join(out).split('\n')
+
+def fit(lines: list, limit: int, max_parts: int) -> list:
+    """Pack lines into at most max_parts strings of at most limit characters each."""
+    parts = []
+    current = []
+    size = 0
+    truncated = False
+
+    for line in lines:
+        if len(line) > limit:
+            line = line[:limit - len(TRUNCATED)] + TRUNCATED
+
+        if current and size + len(line) + 1 > limit:
+            parts.append(current)
+
+            if len(parts) == max_parts:
+                truncated = True
+                break
+
+            current = []
+            size = 0
+
+        current.append(line)
+        size += len(line) + 1
+    else:
+        if current:
+            parts.append(current)
+
+    if truncated:
+        # Make room for the marker at the end of the last part.
+        last = parts[-1]
+
+        while last and sum(len(l) + 1 for l in last) + len(TRUNCATED) > limit:
+            last.pop()
+
+        last.append(TRUNCATED)
+
+    return ['\n'.join(part) for part in parts]
+
+def render(before: str, after: str, mode: str, limit: int, max_parts: int) -> list:
+    """Render the diff of an edit as a list of parts, each fitting within limit characters."""
+    lines = word_diff(before, after) if mode == WORD else line_diff(before, after)
+    return fit(lines, limit, max_parts)
+
+class DiffEngine:
+    """Renders edit diffs, off the event loop for anything but small edits."""
+    mode: str
+    workers: int
+    max_parts: int
+
+    def __init__(self, mode: str, workers: int, max_parts: int):
+        self.mode = mode
+        self.workers = workers
+        self.max_parts = max_parts
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        # Bound the number of diffs queued for the pool.
+        self._slots = asyncio.Semaphore(max(workers, 1) * 2)
+
+        # Statistics
+        self.inline = 0
+        self.offloaded = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn, rather than fork, since the bot process already has threads running.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+        return self._executor
+
+    async def diff(self, before: str, after: str, limit: int) -> list:
+        """Render the diff of an edit as at most max_parts parts of at most limit characters."""
+        if self.workers == 0 or (len(before) < FAST_PATH_CHARS and len(after) < FAST_PATH_CHARS):
+            self.inline += 1
+            return render(before, after, self.mode, limit, self.max_parts)
+
+        async with self._slots:
+            self.offloaded += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool(), render, before, after, self.mode, limit, self.max_parts)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,205 @@
+# Random dog pool - dogs fetched from random.dog ahead of time, so `random dog` answers at once.
+#
+# A background task keeps a small pool of dogs topped up: for each it asks random.dog for a
+# file name, then checks the file is there (and how big it is) with a HEAD request. A command
+# takes a dog from the pool, which wakes the task to replace it; only an empty pool makes
+# the command wait on random.dog itself. Videos are downloaded in chunks, and abandoned as
+# soon as they are known to be too big to upload; small ones are kept in memory, and larger
+# ones spilled to a temporary file, written from a worker thread so the event loop never
+# waits on the disk.
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import io
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Optional
+
+import aiohttp
+
+import httpclient
+
+BASE_URL = 'https://random.dog'
+
+IMAGE = 'image'
+VIDEO = 'video'
+VIDEO_SUFFIXES = ('.mp4', '.webm')
+
+# Download chunk size.
+CHUNK_BYTES = 64 * 1024
+
+# Downloads up to this size are kept in memory; larger ones go to a temporary file.
+SPOOL_BYTES = 1024 * 1024
+
+# Seconds to wait before trying to refill again, after random.dog could not be reached; also
+# the longest pause between bad answers from it, which start at REFILL_BAD_PAUSE and double.
+REFILL_PAUSE = 30.0
+REFILL_BAD_PAUSE = 1.0
+
+def _spill(buffer: io.BytesIO) -> BinaryIO:
+    """Move a download from memory to a temporary file; blocking."""
+    fp = tempfile.TemporaryFile()
+    fp.write(buffer.getbuffer())
+    buffer.close()
+    return fp
+
+@dataclass(frozen=True, slots=True)
+class Dog:
+    url: str
+    filename: str
+    kind: str
+    size: Optional[int]
+
+class DogPool:
+    """A background-refilled pool of dogs, checked to exist, with their type and size."""
+    def __init__(self, logger: logging.Logger, session: aiohttp.ClientSession, retry: httpclient.RetryPolicy,
+                 size: int, base_url: str = BASE_URL):
+        self.logger = logger
+        self.session = session
+        self.retry = retry
+        self.size = size
+        self.base_url = base_url
+
+        self._dogs = deque()
+        self._wanted = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistics
+        self.served = 0
+        self.missed = 0
+        self.rejected = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._dogs)
+
+    def start(self) -> None:
+        if self.size > 0:
+            self._task = asyncio.create_task(self._refill(), name='dog-pool')
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def take(self) -> Optional[Dog]:
+        """A dog from the pool, or straight from random.dog if it is empty; None if there are none to be had."""
+        self._wanted.set()
+
+        if self._dogs:
+            self.served += 1
+            return self._dogs.popleft()
+
+        self.missed += 1
+
+        try:
+            return await self.fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.failures += 1
+            return None
+
+    async def fetch(self) -> Optional[Dog]:
+        """Ask random.dog for a dog, and check it is there; None if random.dog gave a bad answer."""
+        async with httpclient.request(self.session, 'GET', f'{self.base_url}/woof', self.retry) as resp:
+            if resp.status != 200:
+                self.rejected += 1
+                return None
+
+            filename = (await resp.text()).strip()
+
+        url = f'{self.base_url}/{filename}'
+
+        async with httpclient.request(self.session, 'HEAD', url, self.retry) as resp:
+            if resp.status != 200:
+                self.rejected += 1
+                return None
+
+            size = resp.content_length
+
+        kind = VIDEO if filename.lower().endswith(VIDEO_SUFFIXES) else IMAGE
+        return Dog(url, filename, kind, size)
+
+    async def _refill(self) -> None:
+        # Bad answers in a row.
+        bad = 0
+
+        while True:
+            while len(self._dogs) < self.size:
+                try:
+                    dog = await self.fetch()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.failures += 1
+                    self.logger.warning('Could not fetch a dog from %s; trying again in %.0fs.', self.base_url, REFILL_PAUSE,
+                                        exc_info=True)
+                    await asyncio.sleep(REFILL_PAUSE)
+                    continue
+
+                if dog is None:
+                    # Not a usable dog; don't ask again straight away, nor keep asking quickly while
+                    # random.dog keeps answering badly.
+                    bad = min(bad + 1, 8)
+                    await asyncio.sleep(min(REFILL_BAD_PAUSE * 2 ** (bad - 1), REFILL_PAUSE))
+                    continue
+
+                bad = 0
+                self._dogs.append(dog)
+
+            self._wanted.clear()
+            await self._wanted.wait()
+
+    async def download(self, dog: Dog, max_bytes: int) -> Optional[BinaryIO]:
+        """Download a dog, returning the file positioned at its start, or None if it is larger than max_bytes.
+
+        Raises aiohttp.ClientResponseError if the download fails."""
+        if dog.size is not None and dog.size > max_bytes:
+            return None
+
+        async with httpclient.request(self.session, 'GET', dog.url, self.retry) as resp:
+            resp.raise_for_status()
+
+            # The size given up front may be missing, or wrong; count as it arrives.
+            if resp.content_length is not None and resp.content_length > max_bytes:
+                return None
+
+            fp: BinaryIO = io.BytesIO()
+            on_disk = False
+            received = 0
+
+            try:
+                async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                    received += len(chunk)
+
+                    if received > max_bytes:
+                        fp.close()
+                        return None
+
+                    if not on_disk and received > SPOOL_BYTES:
+                        fp = await asyncio.to_thread(_spill, fp)
+                        on_disk = True
+
+                    if on_disk:
+                        await asyncio.to_thread(fp.write, chunk)
+                    else:
+                        fp.write(chunk)
+            except BaseException:
+                fp.close()
+                raise
+
+        if on_disk:
+            await asyncio.to_thread(fp.seek, 0, os.SEEK_SET)
+        else:
+            fp.seek(0, os.SEEK_SET)
+
+        return fp
+
+    def stats(self) -> dict:
+        return {
+            'depth': len(self._dogs),
+            'size': self.size,
+            'served': self.served,
+            'missed': self.missed,
+            'rejected': self.rejected,
+            'failures': self.failures,
+        }
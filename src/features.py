@@ -0,0 +1,66 @@
+# Gateway features - the intents and discord.py caches that the configuration actually needs.
+#
+# Every intent the bot asks for is more gateway traffic to decode, and discord.py keeps much
+# of what arrives: members (and their users) for the member intent, and whole Message objects
+# in its message cache. Rather than asking for all of it regardless, the bot works out from
+# the configuration which of its features are in use, and asks for (and caches) only what
+# those need. With a memory budget set, discord.py's message cache is left off altogether,
+# the compact message store standing in for it, and the store is held within the budget.
+
+from dataclasses import dataclass
+from typing import Optional
+
+import discord
+
+import configuration
+
+# The share of a memory budget the message store may use.
+MESSAGE_STORE_SHARE = 0.5
+
+@dataclass(frozen=True, slots=True)
+class GatewayPlan:
+    intents: discord.Intents
+    member_cache_flags: discord.MemberCacheFlags
+    max_messages: Optional[int]
+    message_store_budget: int
+
+    # (intent or cache, the feature needing it) for each one enabled.
+    needs: tuple
+
+def plan(config: configuration.Configuration) -> GatewayPlan:
+    """Work out the intents and cache sizes the configured features need."""
+    glob = config.globals
+    guilds = config.guildData.values()
+    needs = []
+
+    # Guilds, channels and roles: everything depends on these.
+    intents = discord.Intents.none()
+    intents.guilds = True
+    needs.append(('guilds', 'guild, channel and role state'))
+
+    # Commands are recognised by their prefix, which needs message content, in guilds and DMs.
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    needs.append(('messages, message_content', 'commands'))
+
+    if any(gc.autopin_threshold > 0 for gc in guilds):
+        intents.guild_reactions = True
+        needs.append(('guild_reactions', 'autopin'))
+
+    # Nothing needs the member list: reaction events carry the reacting member, and messages
+    # their author. The bot's own member is always cached.
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+
+    # discord.py's message cache is only a fallback for messages the message store missed.
+    echoes = glob.audit_enabled or any(gc.show_mods_deletes or gc.show_mods_edits for gc in guilds)
+    max_messages = None
+    store_budget = glob.message_store_budget
+
+    if glob.memory_budget is not None:
+        store_budget = min(store_budget, int(glob.memory_budget * MESSAGE_STORE_SHARE))
+    elif echoes and glob.discord_message_cache > 0:
+        max_messages = glob.discord_message_cache
+        needs.append(('message cache', 'delete/edit echo and audit'))
+
+    return GatewayPlan(intents, member_cache_flags, max_messages, store_budget, tuple(needs))
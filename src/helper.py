@@ -1,8 +1,12 @@
 # Miscellaneous helper functions.
 
+import asyncio
+import contextlib
 import discord
 from discord.ext import commands
 import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
 
 # Formatter for logging subsystem.
 class ColorFormatter(logging.Formatter):
@@ -48,6 +52,24 @@ class ColorFormatter(logging.Formatter):
         record.exc_text = None
         return output
 
+# Human-readable formatting for status displays.
+def format_bytes(size: float) -> str:
+    if size < 1024:
+        return f'{int(size)} B'
+
+    for unit in ('KB', 'MB'):
+        size /= 1024
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+
+    return f'{size / 1024:.1f} GB'
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f'{days}d {hours}h {minutes}m {seconds}s'
+
 # Not Yet Implemented exception - used for command clarification
 class NotYetImplemented(Exception):
     """This feature has not yet been implemented."""
@@ -56,3 +78,63 @@ class NotYetImplemented(Exception):
 
     def __str__(self):
         return (str(self.message))
+
+# Single-flight execution - coalesces concurrent calls for the same key into one operation.
+class SingleFlight:
+    """Runs at most one operation per key at a time; concurrent callers share its result."""
+    def __init__(self):
+        self._inflight = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shield the shared operation so one caller being cancelled doesn't cancel it for all.
+        return await asyncio.shield(task)
+
+# Startup timing - how long each phase of getting the bot up and serving took.
+class StartupTimer:
+    """Records the start and duration of each startup phase, relative to when the process started."""
+    def __init__(self, began: Optional[float] = None):
+        self.began = time.perf_counter() if began is None else began
+        self.phases = []
+
+    def record(self, name: str, started: float, finished: Optional[float] = None) -> None:
+        """Record a phase from perf_counter() readings; it finishes now if no end is given."""
+        if finished is None:
+            finished = time.perf_counter()
+
+        self.phases.append((name, started - self.began, finished - started))
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def timed(self, name: str, func: Callable, *args, **kwargs) -> Callable[[], Any]:
+        """Wrap a blocking call, to be run elsewhere (e.g. on a worker thread), as a phase."""
+        def run():
+            with self.phase(name):
+                return func(*args, **kwargs)
+
+        return run
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.began
+
+    def summary(self) -> str:
+        """The phases in the order they started, each with its start offset and duration."""
+        phases = ', '.join(f'{name} {duration * 1000:.0f}ms (at +{offset * 1000:.0f}ms)'
+                           for name, offset, duration in sorted(self.phases, key=lambda p: p[1]))
+        return f'{self.elapsed():.2f}s: {phases}'
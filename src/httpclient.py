@@ -0,0 +1,84 @@
+# Outbound HTTP - the shared aiohttp session, and requests retried with backoff.
+#
+# Commands that call out to other web services share one session, whose connector bounds the
+# connections open in total and to any one host, so that a burst of commands can't open
+# sockets without limit. Requests made through request() are retried on connection errors,
+# timeouts and the statuses that mean "try again later", after an exponentially growing,
+# jittered delay (or the delay the server asks for with Retry-After).
+
+import asyncio
+import contextlib
+from dataclasses import dataclass
+import random
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from configuration import GlobalConfig
+
+# Statuses worth retrying.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    attempts: int
+    backoff: float
+    max_delay: float
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number attempt (from 0)."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        # "Full jitter": spread retries from many callers out, rather than having them all return at once.
+        return random.uniform(0, min(self.backoff * 2 ** attempt, self.max_delay))
+
+def create_session(config: GlobalConfig, trace_configs: Optional[list] = None) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=config.http_max_connections,
+                                     limit_per_host=config.http_max_connections_per_host,
+                                     ttl_dns_cache=300)
+
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=config.http_timeout),
+                                 trace_configs=trace_configs)
+
+def retry_policy(config: GlobalConfig) -> RetryPolicy:
+    return RetryPolicy(config.http_retries, config.http_retry_backoff, config.http_retry_max_delay)
+
+def _retry_after(resp: aiohttp.ClientResponse) -> Optional[float]:
+    try:
+        return float(resp.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+@contextlib.asynccontextmanager
+async def request(session: aiohttp.ClientSession, method: str, url: str, retry: RetryPolicy,
+                  **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+    """As session.request, retrying failures that may be temporary.
+
+    The last response is returned, whatever its status, once the retries are used up; the
+    last exception is raised if the request could not be made at all."""
+    attempt = 0
+
+    while True:
+        retry_after = None
+
+        try:
+            resp = await session.request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt >= retry.attempts:
+                raise
+        else:
+            if resp.status not in RETRY_STATUSES or attempt >= retry.attempts:
+                break
+
+            retry_after = _retry_after(resp)
+            resp.release()
+
+        await asyncio.sleep(retry.delay(attempt, retry_after))
+        attempt += 1
+
+    try:
+        yield resp
+    finally:
+        resp.release()
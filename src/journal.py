@@ -0,0 +1,291 @@
+# Durable message journal - write-behind, append-only log of message events.
+#
+# Message creates, edits and deletes are queued from the event loop without blocking, and
+# a background thread writes them to SQLite in group commits. The journal is split into
+# segments (one SQLite file each) that rotate on age or size, and only the most recent
+# segments are kept. At startup the segments are replayed into the message store, so that
+# deletes and edits of messages posted before a restart can still be echoed.
+
+import glob
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from messagestore import MessageStore, StoredMessage
+
+# Event kinds.
+CREATE = 1
+EDIT = 2
+DELETE = 3
+
+SEGMENT_SUFFIX = '.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    kind INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    channel_id INTEGER,
+    author_id INTEGER,
+    author TEXT,
+    content TEXT,
+    attachments TEXT,
+    time REAL NOT NULL
+)
+'''
+
+INSERT = '''INSERT INTO events (kind, guild_id, message_id, channel_id, author_id, author, content, attachments, time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Queue marker asking the writer thread to finish.
+_STOP = object()
+
+class MessageJournal:
+    """Write-behind journal of message events, in rotating SQLite segments."""
+    path: str
+    segment_seconds: float
+    segment_bytes: int
+    retain_segments: int
+    commit_interval: float
+    max_batch: int
+
+    def __init__(self, logger: logging.Logger, path: str, segment_seconds: float, segment_bytes: int,
+                 retain_segments: int, commit_interval: float, max_batch: int, max_queue: int = 100000):
+        self.logger = logger
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.retain_segments = retain_segments
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._segment: Optional[str] = None
+        self._segment_started = 0.0
+
+        # Whether the last attempt to open a segment failed, so the failure is logged once.
+        self._open_failed = False
+
+        # Statistics
+        self.written = 0
+        self.dropped = 0
+        self.commits = 0
+
+    # Recording (event loop side)
+    def _put(self, event: tuple) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_create(self, guild_id: int, record: StoredMessage) -> None:
+        self._put((CREATE, guild_id, record.id, record.channel_id, record.author_id, record.author,
+                   record.content, '\n'.join(record.attachments), time.time()))
+
+    def record_edit(self, guild_id: int, message_id: int, content: str) -> None:
+        self._put((EDIT, guild_id, message_id, None, None, None, content, None, time.time()))
+
+    def record_delete(self, guild_id: int, message_id: int) -> None:
+        self._put((DELETE, guild_id, message_id, None, None, None, None, None, time.time()))
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # Segments
+    def segments(self) -> list:
+        """The journal's segment files, oldest first."""
+        return sorted(glob.glob(os.path.join(self.path, '*' + SEGMENT_SUFFIX)))
+
+    def _open_segment(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+        # Millisecond timestamps, zero-padded, so that segment names sort chronologically.
+        self._segment_started = time.time()
+        self._segment = os.path.join(self.path, f'{int(self._segment_started * 1000):015d}{SEGMENT_SUFFIX}')
+
+        conn = sqlite3.connect(self._segment)
+
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            conn.commit()
+        except sqlite3.Error:
+            conn.close()
+            raise
+
+        self._conn = conn
+
+        # Drop the oldest segments beyond the retention count.
+        for old in self.segments()[:-self.retain_segments]:
+            for f in (old, old + '-wal', old + '-shm'):
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    self.logger.warning('Cannot remove old message journal file %s.', f, exc_info=True)
+
+    def _ensure_segment(self) -> bool:
+        """Open a fresh segment if there is none yet, or the current one is full; returns whether one is open."""
+        if self._conn is not None and not self._segment_full():
+            return True
+
+        try:
+            self._open_segment()
+        except (sqlite3.Error, OSError):
+            # A full disk or an unwritable directory may yet clear up; keep trying with each batch.
+            if not self._open_failed:
+                self.logger.exception('Cannot open a message journal segment in %s; dropping events until one opens.', self.path)
+
+            self._open_failed = True
+            return False
+
+        if self._open_failed:
+            self.logger.info('Opened message journal segment %s; journalling again.', self._segment)
+
+        self._open_failed = False
+        return True
+
+    def _segment_full(self) -> bool:
+        if time.time() - self._segment_started >= self.segment_seconds:
+            return True
+
+        size = 0
+
+        for f in (self._segment, self._segment + '-wal'):
+            try:
+                size += os.path.getsize(f)
+            except OSError:
+                pass
+
+        return size >= self.segment_bytes
+
+    # Writing (background thread side)
+    def _write(self, batch: list) -> None:
+        if not self._ensure_segment():
+            self.dropped += len(batch)
+            return
+
+        try:
+            self._conn.executemany(INSERT, batch)
+            self._conn.commit()
+        except sqlite3.Error:
+            self.logger.exception('Failed to write %d events to the message journal.', len(batch))
+            return
+
+        self.written += len(batch)
+        self.commits += 1
+
+    def _run(self) -> None:
+        # The segment connection belongs to this thread; it is opened with the first batch.
+        stopping = False
+
+        while not stopping:
+            # Wait for an event, then gather whatever else arrives within the commit interval.
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.commit_interval
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if _STOP in batch:
+                stopping = True
+                batch = [event for event in batch if event is not _STOP]
+
+                # Drain anything still queued behind the stop marker.
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            if batch:
+                self._write(batch)
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def start(self) -> None:
+        """Start the writer thread, which writes to a fresh segment."""
+        os.makedirs(self.path, exist_ok=True)
+
+        self._thread = threading.Thread(target=self._run, name='hal-journal', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Write out everything queued, then stop the writer thread. Blocks until done."""
+        if self._thread is None:
+            return
+
+        # The queue may be full; wait for room while the writer thread is still there to make it.
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+
+        self._thread.join()
+        self._thread = None
+
+    # Replay
+    def replay(self, store: MessageStore) -> int:
+        """Load the journal's events into the message store. Blocks; returns the events replayed."""
+        count = 0
+
+        for segment in self.segments():
+            try:
+                conn = sqlite3.connect(segment)
+            except sqlite3.Error:
+                self.logger.exception('Cannot open message journal segment %s; skipping.', segment)
+                continue
+
+            try:
+                rows = conn.execute('SELECT kind, guild_id, message_id, channel_id, author_id, author, content, attachments '
+                                    'FROM events ORDER BY seq')
+
+                for kind, guild_id, message_id, channel_id, author_id, author, content, attachments in rows:
+                    if kind == CREATE:
+                        store.add_record(guild_id, StoredMessage(message_id, channel_id, author_id, author, content,
+                                                                 tuple(attachments.split('\n')) if attachments else ()))
+                    elif kind == EDIT:
+                        store.update(guild_id, message_id, content)
+                    elif kind == DELETE:
+                        store.pop(guild_id, message_id)
+
+                    count += 1
+            except sqlite3.Error:
+                self.logger.exception('Message journal segment %s is damaged; replayed what was readable.', segment)
+            finally:
+                conn.close()
+
+        return count
+
+    def stats(self) -> dict:
+        return {
+            'segments': len(self.segments()),
+            'depth': self.depth,
+            'written': self.written,
+            'commits': self.commits,
+            'dropped': self.dropped,
+        }
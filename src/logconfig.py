@@ -0,0 +1,215 @@
+# Logging pipeline - queued, sampled and rate-limited log output on a background thread.
+#
+# Code on the event loop only builds a LogRecord and puts it on a queue; formatting
+# (including the %-style arguments) and writing happen on a listener thread. High-volume
+# categories can be sampled or rate limited before they are even queued. Output is coloured
+# text for a terminal, plain text, or one JSON object per line for log collectors.
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+from constants import COLOR, PLAIN, JSON, FORMATS, LEVELS
+import helper
+
+PLAIN_FORMAT = '%(asctime)s %(levelname)-8s %(name)s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has; any others were passed as `extra`, and go into JSON output.
+_STANDARD = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'taskName'}
+
+def _matches(name: str, category: str) -> bool:
+    """Does a logger belong to a category? 'messages' matches both hal.messages and hal.cluster0.messages."""
+    return name == category or name.endswith('.' + category)
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD:
+                entry[key] = value
+
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Lets through only a fraction of the records in each configured category."""
+    def __init__(self, rates: tuple):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for category, rate in self.rates:
+            if _matches(record.name, category):
+                if random.random() < rate:
+                    return True
+
+                self.dropped += 1
+                return False
+
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most a given number of records per second in each configured category.
+
+    The next record let through after some were held back says how many."""
+    def __init__(self, limits: tuple):
+        super().__init__()
+        self.limits = limits
+        self.dropped = 0
+
+        # Per category: [tokens, last refill, records held back since the last one let through]
+        self._buckets = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for category, rate in self.limits:
+            if _matches(record.name, category):
+                return self._admit(category, rate, record)
+
+        return True
+
+    def _admit(self, category: str, rate: float, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.get(category)
+
+        if bucket is None:
+            # Allow a burst of up to one second's worth.
+            bucket = [rate, now, 0]
+            self._buckets[category] = bucket
+
+        tokens = min(rate, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            self.dropped += 1
+            return False
+
+        bucket[0] = tokens - 1
+
+        if bucket[2]:
+            record.msg = f'{record.getMessage()} ({bucket[2]} similar records suppressed)'
+            record.args = ()
+            bucket[2] = 0
+
+        return True
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener thread, dropping (and counting) them if it falls behind."""
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The standard handler formats the record here, on the caller's thread, so that it can
+        # cross a process boundary; ours stays in-process, so formatting is left to the listener.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room, rather than failing, if the queue is full when stopping.
+        self.queue.put(self._sentinel)
+
+class LogPipeline:
+    """The queue, filters and listener thread carrying log records from the loggers to the output."""
+    def __init__(self, loggers: list, output: logging.Handler, queue_size: int, sample_rates: tuple, rate_limits: tuple):
+        self.loggers = loggers
+        self.output = output
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.sampler = SamplingFilter(sample_rates)
+        self.limiter = RateLimitFilter(rate_limits)
+
+        self.handler = QueueingHandler(self.queue)
+        self.handler.addFilter(self.sampler)
+        self.handler.addFilter(self.limiter)
+
+        self._listener: Optional[_Listener] = _Listener(self.queue, output)
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._listener.start()
+
+        for logger in self.loggers:
+            logger.addHandler(self.handler)
+
+    def stop(self) -> None:
+        """Write out everything queued; later records are written directly, on the caller's thread."""
+        with self._lock:
+            if self._listener is None:
+                return
+
+            for logger in self.loggers:
+                logger.addHandler(self.output)
+                logger.removeHandler(self.handler)
+
+            self._listener.stop()
+            self._listener = None
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampler.dropped,
+            'rate_limited': self.limiter.dropped,
+        }
+
+# The running pipeline, if logging has been started.
+pipeline: Optional[LogPipeline] = None
+
+def start(level: str, output_format: str, queue_size: int, sample_rates: tuple = (), rate_limits: tuple = ()) -> LogPipeline:
+    """Route the bot's (and discord.py's) logging through a queue to a background writer."""
+    global pipeline
+
+    output = logging.StreamHandler()
+
+    if output_format == JSON:
+        output.setFormatter(JsonFormatter())
+    elif output_format == PLAIN:
+        output.setFormatter(logging.Formatter(PLAIN_FORMAT, DATE_FORMAT))
+    else:
+        output.setFormatter(helper.ColorFormatter())
+
+    hal = logging.getLogger('hal')
+    hal.setLevel(level)
+
+    # Without a handler, discord.py's logging reaches stderr only at WARNING and above, unformatted;
+    # INFO is the level the library's own setup uses.
+    library = logging.getLogger('discord')
+    library.setLevel(logging.INFO)
+
+    pipeline = LogPipeline([hal, library], output, queue_size, sample_rates, rate_limits)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+
+    return pipeline
+
+def stop() -> None:
+    if pipeline is not None:
+        pipeline.stop()
@@ -0,0 +1,65 @@
+# Memory report - what each cache holds, per guild, and the feature it serves.
+#
+# The message store accounts for its own records; the other caches are estimated from their
+# entry counts and a typical cost per entry. The figures are for comparing caches, guilds and
+# features, not an exact account of the process RSS (which also holds the interpreter, the
+# libraries and the rest of discord.py's state).
+
+import sys
+
+import metrics
+
+# Typical bytes per entry: a discord.py Message (with its author, and not counting its
+# content) or Member (with its User) are rough figures; the OrderedDict entries of the pin
+# index and reaction counter were measured with tracemalloc.
+DISCORD_MESSAGE_BYTES = 2400
+MEMBER_BYTES = 1100
+PIN_INDEX_ENTRY_BYTES = 140
+PIN_COUNT_ENTRY_BYTES = 175
+
+# The feature each cache is there for.
+FEATURES = {
+    'message_store': 'delete/edit echo and audit',
+    'discord_messages': 'delete/edit echo fallback',
+    'members': 'member cache',
+    'pin_index': 'autopin',
+    'pin_counts': 'autopin',
+}
+
+def report(bot) -> dict:
+    """Estimated bytes held by each cache, in total and per guild, with the process RSS and the budget."""
+    guilds = {}
+
+    def add(guild_id: int, cache: str, size: int) -> None:
+        if size:
+            per_guild = guilds.setdefault(guild_id, {})
+            per_guild[cache] = per_guild.get(cache, 0) + size
+
+    for guild_id, size in bot.messages.guild_sizes().items():
+        add(guild_id, 'message_store', size)
+
+    for message in bot.cached_messages:
+        if message.guild is not None:
+            add(message.guild.id, 'discord_messages', DISCORD_MESSAGE_BYTES + sys.getsizeof(message.content))
+
+    for guild in bot.guilds:
+        add(guild.id, 'members', len(guild.members) * MEMBER_BYTES)
+
+    for guild_id, entries in bot.pin_index.guild_sizes().items():
+        add(guild_id, 'pin_index', entries * PIN_INDEX_ENTRY_BYTES)
+
+    caches = {}
+
+    for per_guild in guilds.values():
+        for cache, size in per_guild.items():
+            caches[cache] = caches.get(cache, 0) + size
+
+    # Not kept per guild.
+    caches['pin_counts'] = len(bot.pin_counts) * PIN_COUNT_ENTRY_BYTES
+
+    return {
+        'rss': metrics.process_rss(),
+        'budget': bot.config.globals.memory_budget,
+        'caches': caches,
+        'guilds': guilds,
+    }
@@ -0,0 +1,136 @@
+# Compact store of recent message content, for echoing deletes and edits to moderators.
+#
+# discord.py's own message cache holds full Message objects and only a thousand of them,
+# which on a busy server covers a few minutes. This store keeps just the fields the
+# moderator echo needs, in slotted records, within a configurable memory budget.
+
+from collections import OrderedDict
+import discord
+import sys
+from typing import Iterable, Optional
+
+# Approximate fixed cost of one stored record: the slotted object, its integer fields, the
+# attachments tuple, and its entry in the per-guild ordered dict.
+RECORD_OVERHEAD = 320
+
+class StoredMessage:
+    """The parts of a message needed to echo its deletion or edit."""
+    __slots__ = ('id', 'channel_id', 'author_id', 'author', 'content', 'attachments')
+
+    def __init__(self, id: int, channel_id: int, author_id: int, author: str, content: str, attachments: tuple = ()):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.author = author
+        self.content = content
+        self.attachments = attachments
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> 'StoredMessage':
+        return cls(message.id, message.channel.id, message.author.id, str(message.author), message.content,
+                   tuple(att.url for att in message.attachments))
+
+    def footprint(self) -> int:
+        """Approximate memory used by this record, in bytes."""
+        return (RECORD_OVERHEAD + sys.getsizeof(self.author) + sys.getsizeof(self.content)
+                + sum(sys.getsizeof(url) for url in self.attachments))
+
+class GuildMessages:
+    """Recent messages of one guild, oldest first, within a byte budget."""
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.evicted = 0
+        self.messages = OrderedDict()
+
+    def add(self, record: StoredMessage) -> None:
+        self.remove(record.id)
+        self.messages[record.id] = record
+        self.size += record.footprint()
+
+        while self.size > self.budget and self.messages:
+            _, old = self.messages.popitem(last=False)
+            self.size -= old.footprint()
+            self.evicted += 1
+
+    def remove(self, message_id: int) -> Optional[StoredMessage]:
+        record = self.messages.pop(message_id, None)
+
+        if record is not None:
+            self.size -= record.footprint()
+
+        return record
+
+class MessageStore:
+    """Per-guild stores of recent message content, sharing a total memory budget equally."""
+    budget: int
+
+    def __init__(self, budget: int, guild_count: int):
+        self.budget = budget
+        self.guild_budget = budget // max(guild_count, 1)
+        self._guilds = {}
+
+    def _guild(self, guild_id: int) -> GuildMessages:
+        store = self._guilds.get(guild_id)
+
+        if store is None:
+            store = GuildMessages(self.guild_budget)
+            self._guilds[guild_id] = store
+
+        return store
+
+    def add(self, message: discord.Message) -> StoredMessage:
+        """Remember a newly posted message, returning the record stored for it."""
+        record = StoredMessage.from_message(message)
+        self._guild(message.guild.id).add(record)
+        return record
+
+    def add_record(self, guild_id: int, record: StoredMessage) -> None:
+        self._guild(guild_id).add(record)
+
+    def get(self, guild_id: int, message_id: int) -> Optional[StoredMessage]:
+        store = self._guilds.get(guild_id)
+        return store.messages.get(message_id) if store is not None else None
+
+    def pop(self, guild_id: int, message_id: int) -> Optional[StoredMessage]:
+        """Forget a deleted message, returning what was stored for it."""
+        store = self._guilds.get(guild_id)
+        return store.remove(message_id) if store is not None else None
+
+    def pop_many(self, guild_id: int, message_ids: Iterable[int]) -> list:
+        """Forget several deleted messages, returning what was stored for those we had."""
+        records = (self.pop(guild_id, message_id) for message_id in message_ids)
+        return [record for record in records if record is not None]
+
+    def update(self, guild_id: int, message_id: int, content: str) -> Optional[StoredMessage]:
+        """Record the new content of an edited message, returning the previous record."""
+        store = self._guilds.get(guild_id)
+
+        if store is None:
+            return None
+
+        old = store.messages.get(message_id)
+
+        if old is not None:
+            store.add(StoredMessage(old.id, old.channel_id, old.author_id, old.author, content, old.attachments))
+
+        return old
+
+    def guild_sizes(self) -> dict:
+        """Bytes stored for each guild."""
+        return {guild_id: store.size for guild_id, store in self._guilds.items()}
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+    def __len__(self) -> int:
+        return sum(len(store.messages) for store in self._guilds.values())
+
+    def stats(self) -> dict:
+        return {
+            'guilds': len(self._guilds),
+            'messages': len(self),
+            'bytes': sum(store.size for store in self._guilds.values()),
+            'budget': self.budget,
+            'evicted': sum(store.evicted for store in self._guilds.values()),
+        }
@@ -0,0 +1,228 @@
+# Operational metrics - latency histograms, gauges and counters, exposed for Prometheus.
+#
+# Recording is a bisect and a few additions per observation, cheap enough to leave on all
+# the time. Gauges that are expensive or awkward to maintain incrementally (memory, cache
+# sizes, gateway latency) are computed from callbacks only when the metrics are read.
+
+from aiohttp import web
+import aiohttp
+import asyncio
+from bisect import bisect_left
+import logging
+import os
+import resource
+import time
+from typing import Callable, Optional
+
+# Latency buckets, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+class Histogram:
+    """Cumulative-bucket latency histogram for one label set."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile, as the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+
+        return float('inf')
+
+class HistogramFamily:
+    """A named histogram, with one Histogram per distinct label set."""
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.children = {}
+
+    def observe(self, value: float, *labels) -> None:
+        child = self.children.get(labels)
+
+        if child is None:
+            child = Histogram(self.buckets)
+            self.children[labels] = child
+
+        child.observe(value)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+
+        for values, h in sorted(self.children.items()):
+            cumulative = 0
+
+            for bound, n in zip(self.buckets, h.counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), values + (bound,))} {cumulative}')
+
+            lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), values + ("+Inf",))} {h.count}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {h.sum}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {h.count}')
+
+        return lines
+
+class CounterFamily:
+    """A named, monotonically increasing counter, with one value per label set."""
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, amount: int = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> int:
+        return sum(self.values.values())
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(self.labels, values)} {v}' for values, v in sorted(self.values.items()))
+        return lines
+
+class GaugeFamily:
+    """A named gauge whose values are produced by a callback when read."""
+    def __init__(self, name: str, help: str, labels: tuple, collect: Callable[[], dict]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        lines.extend(f'{self.name}{_labels(self.labels, values)} {v}' for values, v in sorted(self.collect().items()))
+        return lines
+
+def process_rss() -> int:
+    """Resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Not Linux; fall back on the peak, which getrusage reports in kilobytes.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Metrics:
+    """The bot's metric registry."""
+    def __init__(self):
+        self.started = time.time()
+        self.families = []
+
+        self.events = self.histogram('hal_event_seconds', 'Time spent in gateway event handlers.', ('event',))
+        self.commands = self.histogram('hal_command_seconds', 'Time spent running commands.', ('command',))
+        self.database = self.histogram('hal_mongo_seconds', 'Duration of MongoDB calls.', ('operation',))
+        self.http = self.histogram('hal_http_seconds', 'Duration of outbound HTTP requests.', ('method', 'host', 'status'))
+        self.loop_lag = self.histogram('hal_event_loop_lag_seconds', 'Lateness of periodic event-loop wakeups.', ())
+
+        self.messages_seen = self.counter('hal_messages_seen_total', 'Messages received from the gateway.')
+        self.command_candidates = self.counter('hal_command_candidates_total', 'Messages starting with a command prefix.')
+        self.commands_throttled = self.counter('hal_commands_throttled_total', 'Commands refused for going over a rate limit.',
+                                               ('command', 'scope'))
+        self.event_errors = self.counter('hal_event_errors_total', 'Exceptions raised by event handlers.', ('event',))
+
+        self.gauge('hal_process_resident_bytes', 'Resident memory of the bot process.', (), lambda: {(): process_rss()})
+        self.gauge('hal_uptime_seconds', 'Time since the bot process started.', (), lambda: {(): time.time() - self.started})
+
+    def histogram(self, name: str, help: str, labels: tuple) -> HistogramFamily:
+        family = HistogramFamily(name, help, labels)
+        self.families.append(family)
+        return family
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> CounterFamily:
+        family = CounterFamily(name, help, labels)
+        self.families.append(family)
+        return family
+
+    def gauge(self, name: str, help: str, labels: tuple, collect: Callable[[], dict]) -> GaugeFamily:
+        family = GaugeFamily(name, help, labels, collect)
+        self.families.append(family)
+        return family
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        for family in self.families:
+            lines.extend(family.render())
+
+        return '\n'.join(lines) + '\n'
+
+    def http_trace(self) -> aiohttp.TraceConfig:
+        """An aiohttp trace configuration recording request timings into this registry."""
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            self.http.observe(time.perf_counter() - context.started, params.method, params.url.host, str(params.response.status))
+
+        async def on_request_exception(session, context, params):
+            self.http.observe(time.perf_counter() - context.started, params.method, params.url.host, 'error')
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        return trace
+
+    async def watch_loop_lag(self, interval: float = 0.5) -> None:
+        """Measure how late the event loop wakes from a timed sleep, forever."""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(time.perf_counter() - started - interval, 0.0))
+
+class MetricsServer:
+    """Serves the metrics registry over HTTP, for Prometheus to scrape."""
+    def __init__(self, logger: logging.Logger, metrics: Metrics, host: str, port: int):
+        self.logger = logger
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        self.logger.info('Serving metrics on http://%s:%d/metrics', self.host, self.port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
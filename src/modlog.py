@@ -0,0 +1,179 @@
+# Moderator echo pipeline - batches delete/edit notices into as few messages as possible.
+#
+# Each moderator channel has its own queue of notices. A per-channel drain task waits for
+# either a full batch or the flush interval, then sends the queued notices packed as
+# embeds into as few messages as Discord's size limits allow. While a send is held up by
+# the channel's rate limit, further notices accumulate and go out together in the next one.
+
+import asyncio
+from collections import deque
+import discord
+import logging
+import time
+from typing import Optional
+
+# Discord message limits.
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+MAX_EMBED_TITLE = 256
+MAX_EMBED_DESCRIPTION = 4096
+
+ELLIPSIS = '…'
+
+def truncate(text: str, limit: int) -> str:
+    """Shorten text to fit a length limit, marking the cut with an ellipsis."""
+    if len(text) <= limit:
+        return text
+
+    return text[:limit - len(ELLIPSIS)] + ELLIPSIS
+
+class EchoNotice:
+    """A single queued moderator notice."""
+    __slots__ = ('title', 'description', 'queued')
+
+    def __init__(self, title: str, description: str):
+        self.title = truncate(title, MAX_EMBED_TITLE)
+        self.description = truncate(description, MAX_EMBED_DESCRIPTION)
+        self.queued = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.title) + len(self.description)
+
+    def to_embed(self) -> discord.Embed:
+        return discord.Embed(title=self.title, description=self.description, color=0x0000ff)
+
+class ChannelQueue:
+    """Pending notices for one moderator channel, and the task draining them."""
+    def __init__(self, channel: discord.TextChannel):
+        self.channel = channel
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+class ModEchoPipeline:
+    """Per-channel batching queues for moderator echo notices."""
+    flush_interval: float
+    max_queue: int
+
+    def __init__(self, logger: logging.Logger, flush_interval: float, max_queue: int):
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queues = {}
+        self._closing = False
+
+        # Statistics
+        self.notices_queued = 0
+        self.notices_sent = 0
+        self.notices_dropped = 0
+        self.messages_sent = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def post(self, channel: discord.TextChannel, title: str, description: str) -> None:
+        """Queue a notice for a moderator channel."""
+        q = self._queues.get(channel.id)
+
+        if q is None:
+            q = ChannelQueue(channel)
+            self._queues[channel.id] = q
+
+        # Keep the channel current, in case it has been replaced in the cache.
+        q.channel = channel
+
+        if len(q.pending) >= self.max_queue:
+            q.pending.popleft()
+            self.notices_dropped += 1
+
+        q.pending.append(EchoNotice(title, description))
+        self.notices_queued += 1
+
+        q.wakeup.set()
+
+        if len(q.pending) >= MAX_EMBEDS_PER_MESSAGE:
+            q.full.set()
+
+        if q.task is None or q.task.done():
+            q.task = asyncio.create_task(self._drain(q), name=f'modlog-{channel.id}')
+
+    def _take_batch(self, q: ChannelQueue) -> list:
+        """Take as many notices as fit into one message."""
+        batch = []
+        size = 0
+
+        while q.pending and len(batch) < MAX_EMBEDS_PER_MESSAGE:
+            if size + len(q.pending[0]) > MAX_EMBED_CHARS_PER_MESSAGE:
+                break
+
+            notice = q.pending.popleft()
+            batch.append(notice)
+            size += len(notice)
+
+        return batch
+
+    async def _send(self, q: ChannelQueue, batch: list) -> None:
+        try:
+            await q.channel.send(embeds=[n.to_embed() for n in batch],
+                                 allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException:
+            self.logger.exception('Failed to send %d notices to moderator channel #%s.', len(batch), q.channel)
+            return
+
+        latency = time.monotonic() - batch[0].queued
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.notices_sent += len(batch)
+        self.messages_sent += 1
+
+    async def _drain(self, q: ChannelQueue) -> None:
+        while True:
+            await q.wakeup.wait()
+
+            # Give the batch a chance to fill up, unless it already has.
+            if not q.full.is_set() and not self._closing:
+                try:
+                    await asyncio.wait_for(q.full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            while q.pending:
+                await self._send(q, self._take_batch(q))
+
+            q.wakeup.clear()
+            q.full.clear()
+
+            if self._closing:
+                return
+
+    @property
+    def depth(self) -> int:
+        """Number of notices waiting to be sent, across all channels."""
+        return sum(len(q.pending) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            'channels': len(self._queues),
+            'depth': self.depth,
+            'queued': self.notices_queued,
+            'sent': self.notices_sent,
+            'dropped': self.notices_dropped,
+            'messages': self.messages_sent,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+        }
+
+    async def close(self) -> None:
+        """Flush all pending notices and stop the drain tasks."""
+        self._closing = True
+        tasks = []
+
+        for q in self._queues.values():
+            # Wake each drain task so it flushes immediately and exits.
+            if q.task is not None and not q.task.done():
+                q.wakeup.set()
+                q.full.set()
+                tasks.append(q.task)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,140 @@
+# Event offload - event work handed to a pool of worker processes, away from the gateway loop.
+#
+# The event loop that runs the handlers also has to keep every shard's heartbeat going, so CPU
+# work in a handler (diffing and formatting moderator notices, and any content analysis to
+# come) delays the heartbeats too. The handlers therefore split their work in two: the part
+# that needs the bot's state (its caches, channels and configuration) stays on the loop, and
+# reduces the event to a normalized payload of plain data; the rest is a pure function, here,
+# from that payload to the actions to perform, such as moderator notices to post.
+#
+# For the event types configured to be offloaded, those functions run in a pool of worker
+# processes, to which payloads are sent over the pool's queue and from which the actions come
+# back; for the rest, and if the pool fails, they run inline on the loop, as before.
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+from typing import Optional
+
+from constants import MESSAGE_DELETE, BULK_MESSAGE_DELETE, MESSAGE_EDIT, EVENTS
+import diffing
+
+# Actions: ('modlog', channel ID, title, description) posts a moderator notice.
+MODLOG = 'modlog'
+
+EDIT_FENCE = '```diff\n{}\n```'
+
+def message_delete(p: dict) -> list:
+    content = '\n'.join([p['content']] + list(p['attachments']))
+    return [(MODLOG, p['modchan_id'], f"@{p['author']}, in channel #{p['channel']}, has deleted the message:", content)]
+
+def bulk_message_delete(p: dict) -> list:
+    lines = [f'**@{author}:** {content}' for author, content in p['messages']]
+
+    if p['unknown'] > 0:
+        lines.append(f"*...and {p['unknown']} messages whose content is no longer known.*")
+
+    return [(MODLOG, p['modchan_id'], f"{p['count']} messages were bulk deleted in channel #{p['channel']}:", '\n'.join(lines))]
+
+def message_edit(p: dict) -> list:
+    # The parts come ready-made when the diff engine has already rendered them.
+    parts = p.get('parts')
+
+    if parts is None:
+        parts = diffing.render(p['before'], p['after'], p['mode'], p['limit'] - len(EDIT_FENCE.format('')), p['max_parts'])
+
+    actions = []
+
+    for n, part in enumerate(parts):
+        count = f' ({n + 1}/{len(parts)})' if len(parts) > 1 else ''
+        title = f"@{p['author']}, in channel #{p['channel']}, has edited their message{count}:"
+        actions.append((MODLOG, p['modchan_id'], title, EDIT_FENCE.format(part)))
+
+    return actions
+
+HANDLERS = {
+    MESSAGE_DELETE: message_delete,
+    BULK_MESSAGE_DELETE: bulk_message_delete,
+    MESSAGE_EDIT: message_edit,
+}
+
+def handle(event: str, payload: dict) -> list:
+    """Run the handler for an event type; in a worker process, or inline."""
+    return HANDLERS[event](payload)
+
+class EventOffload:
+    """Runs event handlers in worker processes for the event types configured, inline for the rest."""
+    workers: int
+    events: frozenset
+
+    def __init__(self, logger: logging.Logger, workers: int, events: tuple):
+        self.logger = logger
+        self.workers = workers
+        self.events = frozenset(events) if workers > 0 else frozenset()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        # Bound the payloads queued for the pool; past that, handlers wait their turn.
+        self._slots = asyncio.Semaphore(max(workers, 1) * 4)
+
+        # Statistics
+        self.inline = 0
+        self.offloaded = 0
+        self.failures = 0
+
+    def offloads(self, event: str) -> bool:
+        return event in self.events
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn, rather than fork, since the bot process already has threads running.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+        return self._executor
+
+    def start(self) -> None:
+        """Start the worker processes now, rather than when the first event arrives."""
+        if self.events:
+            pool = self._pool()
+
+            for _ in range(self.workers):
+                pool.submit(os.getpid)
+
+    async def run(self, event: str, payload: dict) -> list:
+        """The actions to perform for an event."""
+        if event not in self.events:
+            self.inline += 1
+            return handle(event, payload)
+
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+
+            try:
+                actions = await loop.run_in_executor(self._pool(), handle, event, payload)
+            except BrokenProcessPool:
+                # A worker died; start a new pool for the next event, and handle this one here.
+                self.logger.error('Event worker pool failed; restarting it.', exc_info=True)
+                self.failures += 1
+                self._executor = None
+                self.inline += 1
+                return handle(event, payload)
+
+            self.offloaded += 1
+            return actions
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'events': sorted(self.events),
+            'inline': self.inline,
+            'offloaded': self.offloaded,
+            'failures': self.failures,
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,55 @@
+# Local counts of 📌 reactions on recently reacted-to messages.
+
+from collections import OrderedDict
+import discord
+from typing import Optional
+
+PIN_EMOJI = '📌'
+
+def count_pins(message: discord.Message) -> int:
+    """Count the 📌 reactions on a fetched message."""
+    reaction = discord.utils.find(lambda r: r.emoji == PIN_EMOJI, message.reactions)
+    return reaction.count if reaction is not None else 0
+
+class PinReactionCounter:
+    """LRU-bounded map of message ID to its current number of 📌 reactions.
+
+    Counts are kept from raw reaction add/remove events, starting from the first one seen,
+    and corrected from the message itself whenever it is fetched."""
+    max_entries: int
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def set(self, message_id: int, count: int) -> None:
+        if self.max_entries <= 0:
+            return
+
+        self._counts[message_id] = count
+        self._counts.move_to_end(message_id)
+
+        while len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+
+    def increment(self, message_id: int) -> Optional[int]:
+        """Count an added reaction; returns the new count, or None if no counts are kept."""
+        if self.max_entries <= 0:
+            return None
+
+        count = self._counts.get(message_id, 0) + 1
+        self.set(message_id, count)
+        return count
+
+    def decrement(self, message_id: int) -> None:
+        """Count a removed reaction, if the message is known."""
+        count = self._counts.get(message_id)
+
+        if count is not None:
+            self._counts[message_id] = max(count - 1, 0)
+
+    def forget(self, message_id: int) -> None:
+        self._counts.pop(message_id, None)
@@ -0,0 +1,81 @@
+# In-memory index of pinned messages, in front of the pin collection.
+
+from collections import OrderedDict
+import pymongo
+
+from database import AsyncCollection
+
+class PinIndex:
+    """Per-guild, LRU-bounded set of the IDs of messages that have already been pinned.
+
+    A hit is authoritative (the message has been pinned). A miss is not, since older entries
+    may have been evicted, so callers must confirm a miss against the pin collection."""
+    max_entries: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._guilds = {}
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._guilds.values())
+
+    def guild_sizes(self) -> dict:
+        """Entries held for each guild."""
+        return {guild_id: len(entries) for guild_id, entries in self._guilds.items()}
+
+    def contains(self, guild_id: int, message_id: int) -> bool:
+        """Is the message known to be pinned? Records a hit or a miss."""
+        entries = self._guilds.get(guild_id)
+
+        if entries is not None and message_id in entries:
+            entries.move_to_end(message_id)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def peek(self, guild_id: int, message_id: int) -> bool:
+        """Is the message known to be pinned? Records nothing, for checking again after a lookup already counted."""
+        entries = self._guilds.get(guild_id)
+        return entries is not None and message_id in entries
+
+    def add(self, guild_id: int, message_id: int) -> None:
+        """Record that a message has been pinned, evicting the least recently used if full."""
+        if self.max_entries <= 0:
+            return
+
+        entries = self._guilds.setdefault(guild_id, OrderedDict())
+        entries[message_id] = None
+        entries.move_to_end(message_id)
+
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    async def warm(self, collection: AsyncCollection, guild_count: int) -> int:
+        """Load the most recent pin records from the pin collection; returns the number loaded."""
+        limit = self.max_entries * max(guild_count, 1)
+
+        if limit <= 0:
+            return 0
+
+        docs = await collection.find({}, {'_id': 0, 'guild_id': 1, 'message_id': 1},
+                                     sort=[('_id', pymongo.DESCENDING)], limit=limit)
+
+        # Oldest first, so the most recent pins end up as the most recently used entries.
+        for doc in reversed(docs):
+            self.add(doc['guild_id'], doc['message_id'])
+
+        return len(docs)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self),
+            'guilds': len(self._guilds),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,40 @@
+# Command prefixes - a cheap test of whether a message could be a command at all.
+#
+# discord.py only finds out whether a message is a command by building a Context for it,
+# which resolves the prefix (through a callable) and scans the start of the content. Almost
+# no chat is a command, so the bot first checks each message against a tuple of prefixes
+# compiled once per distinct guild prefix: a single str.startswith, allocating nothing.
+# Only messages that pass go on to discord.py's command processing.
+
+from typing import Optional
+
+from configuration import GuildConfig
+
+class PrefixTable:
+    """The command prefixes in effect in each guild: mentions of the bot, then the guild's own prefix."""
+    def __init__(self, default: str):
+        self.default = default
+        self._user_id: Optional[int] = None
+        self._compiled = {}
+
+    def __len__(self) -> int:
+        return len(self._compiled)
+
+    def prefixes(self, gc: Optional[GuildConfig], user_id: int) -> tuple:
+        """The prefixes a command may start with, in a guild (or outside any configured one, if gc is None)."""
+        if user_id != self._user_id:
+            self._user_id = user_id
+            self._compiled.clear()
+
+        prefix = gc.command_prefix if gc is not None else self.default
+        compiled = self._compiled.get(prefix)
+
+        if compiled is None:
+            # As commands.when_mentioned_or: either form of mention, followed by a space.
+            compiled = (f'<@{user_id}> ', f'<@!{user_id}> ', prefix)
+            self._compiled[prefix] = compiled
+
+        return compiled
+
+    def may_be_command(self, content: str, gc: Optional[GuildConfig], user_id: int) -> bool:
+        return content.startswith(self.prefixes(gc, user_id))
@@ -0,0 +1,109 @@
+# Live profiling - an on-demand stack sampler, and a watchdog for a blocked event loop.
+#
+# Both run on their own threads and look at the event loop thread from the outside with
+# sys._current_frames(), so they see exactly what the loop is doing without having to
+# instrument it, and keep working while the loop itself is stuck.
+
+import asyncio
+from collections import Counter
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+def _collapse(frame) -> str:
+    """Render a stack as a single collapsed line, outermost frame first."""
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval."""
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+
+    def sample(self, seconds: float) -> Counter:
+        """Sample for the given time, blocking the calling thread; returns collapsed stack counts."""
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+
+            del frame
+            time.sleep(self.interval)
+
+        return stacks
+
+    @staticmethod
+    def render(stacks: Counter) -> str:
+        """Render sampled stacks in the collapsed format read by flamegraph tools."""
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+class LoopWatchdog:
+    """Logs the event loop's stack whenever it goes longer than a threshold without ticking."""
+    threshold: float
+    stalls: int
+
+    def __init__(self, logger: logging.Logger, threshold: float):
+        self.logger = logger
+        self.threshold = threshold
+        self.stalls = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_tick = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _tick(self) -> None:
+        self._last_tick = time.monotonic()
+
+        if not self._stop.is_set():
+            self._loop.call_later(self.threshold / 4, self._tick)
+
+    def start(self) -> None:
+        """Start watching the running event loop; call from the loop's own thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._tick()
+
+        self._thread = threading.Thread(target=self._watch, name='hal-watchdog', daemon=True)
+        self._thread.start()
+
+    def _watch(self) -> None:
+        reported = None
+
+        while not self._stop.wait(self.threshold / 4):
+            last = self._last_tick
+            blocked = time.monotonic() - last
+
+            # Report each stall once, however long it lasts.
+            if blocked < self.threshold or reported == last:
+                continue
+
+            reported = last
+            self.stalls += 1
+
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no stack available)\n'
+            del frame
+
+            self.logger.warning('Event loop blocked for over %.3fs; currently running:\n%s', blocked, stack)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
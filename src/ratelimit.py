@@ -0,0 +1,203 @@
+# Command rate limits - token buckets per user, channel and guild, expired on a timing wheel.
+#
+# A command (or every command, under 'default') can be limited to a number of uses within a
+# number of seconds, separately for each user, channel and/or guild. Each bucket holds up to
+# that many tokens and refills at uses/seconds; a use takes a token from every bucket that
+# applies, or from none if any of them is empty. The first refusal from a bucket is answered;
+# later ones are dropped silently until a use is let through again.
+#
+# A bucket that has been idle long enough to refill is no different from a new one, so it is
+# dropped then: buckets are filed on a timing wheel by when that happens, and each tick
+# expires one slot's worth. The number of buckets is bounded too; beyond it, the least
+# recently used is dropped early.
+
+from collections import OrderedDict
+import math
+import time
+from typing import Optional
+
+from discord.ext import commands
+
+from configuration import CommandLimit
+
+# Timing wheel resolution, and the number of slots (buckets idle for longer than a full turn
+# stay filed until a later turn).
+TICK = 1.0
+WHEEL_SLOTS = 512
+
+# Who a refusal is addressed to, by scope.
+_SUBJECTS = {'user': 'You are', 'channel': 'This channel is', 'guild': 'This server is'}
+
+class RateLimited(commands.CommandError):
+    """A command was refused for going over one of its rate limits."""
+    def __init__(self, command: str, scope: str, retry_after: float, notify: bool):
+        super().__init__(f'{_SUBJECTS[scope]} using `{command}` too often; try again in {math.ceil(retry_after)} seconds.')
+        self.command = command
+        self.scope = scope
+        self.retry_after = retry_after
+        self.notify = notify
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'expires', 'warned')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.expires = None
+        self.warned = False
+
+class CommandLimiter:
+    """Token buckets for the configured command rate limits."""
+    def __init__(self, limits: tuple, max_buckets: int):
+        self.limits = dict(limits)
+        self.default = self.limits.pop('default', ())
+        self.max_buckets = max_buckets
+
+        self._buckets = OrderedDict()
+        self._wheel = [set() for _ in range(WHEEL_SLOTS)]
+        self._tick = int(time.monotonic() / TICK)
+
+        # Statistics
+        self.allowed = 0
+        self.refused = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def check(self, ctx: commands.Context) -> None:
+        """Take a use of the context's command, raising RateLimited if it is over a limit.
+
+        Groups are not limited themselves; the commands run within them are."""
+        if isinstance(ctx.command, commands.Group):
+            return
+
+        subjects = {'user': ctx.author.id, 'channel': ctx.channel.id, 'guild': ctx.guild.id if ctx.guild else None}
+        refusal = self.acquire(ctx.command.qualified_name, subjects)
+
+        if refusal is not None:
+            raise RateLimited(ctx.command.qualified_name, *refusal)
+
+    def acquire(self, command: str, subjects: dict, now: Optional[float] = None) -> Optional[tuple]:
+        """Take a use of a command by the given {scope: id}.
+
+        Returns None if it is allowed, or (scope, seconds until it would be, whether to notify)."""
+        limits = self.limits.get(command, self.default)
+
+        if not limits:
+            return None
+
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+
+        touched = []
+        refusal = None
+
+        for limit in limits:
+            subject = subjects.get(limit.scope)
+
+            if subject is None:
+                continue
+
+            key = (command, limit.scope, subject)
+            bucket = self._bucket(key, limit, now, touched)
+            bucket.tokens = min(limit.uses, bucket.tokens + (now - bucket.updated) * limit.uses / limit.seconds)
+            bucket.updated = now
+            touched.append((key, bucket, limit))
+
+            if bucket.tokens < 1:
+                wait = (1 - bucket.tokens) * limit.seconds / limit.uses
+
+                if refusal is None or wait > refusal[1]:
+                    refusal = (limit.scope, wait, bucket)
+
+        if refusal is None:
+            for _, bucket, _ in touched:
+                bucket.tokens -= 1
+                bucket.warned = False
+
+            self.allowed += 1
+
+        # File each bucket by when it will have refilled.
+        for key, bucket, limit in touched:
+            self._schedule(key, bucket, now + (limit.uses - bucket.tokens) * limit.seconds / limit.uses)
+
+        if refusal is None:
+            return None
+
+        scope, wait, bucket = refusal
+        notify = not bucket.warned
+        bucket.warned = True
+        self.refused += 1
+
+        return scope, wait, notify
+
+    def _bucket(self, key: tuple, limit: CommandLimit, now: float, touched: list) -> _Bucket:
+        bucket = self._buckets.get(key)
+
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+
+        if len(self._buckets) >= self.max_buckets:
+            # The least recently used bucket, other than those this use has already taken from
+            # (which are the most recently used, so this looks no further than a few buckets).
+            keep = {k for k, _, _ in touched}
+            old_key = next((k for k in self._buckets if k not in keep), None)
+
+            if old_key is not None:
+                old = self._buckets.pop(old_key)
+                self._wheel[old.expires % WHEEL_SLOTS].discard(old_key)
+                self.evicted += 1
+
+        bucket = _Bucket(limit.uses, now)
+        self._buckets[key] = bucket
+        return bucket
+
+    def _schedule(self, key: tuple, bucket: _Bucket, at: float) -> None:
+        tick = int(at / TICK) + 1
+
+        if tick != bucket.expires:
+            if bucket.expires is not None:
+                self._wheel[bucket.expires % WHEEL_SLOTS].discard(key)
+
+            self._wheel[tick % WHEEL_SLOTS].add(key)
+            bucket.expires = tick
+
+    def _advance(self, now: float) -> None:
+        """Expire the buckets in each slot the wheel has turned past since it was last advanced."""
+        tick = int(now / TICK)
+
+        if tick <= self._tick:
+            return
+
+        # After a long idle spell, each slot need only be visited once.
+        for t in range(max(self._tick + 1, tick - WHEEL_SLOTS + 1), tick + 1):
+            slot = self._wheel[t % WHEEL_SLOTS]
+            due = []
+
+            for key in slot:
+                bucket = self._buckets.get(key)
+
+                # A bucket no longer held shouldn't be filed, but if one is, its entry goes too.
+                if bucket is None or bucket.expires <= tick:
+                    due.append((key, bucket))
+
+            for key, bucket in due:
+                slot.discard(key)
+
+                if bucket is not None:
+                    del self._buckets[key]
+                    self.expired += 1
+
+        self._tick = tick
+
+    def stats(self) -> dict:
+        return {
+            'buckets': len(self._buckets),
+            'allowed': self.allowed,
+            'refused': self.refused,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
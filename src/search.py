@@ -0,0 +1,100 @@
+# Message search index - full-text search over the messages the bot has seen, for moderators.
+#
+# Each message posted in a configured guild is added, through the write-behind buffer, to a
+# collection with a MongoDB text index; edits replace its indexed content, and deletes mark
+# it deleted rather than removing it, so that moderators can still find what was said. The
+# text index is compound, with the guild ID first, so a search only ever reads the index
+# entries of its own guild. A TTL index drops messages once the retention period is up.
+
+import logging
+
+import discord
+import pymongo
+
+from database import AsyncDatabase, ensure_ttl_index
+from messagestore import StoredMessage
+from writebehind import WriteBehind
+
+COLLECTION = 'message_text'
+
+TEXT_INDEX = [('guild_id', pymongo.ASCENDING), ('content', pymongo.TEXT)]
+SCORE = {'$meta': 'textScore'}
+
+def prepare(db: pymongo.database.Database, retention_days: int) -> None:
+    """Create the search collection's indexes; blocking, called from prepare_database."""
+    messages = db[COLLECTION]
+
+    messages.create_index([('guild_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)], unique=True)
+    messages.create_index(TEXT_INDEX)
+    ensure_ttl_index(db, COLLECTION, 'time', retention_days * 86400)
+
+def jump_url(result: dict) -> str:
+    return f"https://discord.com/channels/{result['guild_id']}/{result['channel_id']}/{result['message_id']}"
+
+class MessageSearch:
+    """Keeps the search index up to date with messages, edits and deletes, and searches it."""
+    def __init__(self, logger: logging.Logger, db: AsyncDatabase, writes: WriteBehind, enabled: bool, timeout: float):
+        self.logger = logger
+        self.db = db
+        self.writes = writes
+        self.enabled = enabled
+        self.timeout = timeout
+
+        # Statistics
+        self.indexed = 0
+        self.edited = 0
+        self.deleted = 0
+        self.searches = 0
+
+    def index(self, guild_id: int, record: StoredMessage) -> None:
+        """Add a newly posted message."""
+        if not self.enabled or not record.content:
+            return
+
+        self.writes.upsert(COLLECTION, {'guild_id': guild_id, 'message_id': record.id}, {'$set': {
+            'channel_id': record.channel_id,
+            'author_id': record.author_id,
+            'author': record.author,
+            'time': discord.utils.snowflake_time(record.id),
+            'content': record.content,
+        }})
+        self.indexed += 1
+
+    def edit(self, guild_id: int, message_id: int, content: str) -> None:
+        """Replace the indexed content of an edited message (if it was indexed)."""
+        if not self.enabled:
+            return
+
+        self.writes.update(COLLECTION, {'guild_id': guild_id, 'message_id': message_id},
+                           {'$set': {'content': content, 'edited': True}})
+        self.edited += 1
+
+    def delete(self, guild_id: int, message_id: int) -> None:
+        """Mark a message deleted; it can still be found."""
+        if not self.enabled:
+            return
+
+        self.writes.update(COLLECTION, {'guild_id': guild_id, 'message_id': message_id}, {'$set': {'deleted': True}})
+        self.deleted += 1
+
+    async def search(self, guild_id: int, terms: str, limit: int) -> list:
+        """The best matches for terms, in MongoDB $text search syntax, best first.
+
+        Raises pymongo.errors.ExecutionTimeout if the search takes longer than the timeout."""
+        self.searches += 1
+
+        return await self.db[COLLECTION].find({'guild_id': guild_id, '$text': {'$search': terms}},
+                                              {'score': SCORE, 'channel_id': 1, 'message_id': 1, 'guild_id': 1,
+                                               'author': 1, 'time': 1, 'content': 1, 'edited': 1, 'deleted': 1},
+                                              sort=[('score', SCORE), ('message_id', pymongo.DESCENDING)],
+                                              limit=limit,
+                                              max_time_ms=int(self.timeout * 1000))
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'indexed': self.indexed,
+            'edited': self.edited,
+            'deleted': self.deleted,
+            'searches': self.searches,
+        }
@@ -0,0 +1,256 @@
+# Write-behind buffer - batches inserts and upserts into one bulk_write per collection.
+#
+# Records the bot writes but doesn't read back straight away (such as pin records) are queued
+# per collection rather than written a round-trip at a time. A per-collection drain task waits
+# for a full batch or the flush interval, then writes the queued operations, in the order
+# they were queued, with one ordered bulk_write. Every operation is an upsert keyed on the
+# fields identifying its record, so a batch can be written again after a failure, or meet a
+# record another cluster process has already written, without creating duplicates or
+# tripping a unique index. flush() writes out a collection's queue before it is read back,
+# and close() writes out whatever is still queued.
+
+import asyncio
+from collections import deque
+import logging
+from typing import Optional
+
+import pymongo
+
+from database import AsyncDatabase
+
+# MongoDB's duplicate key error; an upsert racing another for the same key can meet it, and
+# succeeds (as an update) when tried again.
+DUPLICATE_KEY = 11000
+
+# Seconds to wait before trying a failed batch again, doubling with each further failure.
+RETRY_BACKOFF = 0.5
+RETRY_MAX_DELAY = 30.0
+
+class CollectionQueue:
+    """Pending writes for one collection, and the task draining them."""
+    def __init__(self, name: str):
+        self.name = name
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+        # Futures waiting for the queue to be written out.
+        self.flushing = []
+
+        # The operation last put back to retry after a duplicate key error.
+        self.retrying: Optional[pymongo.UpdateOne] = None
+
+        # Failed attempts in a row to write the queue out.
+        self.failures = 0
+
+class WriteBehind:
+    """Per-collection write-behind queues in front of the database."""
+    flush_interval: float
+    max_batch: int
+    max_queue: int
+
+    def __init__(self, logger: logging.Logger, db: AsyncDatabase, flush_interval: float, max_batch: int, max_queue: int):
+        self.logger = logger
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._queues = {}
+        self._closing = asyncio.Event()
+
+        # Statistics
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def insert(self, collection: str, document: dict, key: tuple) -> None:
+        """Queue a document to be inserted, unless a record with the same key fields already exists."""
+        self._queue(collection, pymongo.UpdateOne({k: document[k] for k in key}, {'$setOnInsert': document}, upsert=True))
+
+    def upsert(self, collection: str, filter: dict, update: dict) -> None:
+        """Queue an update of the record matching filter, creating it if there is none."""
+        self._queue(collection, pymongo.UpdateOne(filter, update, upsert=True))
+
+    def update(self, collection: str, filter: dict, update: dict) -> None:
+        """Queue an update of the record matching filter, if there is one."""
+        self._queue(collection, pymongo.UpdateOne(filter, update))
+
+    def _queue(self, collection: str, operation: pymongo.UpdateOne) -> None:
+        q = self._queues.get(collection)
+
+        if q is None:
+            q = CollectionQueue(collection)
+            self._queues[collection] = q
+
+        if len(q.pending) >= self.max_queue:
+            q.pending.popleft()
+            self.dropped += 1
+
+        q.pending.append(operation)
+        self.queued += 1
+
+        q.wakeup.set()
+
+        if len(q.pending) >= self.max_batch:
+            q.full.set()
+
+        if q.task is None or q.task.done():
+            q.task = asyncio.create_task(self._drain(q), name=f'writebehind-{collection}')
+
+    async def _write(self, q: CollectionQueue, batch: list) -> bool:
+        """Write a batch; anything left unwritten that is worth retrying goes back on the queue.
+
+        Returns whether the whole batch was dealt with."""
+        try:
+            await self.db[q.name].bulk_write(batch, ordered=True)
+        except pymongo.errors.BulkWriteError as e:
+            if not e.details.get('writeErrors'):
+                # Only the write concern wasn't met: every operation was applied, if not yet as
+                # durably as asked, and writing them again would meet the same concern.
+                self.logger.warning('Wrote %d records to %s without meeting the write concern: %s',
+                                    len(batch), q.name, e.details.get('writeConcernErrors'))
+                self.written += len(batch)
+                self.batches += 1
+                return True
+
+            # Being ordered, everything before the first error was written, and nothing after it.
+            error = e.details['writeErrors'][0]
+            index = error['index']
+            self.written += index
+            self.batches += 1
+
+            if error.get('code') == DUPLICATE_KEY and batch[index] is not q.retrying:
+                q.retrying = batch[index]
+                rest = batch[index:]
+                self.retried += 1
+            else:
+                self.logger.error('Dropped a write to %s: %s', q.name, error.get('errmsg'))
+                rest = batch[index + 1:]
+                self.failed += 1
+
+            q.pending.extendleft(reversed(rest))
+            return True
+        except pymongo.errors.PyMongoError:
+            self.logger.warning('Failed to write %d records to %s; will try again.', len(batch), q.name, exc_info=True)
+            q.pending.extendleft(reversed(batch))
+            self.retried += 1
+            return False
+
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    async def _drain(self, q: CollectionQueue) -> None:
+        while True:
+            await q.wakeup.wait()
+
+            # Give the batch a chance to fill up, unless it already has.
+            if not q.full.is_set() and not self._closing.is_set():
+                try:
+                    await asyncio.wait_for(q.full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            ok = True
+
+            while q.pending and ok:
+                batch = [q.pending.popleft() for _ in range(min(self.max_batch, len(q.pending)))]
+
+                try:
+                    ok = await self._write(q, batch)
+                except Exception:
+                    # Whatever went wrong, keep the batch, and the task, for another try, and
+                    # don't leave flush() waiting.
+                    self.logger.exception('Failed to write %d records to %s; will try again.', len(batch), q.name)
+                    q.pending.extendleft(reversed(batch))
+                    self.retried += 1
+                    ok = False
+
+            q.full.clear()
+
+            for waiter in q.flushing:
+                if not waiter.done():
+                    waiter.set_result(ok)
+
+            q.flushing.clear()
+
+            if self._closing.is_set():
+                if q.pending:
+                    self.logger.error('Lost %d writes to %s while shutting down.', len(q.pending), q.name)
+                    self.failed += len(q.pending)
+                    q.pending.clear()
+
+                return
+
+            if ok:
+                q.failures = 0
+                q.wakeup.clear()
+                continue
+
+            # After a failure, leave the wakeup set to try again, but only after a backoff (which
+            # shutting down cuts short), since the flush interval may be too short to wait on.
+            q.failures += 1
+
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=min(RETRY_BACKOFF * 2 ** (q.failures - 1), RETRY_MAX_DELAY))
+            except asyncio.TimeoutError:
+                pass
+
+    async def flush(self, *collections: str) -> bool:
+        """Write out what is queued for the collections now, for a read to see it.
+
+        Returns whether it was all written; if not, it stays queued, to be tried again."""
+        waiters = []
+
+        for name in collections:
+            q = self._queues.get(name)
+
+            if q is None or q.task is None or q.task.done():
+                continue
+
+            waiter = asyncio.get_running_loop().create_future()
+            q.flushing.append(waiter)
+            waiters.append(waiter)
+
+            # Don't wait for the batch to fill up.
+            q.full.set()
+            q.wakeup.set()
+
+        results = await asyncio.gather(*waiters)
+        return all(results)
+
+    @property
+    def depth(self) -> int:
+        """Number of writes waiting, across all collections."""
+        return sum(len(q.pending) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            'collections': len(self._queues),
+            'depth': self.depth,
+            'queued': self.queued,
+            'written': self.written,
+            'batches': self.batches,
+            'retried': self.retried,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+    async def close(self) -> None:
+        """Write out everything queued and stop the drain tasks."""
+        self._closing.set()
+        tasks = []
+
+        for q in self._queues.values():
+            # Wake each drain task so it flushes immediately and exits.
+            if q.task is not None and not q.task.done():
+                q.wakeup.set()
+                q.full.set()
+                tasks.append(q.task)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)